@@ -0,0 +1,42 @@
+"""Scaling of shadowed rule detection over adjacent IP prefixes.
+
+Run with:
+
+```
+python benchmarks/bench_analysis.py
+```
+"""
+
+from __future__ import annotations
+
+import time
+
+from uniproxy.analysis import find_shadowed_rules
+from uniproxy.uniproxy.rules import IPCidrRule, UniproxyRule
+
+
+def make_rules(n: int) -> list[UniproxyRule]:
+    """`n` adjacent /24 prefixes, each also shadowing a /25, then their /8."""
+    rules: list[UniproxyRule] = []
+    for i in range(n):
+        prefix = f"10.{i >> 8 & 255}.{i & 255}"
+        rules.append(IPCidrRule(matcher=f"{prefix}.0/24", policy="Proxy"))
+        rules.append(IPCidrRule(matcher=f"{prefix}.128/25", policy="DIRECT"))
+    rules.append(IPCidrRule(matcher="10.0.0.0/8", policy="DIRECT"))
+    return rules
+
+
+def main() -> None:
+    for n in (5_000, 10_000, 20_000, 40_000, 65_536):
+        rules = make_rules(n)
+        start = time.perf_counter()
+        report = find_shadowed_rules(rules)
+        elapsed = time.perf_counter() - start
+        print(
+            f"{len(rules)} rules: {elapsed * 1000:.0f} ms,"
+            f" {len(report.entries)} shadowed"
+        )
+
+
+if __name__ == "__main__":
+    main()
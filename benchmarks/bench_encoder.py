@@ -0,0 +1,83 @@
+"""Dict-based versus streaming JSON output of a large sing-box configuration.
+
+Run with:
+
+```
+python benchmarks/bench_encoder.py
+```
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import time
+import tracemalloc
+
+from xattrs import asdict
+from xattrs.filters import exclude_if_none
+
+from uniproxy.singbox import Route, SingBoxConfig
+from uniproxy.singbox.encoder import dump
+from uniproxy.singbox.inbounds import HTTPInbound
+from uniproxy.singbox.outbounds import ShadowsocksOutbound
+from uniproxy.singbox.route_rules import RouteRule
+
+N_RULES = 100_000
+N_OUTBOUNDS = 5_000
+
+
+def make_config() -> SingBoxConfig:
+    outbounds = [
+        ShadowsocksOutbound(
+            tag=f"Proxy {i}",
+            server=f"s{i}.example.com",
+            server_port=8388,
+            method="aes-128-gcm",
+            password="password",
+        )
+        for i in range(N_OUTBOUNDS)
+    ]
+    rules = [
+        RouteRule(
+            outbound=f"Proxy {i % N_OUTBOUNDS}",
+            domain_suffix=[f"site{i}.com", f"cdn{i}.net"],
+            port=[443],
+        )
+        for i in range(N_RULES)
+    ]
+    return SingBoxConfig(
+        inbounds=[HTTPInbound(tag="http-in", listen="127.0.0.1", listen_port=8080)],
+        outbounds=outbounds,
+        route=Route(rules=rules, final="Proxy 0"),
+    )
+
+
+def measure(func) -> tuple[float, float]:
+    tracemalloc.start()
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak / 2**20
+
+
+def main() -> None:
+    config = make_config()
+
+    def dict_based() -> None:
+        with open(os.devnull, "w") as f:
+            f.write(json.dumps(asdict(config, filter=exclude_if_none), indent=2))
+
+    def streaming() -> None:
+        with open(os.devnull, "w") as f:
+            dump(config, f, indent=2)
+
+    for name, func in (("dict-based", dict_based), ("streaming", streaming)):
+        elapsed, peak = measure(func)
+        print(f"{name}: {elapsed * 1000:.0f} ms, peak {peak:.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
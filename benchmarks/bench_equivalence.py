@@ -0,0 +1,38 @@
+"""Differential check of the Surge, Clash and sing-box converters.
+
+Run with:
+
+```
+python benchmarks/bench_equivalence.py
+```
+"""
+
+from __future__ import annotations
+
+import random
+import time
+
+from bench_matcher import make_rules
+
+from uniproxy.equivalence import check_equivalence, synthetic_requests
+
+N_REQUESTS = 1_000_000
+
+
+def main() -> None:
+    random.seed(0)
+    rules = make_rules(20_000)
+    start = time.perf_counter()
+    requests = synthetic_requests(rules, N_REQUESTS)
+    print(f"generate {len(requests)} requests: {time.perf_counter() - start:.2f}s")
+
+    start = time.perf_counter()
+    report = check_equivalence(rules, requests)
+    elapsed = time.perf_counter() - start
+    print(f"check {report.unique} unique requests: {elapsed:.2f}s")
+    print(f"disagreeing: {report.disagreeing}, by backend: {report.by_backend}")
+    print(f"skipped rules: {report.skipped}, errors: {report.errors}")
+
+
+if __name__ == "__main__":
+    main()
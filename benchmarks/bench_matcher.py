@@ -0,0 +1,87 @@
+"""Lookups per second of the offline rule matcher.
+
+Run with:
+
+```
+python benchmarks/bench_matcher.py
+```
+"""
+
+from __future__ import annotations
+
+import random
+import time
+
+from uniproxy.matcher import RuleMatcher
+from uniproxy.uniproxy.rules import (
+    DestPortRule,
+    DomainKeywordRule,
+    DomainRule,
+    DomainSuffixRule,
+    FinalRule,
+    IPCidrRule,
+    ProcessNameRule,
+    UniproxyRule,
+)
+
+N_RULES = 50_000
+N_LOOKUPS = 1_000_000
+N_HOSTS = 20_000
+
+
+def make_rules(n: int = N_RULES) -> list[UniproxyRule]:
+    rules: list[UniproxyRule] = []
+    for i in range(n):
+        policy = random.choice(["Proxy", "DIRECT", "REJECT"])
+        match i % 5:
+            case 0:
+                rules.append(DomainRule(matcher=f"www.site{i}.com", policy=policy))
+            case 1:
+                rules.append(DomainSuffixRule(matcher=f"site{i}.net", policy=policy))
+            case 2:
+                rules.append(DomainKeywordRule(matcher=f"kw{i}x", policy=policy))
+            case 3:
+                rules.append(
+                    IPCidrRule(
+                        matcher=f"10.{i % 256}.{i // 256 % 256}.0/24", policy=policy
+                    )
+                )
+            case _:
+                rules.append(ProcessNameRule(matcher=f"app{i}", policy=policy))
+    rules.append(DestPortRule(matcher="8000-8999", policy="DIRECT"))
+    rules.append(FinalRule(policy="Proxy"))
+    return rules
+
+
+def make_requests(n: int = N_LOOKUPS) -> list[dict]:
+    hosts = [
+        random.choice([f"www.site{i}.com", f"a.b.site{i}.net", f"kw{i}x.org"])
+        for i in (random.randrange(N_RULES) for _ in range(N_HOSTS))
+    ]
+    ips = [f"10.{random.randrange(256)}.{random.randrange(256)}.1" for _ in range(256)]
+    return [
+        {"domain": random.choice(hosts), "port": 443}
+        if i % 4
+        else {"ip": random.choice(ips), "port": random.randrange(1, 65536)}
+        for i in range(n)
+    ]
+
+
+def main() -> None:
+    random.seed(0)
+    rules = make_rules()
+    start = time.perf_counter()
+    matcher = RuleMatcher(rules)
+    print(f"compile {len(rules)} rules: {time.perf_counter() - start:.2f}s")
+
+    requests = make_requests()
+    match = matcher.match
+    start = time.perf_counter()
+    for request in requests:
+        match(**request)
+    elapsed = time.perf_counter() - start
+    print(f"{len(requests)} lookups: {elapsed:.2f}s, {len(requests) / elapsed:,.0f}/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Throughput of SIP008 JSON and Clash YAML ingestion.
+
+Run with:
+
+```
+python benchmarks/bench_readers.py
+```
+"""
+
+from __future__ import annotations
+
+import io
+import json
+import time
+
+from ruamel.yaml import YAML
+
+from uniproxy.readers import protocol_from_clash, protocol_from_sip008
+from uniproxy.uri import iter_protocols
+
+N_NODES = 10_000
+
+CLASH_ITEM = """\
+  - name: node-{i}
+    type: {type}
+    server: node-{i}.example.com
+    port: {port}
+    password: secret-{i}
+    cipher: aes-256-gcm
+    sni: node-{i}.example.com
+    udp: true
+"""
+
+
+def make_clash(n: int = N_NODES) -> str:
+    items = (
+        CLASH_ITEM.format(i=i, type=("ss", "trojan")[i % 2], port=1024 + i)
+        for i in range(n)
+    )
+    return "mixed-port: 7890\nproxies:\n" + "".join(items)
+
+
+def make_sip008(n: int = N_NODES) -> str:
+    servers = [
+        {
+            "remarks": f"node-{i}",
+            "server": f"node-{i}.example.com",
+            "server_port": 1024 + i,
+            "password": f"secret-{i}",
+            "method": "aes-256-gcm",
+        }
+        for i in range(n)
+    ]
+    return json.dumps({"version": 1, "servers": servers}, indent=2)
+
+
+def timed(func) -> float:
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    clash = make_clash()
+    full = timed(
+        lambda: [
+            protocol_from_clash(p) for p in YAML(typ="safe").load(clash)["proxies"]
+        ]
+    )
+    streamed = timed(lambda: list(iter_protocols(io.StringIO(clash))))
+    print(
+        f"clash {N_NODES} proxies: full tree {full * 1000:.0f} ms,"
+        f" iter_protocols {streamed * 1000:.0f} ms ({full / streamed:.1f}x)"
+    )
+
+    sip008 = make_sip008()
+    full = timed(
+        lambda: [protocol_from_sip008(s) for s in json.loads(sip008)["servers"]]
+    )
+    streamed = timed(lambda: list(iter_protocols(io.StringIO(sip008))))
+    print(
+        f"sip008 {N_NODES} servers: json.loads {full * 1000:.0f} ms,"
+        f" iter_protocols {streamed * 1000:.0f} ms"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""Per-rule versus batch conversion of uniproxy rules.
+
+Run with:
+
+```
+python benchmarks/bench_rules.py
+```
+"""
+
+from __future__ import annotations
+
+import random
+import time
+
+from uniproxy.clash import rules as clash
+from uniproxy.surge import rules as surge
+from uniproxy.to.singbox.uniproxy import rules as singbox
+from uniproxy.uniproxy.protocols import HttpProtocol
+from uniproxy.uniproxy.rules import (
+    DomainKeywordRule,
+    DomainRule,
+    DomainSuffixGroupRule,
+    DomainSuffixRule,
+    IPCidrGroupRule,
+    IPCidrRule,
+    ProcessNameRule,
+    UniproxyRule,
+)
+
+N_RULES = 250_000
+
+
+def make_rules(n: int = N_RULES) -> list[UniproxyRule]:
+    policies = [
+        HttpProtocol(name=f"Proxy {i}", server="example.com", port=8080)
+        for i in range(4)
+    ] + ["DIRECT", "REJECT"]
+    rules: list[UniproxyRule] = []
+    for i in range(n):
+        policy = random.choice(policies)
+        match i % 10:
+            case 0:
+                rules.append(DomainRule(matcher=f"www.site{i}.com", policy=policy))
+            case 1:
+                rules.append(DomainKeywordRule(matcher=f"kw{i}", policy=policy))
+            case 2:
+                rules.append(IPCidrRule(matcher=f"10.{i % 256}.0.0/16", policy=policy))
+            case 3:
+                rules.append(ProcessNameRule(matcher=f"app{i}", policy=policy))
+            case 4:
+                rules.append(
+                    DomainSuffixGroupRule(
+                        matcher=[f"g{i}-{j}.com" for j in range(4)], policy=policy
+                    )
+                )
+            case 5:
+                rules.append(
+                    IPCidrGroupRule(
+                        matcher=[f"172.16.{j}.0/24" for j in range(4)],
+                        policy=policy,
+                        no_resolve=True,
+                    )
+                )
+            case _:
+                rules.append(DomainSuffixRule(matcher=f"site{i}.com", policy=policy))
+    return rules
+
+
+def best_of(func, rounds: int = 3) -> float:
+    best = float("inf")
+    for _ in range(rounds):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main() -> None:
+    random.seed(0)
+    rules = make_rules()
+    cases = [
+        (
+            "surge",
+            lambda: [r for rule in rules for r in surge.make_rules_from_uniproxy(rule)],
+            lambda: surge.make_rules_from_uniproxy_many(rules),
+        ),
+        (
+            "clash",
+            lambda: [r for rule in rules for r in clash.make_rules_from_uniproxy(rule)],
+            lambda: clash.make_rules_from_uniproxy_many(rules),
+        ),
+        (
+            "sing-box",
+            lambda: singbox.unify_mixed_route_rules(rules),
+            lambda: singbox.route_rules_from_uniproxy_many(rules),
+        ),
+    ]
+    for name, per_rule, batch in cases:
+        before, after = best_of(per_rule), best_of(batch)
+        print(
+            f"{name}: {N_RULES} rules, per rule {before * 1000:.0f} ms,"
+            f" batch {after * 1000:.0f} ms ({before / after:.2f}x)"
+        )
+
+
+if __name__ == "__main__":
+    main()
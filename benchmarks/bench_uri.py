@@ -0,0 +1,123 @@
+"""Throughput of subscription parsing.
+
+Run with:
+
+```
+python benchmarks/bench_uri.py
+```
+"""
+
+from __future__ import annotations
+
+import base64
+import random
+import string
+import time
+from urllib.parse import parse_qs, urlparse
+
+from uniproxy.uri import _parse_query, _split_uri, parse_subscription, parse_trojan_uri
+
+N_LINES = 20_000
+
+
+def _random_word(k: int) -> str:
+    return "".join(random.choices(string.ascii_lowercase, k=k))
+
+
+def make_subscription(n: int = N_LINES) -> bytes:
+    lines = []
+    for i in range(n):
+        host = f"{_random_word(8)}.example.com"
+        port = random.randint(1024, 65535)
+        match i % 3:
+            case 0:
+                userinfo = "/"
+                while "/" in userinfo or "+" in userinfo:
+                    userinfo = base64.b64encode(
+                        f"aes-256-gcm:{_random_word(16)}".encode()
+                    ).decode()
+                lines.append(f"ss://{userinfo.rstrip('=')}@{host}:{port}#node-{i}")
+            case 1:
+                lines.append(
+                    f"trojan://{_random_word(16)}@{host}:{port}"
+                    f"?sni={host}&allowInsecure=0&udp=1#node-{i}"
+                )
+            case _:
+                lines.append(
+                    f"anytls://{_random_word(16)}@{host}:{port}/"
+                    f"?sni={host}&insecure=1#node-{i}"
+                )
+    return base64.b64encode("\n".join(lines).encode())
+
+
+def bench(blob: bytes, rounds: int = 5, **kwargs) -> float:
+    best = float("inf")
+    for _ in range(rounds):
+        start = time.perf_counter()
+        _protocols, errors = parse_subscription(blob, **kwargs)
+        best = min(best, time.perf_counter() - start)
+        assert not errors, errors[:3]
+    return best
+
+
+def _urllib_split(uri: str) -> object:
+    result = urlparse(uri, allow_fragments=True)
+    return (
+        result.username,
+        result.password,
+        result.hostname,
+        result.port,
+        parse_qs(result.query),
+        result.fragment,
+    )
+
+
+def _fast_split(uri: str) -> object:
+    username, password, hostname, port, query, fragment, _ = _split_uri(uri, "trojan")
+    return (username, password, hostname, port, _parse_query(query), fragment)
+
+
+def bench_func(func, uris: list[str], rounds: int = 5) -> float:
+    best = float("inf")
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for uri in uris:
+            func(uri)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main() -> None:
+    random.seed(0)
+    blob = make_subscription()
+    elapsed = bench(blob)
+    print(
+        f"parse_subscription: {N_LINES} lines in {elapsed * 1000:.1f} ms"
+        f" ({N_LINES / elapsed:,.0f} nodes/s)"
+    )
+    elapsed = bench(blob, max_workers=None, parallel_threshold=0)
+    print(
+        f"parse_subscription (process pool): {N_LINES} lines in"
+        f" {elapsed * 1000:.1f} ms ({N_LINES / elapsed:,.0f} nodes/s)"
+    )
+
+    uris = [
+        line
+        for line in base64.b64decode(blob).decode().splitlines()
+        if line.startswith("trojan://")
+    ]
+    baseline = bench_func(_urllib_split, uris)
+    fast = bench_func(_fast_split, uris)
+    print(
+        f"split {len(uris)} trojan URIs: urlparse+parse_qs {baseline * 1000:.1f} ms,"
+        f" _split_uri+_parse_query {fast * 1000:.1f} ms ({baseline / fast:.1f}x)"
+    )
+    elapsed = bench_func(parse_trojan_uri, uris)
+    print(
+        f"parse_trojan_uri: {len(uris)} URIs in {elapsed * 1000:.1f} ms"
+        f" ({len(uris) / elapsed:,.0f} URIs/s)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,463 @@
+from __future__ import annotations
+
+from typing import Any, Iterable, Sequence
+
+from bisect import bisect_left, bisect_right
+from ipaddress import IPv4Network, ip_network
+
+from attrs import evolve, fields, frozen
+
+from uniproxy.optimize import DomainTrie
+from uniproxy.singbox.route_rules import RouteOptionFieldsMixin
+from uniproxy.singbox.route_rules import Rule as SingBoxRule
+from uniproxy.uniproxy.base import BaseBasicRule, BaseGroupRule
+from uniproxy.uniproxy.rules import NoResoleMixin, UniproxyRule
+
+type AnyRule = UniproxyRule | SingBoxRule
+
+MAX_SHADOWED_BY = 16
+"""Earlier rules reported per shadowed entry at most."""
+
+_PORT_TYPES = {"dest-port": "dest-port", "src-port": "src-port", "in-port": "in-port"}
+
+_SINGBOX_FIELDS = {
+    "domain": ("address", "domain"),
+    "domain_suffix": ("address", "suffix"),
+    "domain_keyword": ("address", "keyword"),
+    "ip_cidr": ("address", "cidr"),
+    "source_ip_cidr": ("src-ip", "cidr"),
+    "port": ("dest-port", "port"),
+    "port_range": ("dest-port", "port"),
+    "source_port": ("src-port", "port"),
+    "source_port_range": ("src-port", "port"),
+    "process_name": ("process", "exact"),
+}
+"""Analyzed fields of sing-box rules, with their dimension and entry kind."""
+
+_SINGBOX_OPAQUE_ENTRIES = {
+    "domain_regex": "address",
+    "ip_is_private": "address",
+    "source_ip_is_private": "src-ip",
+}
+"""Fields adding entries to a dimension which are never considered covered."""
+
+_SINGBOX_OPAQUE_RULE = ("rule_set", "invert")
+"""Fields making a whole sing-box rule impossible to analyze."""
+
+_SINGBOX_ACTION_FIELDS = ("outbound", "action", "method", "no_drop")
+"""Fields describing what to do, not what to match."""
+
+
+@frozen
+class ShadowedEntry:
+    """A matcher of a rule which never matches, because earlier rules win."""
+
+    index: int
+    """Index of the rule in the analyzed sequence."""
+    field: str
+    """Attribute of the rule holding the matcher, e.g. `matcher` or `domain_suffix`."""
+    matcher: str
+    shadowed_by: tuple[int, ...]
+    """Indices of the earlier rules which together match everything it matches,
+    at most `MAX_SHADOWED_BY` of them."""
+
+
+@frozen
+class ShadowReport:
+    """Result of `find_shadowed_rules`."""
+
+    total: int
+    """Number of analyzed rules."""
+    dead: tuple[int, ...]
+    """Indices of rules which can never match."""
+    entries: tuple[ShadowedEntry, ...]
+    """Every shadowed matcher, including those of dead rules."""
+
+    def to_dict(self) -> dict[str, Any]:
+        """Plain representation, e.g. for `json.dumps`."""
+        return {
+            "total": self.total,
+            "dead": list(self.dead),
+            "entries": [
+                {
+                    "index": e.index,
+                    "field": e.field,
+                    "matcher": e.matcher,
+                    "shadowed_by": list(e.shadowed_by),
+                }
+                for e in self.entries
+            ],
+        }
+
+
+class _IntervalSet:
+    """Union of closed integer intervals, remembering which rules added them.
+
+    The union is kept twice, as sorted and merged blocks to decide coverage
+    with a binary search, and as sorted, disjoint spans `(start, end, index)`
+    each owned by the earliest rule covering it. Adding an interval only
+    inserts the gaps it fills, so nothing is copied on merges. Adjacent
+    intervals are merged, `1.0.0.0/24` and `1.0.1.0/24` together cover
+    `1.0.0.0/23`.
+    """
+
+    def __init__(self) -> None:
+        self._block_starts: list[int] = []
+        self._block_ends: list[int] = []
+        self._starts: list[int] = []
+        self._ends: list[int] = []
+        self._owners: list[int] = []
+
+    def _covers(self, lo: int, hi: int) -> bool:
+        i = bisect_right(self._block_starts, lo) - 1
+        return i >= 0 and self._block_ends[i] >= hi
+
+    def covering(self, lo: int, hi: int) -> tuple[int, ...] | None:
+        """Rules covering `[lo, hi]`, the first `MAX_SHADOWED_BY` by address."""
+        if not self._covers(lo, hi):
+            return None
+        starts, ends, owners = self._starts, self._ends, self._owners
+        first = bisect_left(ends, lo)
+        last = min(first + MAX_SHADOWED_BY, bisect_right(starts, hi, lo=first))
+        return tuple(sorted(set(owners[first:last])))
+
+    def add(self, lo: int, hi: int, index: int) -> None:
+        if self._covers(lo, hi):
+            return
+        # merged blocks overlapping or adjacent to [lo, hi]
+        left = bisect_left(self._block_ends, lo - 1)
+        right = bisect_right(self._block_starts, hi + 1)
+        if left < right:
+            block = [min(lo, self._block_starts[left])]
+            block_end = [max(hi, self._block_ends[right - 1])]
+        else:
+            block, block_end = [lo], [hi]
+        self._block_starts[left:right] = block
+        self._block_ends[left:right] = block_end
+
+        # owned spans, filling the gaps between the overlapped ones
+        starts, ends, owners = self._starts, self._ends, self._owners
+        left = bisect_left(ends, lo)
+        right = bisect_right(starts, hi)
+        spans: list[tuple[int, int, int]] = []
+        pos = lo
+        for i in range(left, right):
+            if starts[i] > pos:
+                spans.append((pos, starts[i] - 1, index))
+            spans.append((starts[i], ends[i], owners[i]))
+            pos = ends[i] + 1
+        if pos <= hi:
+            spans.append((pos, hi, index))
+        starts[left:right] = [span[0] for span in spans]
+        ends[left:right] = [span[1] for span in spans]
+        owners[left:right] = [span[2] for span in spans]
+
+
+def _port_range(value: Any) -> tuple[int, int]:
+    if isinstance(value, int):
+        return value, value
+    value = str(value).strip()
+    for sep in (":", "-"):
+        if sep in value:
+            lo, _, hi = value.partition(sep)
+            return int(lo or 0), int(hi or 65535)
+    return int(value), int(value)
+
+
+def _cidr_range(value: str) -> tuple[int, int, int]:
+    network = ip_network(value.strip(), strict=False)
+    family = 4 if isinstance(network, IPv4Network) else 6
+    return family, int(network.network_address), int(network.broadcast_address)
+
+
+@frozen
+class _Entry:
+    field: str
+    matcher: Any
+    kind: str
+    """`domain`, `suffix`, `keyword`, `cidr`, `port`, `exact` or `opaque`."""
+
+
+@frozen
+class _Clause:
+    """Normalized rule: entries by dimension, ORed within and ANDed across."""
+
+    dims: dict[str, list[_Entry]]
+    unconditional: bool
+    """Whether the rule matches all requests of its only dimension's entries."""
+    no_resolve: bool = True
+
+
+class _Coverage:
+    """Everything matched by the unconditional rules seen so far."""
+
+    def __init__(self) -> None:
+        self.domains = DomainTrie()
+        self.keywords: dict[str, int] = {}
+        self.keyword_lengths: set[int] = set()
+        # rules which resolve domains cover more than those which do not, so
+        # they are tracked apart, keyed by `no_resolve`
+        self.ips: dict[tuple[str, int, bool], _IntervalSet] = {}
+        self.ports: dict[str, _IntervalSet] = {}
+        self.exact: dict[tuple[str, str, bool], int] = {}
+        self.final: int | None = None
+
+    def _keyword_in(self, name: str) -> int | None:
+        found: int | None = None
+        for start in range(len(name)):
+            for length in self.keyword_lengths:
+                index = self.keywords.get(name[start : start + length])
+                if index is not None and (found is None or index < found):
+                    found = index
+        return found
+
+    def covering(
+        self, dim: str, entry: _Entry, no_resolve: bool
+    ) -> tuple[int, ...] | None:
+        value = entry.matcher
+        match entry.kind:
+            case "domain" | "suffix":
+                name = str(value).lower()
+                if entry.kind == "domain":
+                    index = self.domains.covering_domain(name)
+                else:
+                    index = self.domains.covering_suffix(name)
+                keyword = self._keyword_in(name.lstrip(".")) if self.keywords else None
+                found = [i for i in (index, keyword) if i is not None]
+                return (min(found),) if found else None
+            case "keyword":
+                index = self._keyword_in(str(value).lower())
+                return None if index is None else (index,)
+            case "cidr":
+                family, lo, hi = _cidr_range(value)
+                resolving = self.ips.get((dim, family, False))
+                owners = resolving.covering(lo, hi) if resolving is not None else None
+                if owners is None and no_resolve:
+                    any_ = self.ips.get((dim, family, True))
+                    owners = any_.covering(lo, hi) if any_ is not None else None
+                return owners
+            case "port":
+                ports = self.ports.get(dim)
+                return None if ports is None else ports.covering(*_port_range(value))
+            case "exact":
+                index = self.exact.get((dim, str(value), False))
+                if index is None and no_resolve:
+                    index = self.exact.get((dim, str(value), True))
+                return None if index is None else (index,)
+            case _:
+                return None
+
+    def add(self, dim: str, entry: _Entry, no_resolve: bool, index: int) -> None:
+        value = entry.matcher
+        match entry.kind:
+            case "domain":
+                self.domains.add_domain(str(value), index)
+            case "suffix":
+                self.domains.add_suffix(str(value), index)
+            case "keyword":
+                keyword = str(value).lower()
+                if keyword:
+                    self.keywords.setdefault(keyword, index)
+                    self.keyword_lengths.add(len(keyword))
+            case "cidr":
+                family, lo, hi = _cidr_range(value)
+                for key in {(dim, family, True), (dim, family, no_resolve)}:
+                    self.ips.setdefault(key, _IntervalSet()).add(lo, hi, index)
+            case "port":
+                self.ports.setdefault(dim, _IntervalSet()).add(
+                    *_port_range(value), index
+                )
+            case "exact":
+                for key in {(dim, str(value), True), (dim, str(value), no_resolve)}:
+                    self.exact.setdefault(key, index)
+            case _:
+                pass
+
+
+def _as_list(value: Any) -> list[Any]:
+    if value is None:
+        return []
+    if isinstance(value, (str, int)):
+        return [value]
+    return list(value)
+
+
+def _uniproxy_clause(rule: UniproxyRule) -> _Clause:
+    typ = rule.type.removesuffix("-group")
+    no_resolve = bool(rule.no_resolve) if isinstance(rule, NoResoleMixin) else True
+    match typ:
+        case "domain" | "domain-suffix" | "domain-keyword":
+            dim, kind = "address", typ.removeprefix("domain-")
+        case "ip-cidr" | "ip-cidr6":
+            dim, kind = "address", "cidr"
+        case "src-ip":
+            dim, kind = "src-ip", "cidr"
+        case "dest-port" | "src-port" | "in-port":
+            dim, kind = _PORT_TYPES[typ], "port"
+        case "process-name":
+            dim, kind = "process", "exact"
+        case _:
+            dim, kind = typ, "exact"
+    matchers = (
+        _as_list(rule.matcher) if isinstance(rule, BaseGroupRule) else [rule.matcher]
+    )  # type: ignore[reportAttributeAccessIssue]
+    entries = [_Entry(field="matcher", matcher=m, kind=kind) for m in matchers]
+    return _Clause(dims={dim: entries}, unconditional=True, no_resolve=no_resolve)
+
+
+def _singbox_clause(rule: RouteOptionFieldsMixin) -> _Clause | None:
+    if any(getattr(rule, name) for name in _SINGBOX_OPAQUE_RULE):
+        return None
+    dims: dict[str, list[_Entry]] = {}
+    unconditional = True
+    for attr in fields(type(rule)):
+        value = getattr(rule, attr.name)
+        if value is None or attr.name in _SINGBOX_ACTION_FIELDS:
+            continue
+        if attr.name in _SINGBOX_FIELDS:
+            dim, kind = _SINGBOX_FIELDS[attr.name]
+            dims.setdefault(dim, []).extend(
+                _Entry(field=attr.name, matcher=v, kind=kind) for v in _as_list(value)
+            )
+        elif attr.name in _SINGBOX_OPAQUE_ENTRIES:
+            dim = _SINGBOX_OPAQUE_ENTRIES[attr.name]
+            dims.setdefault(dim, []).append(
+                _Entry(field=attr.name, matcher=value, kind="opaque")
+            )
+        else:
+            # inbound, network, protocol, ... narrow the rule down
+            unconditional = False
+    if not dims:
+        return None
+    return _Clause(dims=dims, unconditional=unconditional and len(dims) == 1)
+
+
+def _clause(rule: AnyRule) -> _Clause | None:
+    if isinstance(rule, (BaseBasicRule, BaseGroupRule)):
+        return _uniproxy_clause(rule)  # type: ignore[reportArgumentType]
+    if isinstance(rule, RouteOptionFieldsMixin):
+        return _singbox_clause(rule)
+    return None
+
+
+def _is_final(rule: AnyRule) -> bool:
+    return getattr(rule, "type", None) == "final"
+
+
+def find_shadowed_rules(rules: Sequence[AnyRule]) -> ShadowReport:
+    """Find rules and matchers which can never match in an ordered rule list.
+
+    Rules are matched first to last, so a matcher is shadowed if earlier rules
+    together match every request it matches:
+
+    - `DOMAIN`, `DOMAIN-SUFFIX` and `DOMAIN-KEYWORD` matchers are looked up in
+      a trie of reversed labels and a keyword table.
+    - `IP-CIDR` and `IP-CIDR6` matchers are looked up in a set of merged
+      intervals, so a prefix covered by several smaller ones is found as well.
+      Rules skipping DNS resolution (`no_resolve`) only shadow rules which
+      skip it too.
+    - Port matchers are looked up in merged port ranges, everything else
+      (process names, GeoIP, user agents, ...) by exact value.
+    - Every rule after a `FinalRule` is dead.
+
+    A rule is dead once all matchers of one of its dimensions are shadowed.
+    Both `UniproxyRule` and sing-box route rules are supported, fields of
+    sing-box rules are ORed within a dimension and ANDed across. Only rules
+    with a single dimension and no other condition (e.g. `network`) shadow
+    later ones, sing-box rules with `rule_set` or `invert` are skipped.
+
+    Example:
+
+    ```python
+    report = find_shadowed_rules(rules)
+    print(json.dumps(report.to_dict(), indent=2))
+    ```
+    """
+    coverage = _Coverage()
+    dead: list[int] = []
+    entries: list[ShadowedEntry] = []
+
+    for index, rule in enumerate(rules):
+        if coverage.final is not None:
+            dead.append(index)
+            continue
+        if _is_final(rule):
+            coverage.final = index
+            continue
+        clause = _clause(rule)
+        if clause is None:
+            continue
+
+        is_dead = False
+        live: dict[str, list[_Entry]] = {}
+        for dim, dim_entries in clause.dims.items():
+            live[dim] = []
+            for entry in dim_entries:
+                owners = coverage.covering(dim, entry, clause.no_resolve)
+                if owners is None:
+                    live[dim].append(entry)
+                else:
+                    entries.append(
+                        ShadowedEntry(
+                            index=index,
+                            field=entry.field,
+                            matcher=str(entry.matcher),
+                            shadowed_by=owners,
+                        )
+                    )
+            if not live[dim]:
+                is_dead = True
+
+        if is_dead:
+            dead.append(index)
+        elif clause.unconditional:
+            for dim, dim_entries in live.items():
+                for entry in dim_entries:
+                    coverage.add(dim, entry, clause.no_resolve, index)
+
+    return ShadowReport(total=len(rules), dead=tuple(dead), entries=tuple(entries))
+
+
+def _without(rule: AnyRule, shadowed: Iterable[ShadowedEntry]) -> AnyRule:
+    by_field: dict[str, set[str]] = {}
+    for each in shadowed:
+        by_field.setdefault(each.field, set()).add(each.matcher)
+    changes: dict[str, Any] = {}
+    for name, matchers in by_field.items():
+        value = getattr(rule, name)
+        kept = [v for v in _as_list(value) if str(v) not in matchers]
+        if isinstance(value, (str, int)):
+            # a shadowed single matcher leaves only other fields of the dimension
+            changes[name] = kept[0] if kept else None
+        else:
+            changes[name] = kept or None
+    return evolve(rule, **changes)  # type: ignore[reportArgumentType]
+
+
+def prune_shadowed_rules(
+    rules: Sequence[AnyRule],
+) -> tuple[list[AnyRule], ShadowReport]:
+    """Remove dead rules and shadowed matchers, see `find_shadowed_rules`.
+
+    Dead rules are dropped. Shadowed matchers of live group rules and sing-box
+    rules are removed, which never changes the outcome: the requests they
+    match are decided by earlier rules.
+
+    Returns:
+      tuple[list[AnyRule], ShadowReport]:
+        The remaining rules in order, and the report of the analysis.
+    """
+    report = find_shadowed_rules(rules)
+    dead = set(report.dead)
+    by_rule: dict[int, list[ShadowedEntry]] = {}
+    for each in report.entries:
+        if each.index not in dead:
+            by_rule.setdefault(each.index, []).append(each)
+
+    out: list[AnyRule] = []
+    for index, rule in enumerate(rules):
+        if index in dead:
+            continue
+        shadowed = by_rule.get(index)
+        out.append(rule if shadowed is None else _without(rule, shadowed))
+    return out, report
@@ -0,0 +1,323 @@
+"""Write and read mihomo MRS rule-provider files.
+
+MRS files hold the payload of a `domain` or `ipcidr` rule provider in binary
+form, which mihomo loads much faster than `yaml` or `text` providers:
+
+```
+zstd(
+    "MRS\\x01" | behavior: u8 | count: i64 | len(extra): i64 | extra
+    | payload
+)
+```
+
+Integers are big endian. Domain payloads are stored as a succinct trie of
+reversed domains, IP payloads as a sorted list of merged address ranges, each
+address as 16 bytes (IPv4 mapped into IPv6).
+
+The zstd frame is written with the stdlib `compression.zstd` module where
+available (Python 3.14), and otherwise as uncompressed raw blocks, which is a
+valid zstd frame any decoder reads.
+"""
+
+from __future__ import annotations
+
+from typing import Literal, Sequence
+
+from ipaddress import (
+    IPv6Address,
+    collapse_addresses,
+    ip_network,
+    summarize_address_range,
+)
+from os import PathLike
+from pathlib import Path
+
+from uniproxy import succinct
+from uniproxy.uniproxy.rules import UniproxyRule
+from uniproxy.utils import to_name
+
+from .providers import DomainRuleProvider, IPCidrRuleProvider
+from .rules import ClashRule, RuleSetRule, make_rules_from_uniproxy_many
+
+try:
+    from compression import zstd  # type: ignore[import-not-found]
+except ImportError:
+    zstd = None
+
+type MrsBehavior = Literal["domain", "ipcidr"]
+
+MAGIC = b"MRS\x01"
+
+_BEHAVIORS: dict[MrsBehavior, int] = {"domain": 0, "ipcidr": 1}
+
+_ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+_ZSTD_BLOCK_SIZE = 128 * 1024
+
+#
+# zstd frames
+#
+
+
+def _zstd_compress(data: bytes) -> bytes:
+    if zstd is not None:
+        return zstd.compress(data)
+    # single segment frame with an 8 byte content size, no checksum
+    out = bytearray(_ZSTD_MAGIC)
+    out.append(0xE0)
+    out += len(data).to_bytes(8, "little")
+    for start in range(0, max(len(data), 1), _ZSTD_BLOCK_SIZE):
+        block = data[start : start + _ZSTD_BLOCK_SIZE]
+        last = start + _ZSTD_BLOCK_SIZE >= len(data)
+        out += (len(block) << 3 | int(last)).to_bytes(3, "little")  # raw block
+        out += block
+    return bytes(out)
+
+
+def _zstd_decompress(data: bytes) -> bytes:
+    if zstd is not None:
+        return zstd.decompress(data)
+    out = bytearray()
+    offset = 0
+    while offset < len(data):
+        magic = data[offset : offset + 4]
+        if magic[1:] == b"\x2a\x4d\x18" and magic[0] & 0xF0 == 0x50:
+            size = int.from_bytes(data[offset + 4 : offset + 8], "little")
+            offset += 8 + size  # skippable frame
+            continue
+        if magic != _ZSTD_MAGIC:
+            raise ValueError("Not a zstd frame")
+        descriptor = data[offset + 4]
+        offset += 5
+        single_segment = descriptor >> 5 & 1
+        offset += 0 if single_segment else 1  # window descriptor
+        offset += (0, 1, 2, 4)[descriptor & 3]  # dictionary id
+        fcs = descriptor >> 6
+        offset += (1 if single_segment else 0, 2, 4, 8)[fcs]
+        while True:
+            header = int.from_bytes(data[offset : offset + 3], "little")
+            offset += 3
+            last, kind, size = header & 1, header >> 1 & 3, header >> 3
+            if kind == 0:
+                out += data[offset : offset + size]
+                offset += size
+            elif kind == 1:
+                out += data[offset : offset + 1] * size
+                offset += 1
+            else:
+                raise ValueError(
+                    "Compressed zstd blocks need the `compression.zstd` module"
+                )
+            if last:
+                break
+        if descriptor >> 2 & 1:
+            offset += 4  # content checksum
+    return bytes(out)
+
+
+#
+# Payloads
+#
+
+
+def _domain_keys(payload: Sequence[str]) -> list[bytes]:
+    keys: set[str] = set()
+    for entry in payload:
+        entry = entry.strip().lower()
+        if entry.startswith("+."):
+            keys.add(entry[2:])
+            keys.add(entry)
+        elif entry.startswith("."):
+            keys.add(f"+{entry}")
+        else:
+            keys.add(entry)
+    return sorted(key[::-1].encode() for key in keys)
+
+
+def _read_domains(keys: list[bytes]) -> list[str]:
+    names = {key[::-1].decode() for key in keys}
+    payload: list[str] = []
+    for name in sorted(names):
+        if name.startswith("+."):
+            payload.append(name if name[2:] in names else name[1:])
+        elif f"+.{name}" not in names:
+            payload.append(name)
+    return sorted(payload)
+
+
+def _address_ranges(payload: Sequence[str]) -> list[tuple[int, int]]:
+    """Merged ranges of IPv4-mapped or IPv6 addresses as integers."""
+    networks = [ip_network(each.strip(), strict=False) for each in payload]
+    ranges: list[tuple[int, int]] = []
+    for version, offset in ((4, 0xFFFF << 32), (6, 0)):
+        collapsed = collapse_addresses(n for n in networks if n.version == version)  # type: ignore[reportArgumentType]
+        for network in collapsed:
+            first = int(network.network_address) + offset
+            last = int(network.broadcast_address) + offset
+            if ranges and ranges[-1][1] + 1 == first:
+                ranges[-1] = (ranges[-1][0], last)
+            else:
+                ranges.append((first, last))
+    return ranges
+
+
+def _read_cidrs(first: int, last: int) -> list[str]:
+    lo, hi = IPv6Address(first), IPv6Address(last)
+    if lo.ipv4_mapped is not None and hi.ipv4_mapped is not None:
+        networks = summarize_address_range(lo.ipv4_mapped, hi.ipv4_mapped)
+    else:
+        networks = summarize_address_range(lo, hi)
+    return [str(n) for n in networks]
+
+
+def dumps_mrs(behavior: MrsBehavior, payload: Sequence[str]) -> bytes:
+    """Encode the payload of a `domain` or `ipcidr` rule provider as MRS.
+
+    Domain entries follow the rule provider syntax: `+.example.com` matches
+    the domain and its subdomains, `.example.com` only its subdomains.
+
+    Raises:
+      ValueError: If `behavior` is not supported, or an `ipcidr` entry is not
+        a valid IP network.
+    """
+    if behavior not in _BEHAVIORS:
+        raise ValueError(f"Unsupported MRS behavior: {behavior}")
+    out = bytearray(MAGIC)
+    out.append(_BEHAVIORS[behavior])
+    out += len(payload).to_bytes(8, "big")
+    out += (0).to_bytes(8, "big")  # no extra data
+    out.append(1)  # version of the set
+    if behavior == "domain":
+        leaves, bitmap, labels = succinct.build(_domain_keys(payload))
+        for words in (leaves, bitmap):
+            out += len(words).to_bytes(8, "big")
+            for word in words:
+                out += word.to_bytes(8, "big")
+        out += len(labels).to_bytes(8, "big")
+        out += labels
+    else:
+        ranges = _address_ranges(payload)
+        out += len(ranges).to_bytes(8, "big")
+        for first, last in ranges:
+            out += first.to_bytes(16, "big")
+            out += last.to_bytes(16, "big")
+    return _zstd_compress(bytes(out))
+
+
+def loads_mrs(data: bytes) -> tuple[MrsBehavior, list[str]]:
+    """Decode an MRS file into its behavior and payload, see `dumps_mrs`.
+
+    Domains are returned sorted, with `+.` prefixes where both a domain and
+    its subdomains are matched. IP networks are returned merged.
+
+    Raises:
+      ValueError: If `data` is not a supported MRS file.
+    """
+    raw = _zstd_decompress(data)
+    if raw[:4] != MAGIC:
+        raise ValueError("Not an MRS file")
+    behaviors = {v: k for k, v in _BEHAVIORS.items()}
+    if raw[4] not in behaviors:
+        raise ValueError(f"Unsupported MRS behavior: {raw[4]}")
+    behavior = behaviors[raw[4]]
+    offset = 5 + 8
+    extra = int.from_bytes(raw[offset : offset + 8], "big")
+    offset += 8 + extra
+    if raw[offset] != 1:
+        raise ValueError(f"Unsupported MRS set version: {raw[offset]}")
+    offset += 1
+
+    def int64() -> int:
+        nonlocal offset
+        value = int.from_bytes(raw[offset : offset + 8], "big")
+        offset += 8
+        return value
+
+    if behavior == "domain":
+        leaves = [int64() for _ in range(int64())]
+        bitmap = [int64() for _ in range(int64())]
+        n = int64()
+        labels = raw[offset : offset + n]
+        return behavior, _read_domains(succinct.keys(leaves, bitmap, labels))
+
+    payload: list[str] = []
+    for _ in range(int64()):
+        first = int.from_bytes(raw[offset : offset + 16], "big")
+        last = int.from_bytes(raw[offset + 16 : offset + 32], "big")
+        offset += 32
+        payload.extend(_read_cidrs(first, last))
+    return behavior, payload
+
+
+#
+# Compiling
+#
+
+type MrsRuleProvider = DomainRuleProvider | IPCidrRuleProvider
+
+
+def compile_mrs_providers(
+    rules: Sequence[UniproxyRule],
+    directory: str | PathLike[str],
+    threshold: int = 1000,
+    prefix: str = "inline",
+) -> tuple[list[ClashRule], list[MrsRuleProvider]]:
+    """Convert uniproxy rules to Clash, moving large groups into MRS providers.
+
+    `DomainGroupRule`, `DomainSuffixGroupRule`, `IPCidrGroupRule` and
+    `IPCidr6GroupRule` with at least `threshold` matchers are written to
+    `directory/<prefix>-<n>.mrs` and replaced by a `RULE-SET` rule of the
+    same policy (and `no-resolve` flag). All other rules are converted with
+    `make_rules_from_uniproxy_many`.
+
+    Returns:
+      tuple[list[ClashRule], list[MrsRuleProvider]]:
+        The Clash rules in order, and the providers to register in
+        `rule-providers`.
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    out: list[ClashRule] = []
+    providers: list[MrsRuleProvider] = []
+    pending: list[UniproxyRule] = []
+    for rule in rules:
+        match rule.type:
+            case "domain-group":
+                behavior, payload = "domain", list(rule.matcher)  # type: ignore[reportAttributeAccessIssue]
+            case "domain-suffix-group":
+                # a leading dot restricts the suffix to subdomains, as in mihomo
+                behavior = "domain"
+                payload = [
+                    each if each.startswith(".") else f"+.{each}"
+                    for each in rule.matcher  # type: ignore[reportAttributeAccessIssue]
+                ]
+            case "ip-cidr-group" | "ip-cidr6-group":
+                behavior, payload = "ipcidr", list(rule.matcher)  # type: ignore[reportAttributeAccessIssue]
+            case _:
+                behavior, payload = None, []
+        if behavior is None or len(payload) < threshold:
+            pending.append(rule)
+            continue
+
+        out.extend(make_rules_from_uniproxy_many(pending))
+        pending = []
+        name = f"{prefix}-{len(providers)}"
+        path = directory / f"{name}.mrs"
+        path.write_bytes(dumps_mrs(behavior, payload))
+        if behavior == "domain":
+            provider = DomainRuleProvider(
+                name=name, type="file", format="mrs", path=str(path)
+            )
+        else:
+            provider = IPCidrRuleProvider(
+                name=name, type="file", format="mrs", path=str(path)
+            )
+        providers.append(provider)
+        out.append(
+            RuleSetRule(
+                matcher=name,
+                policy=to_name(rule.policy),
+                no_resolve=getattr(rule, "no_resolve", None),
+            )
+        )
+    out.extend(make_rules_from_uniproxy_many(pending))
+    return out, providers
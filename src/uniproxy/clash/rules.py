@@ -1,6 +1,6 @@
 from __future__ import annotations
 
-from typing import Literal, Mapping, Union
+from typing import Literal, Mapping, Sequence, Union
 
 from attrs import define
 
@@ -11,12 +11,12 @@ from uniproxy.uniproxy.rules import (
     DomainSuffixGroupRule,
     IPCidr6GroupRule,
     IPCidrGroupRule,
+    NoResoleMixin,
     UniproxyRule,
     is_basic_no_resolvable_rule,
     is_basic_rule,
 )
 from uniproxy.uniproxy.rules import FinalRule as UniproxyFinalRule
-from uniproxy.uniproxy.shared import NoResoleMixin
 from uniproxy.uniproxy.typing import (
     BASIC_NO_RESOLABLE_RULES,
     BASIC_RULES,
@@ -159,9 +159,15 @@ class DeviceNameRule(BaseBasicRule):
 
 
 @define
-class RuleSetRule(BaseBasicRule):
+class RuleSetRule(NoResoleMixin, BaseBasicRule):
     type: Literal["rule-set"] = "rule-set"
 
+    def __str__(self) -> str:
+        if self.no_resolve:
+            return f"{self.type.upper()},{self.matcher},{self.policy},no-resolve"
+        else:
+            return f"{self.type.upper()},{self.matcher},{self.policy}"
+
 
 type ClashBasicRule = (
     DomainRule
@@ -264,3 +270,70 @@ def make_rules_from_uniproxy(rule: UniproxyRule) -> tuple[ClashRule, ...]:
             return (FinalRule(policy=str(policy)),)
         case _:
             raise ValueError("Invalid rule type")
+
+
+# kinds from `_GROUP` on expand to one rule per matcher
+_BASIC, _NO_RESOLVE, _FINAL, _GROUP, _GROUP_NO_RESOLVE = range(5)
+
+_CLASH_DISPATCH: Mapping[str, tuple[int, type[ClashRule]]] = {
+    **{typ: (_BASIC, cls) for typ, cls in _CLASH_MAPPER.items()},
+    **{typ: (_NO_RESOLVE, cls) for typ, cls in _CLASH_RESOLVABLE_MAPPER.items()},
+    "domain-group": (_GROUP, DomainRule),
+    "domain-suffix-group": (_GROUP, DomainSuffixRule),
+    "domain-keyword-group": (_GROUP, DomainKeywordRule),
+    "ip-cidr-group": (_GROUP_NO_RESOLVE, IPCidrRule),
+    "ip-cidr6-group": (_GROUP_NO_RESOLVE, IPCidr6Rule),
+    "final": (_FINAL, FinalRule),
+}
+
+
+def make_rules_from_uniproxy_many(rules: Sequence[UniproxyRule]) -> list[ClashRule]:
+    """Convert many uniproxy rules at once, see `make_rules_from_uniproxy`.
+
+    Rules are dispatched by their `type` through a single lookup table, the
+    name of each distinct policy is resolved once, and the results are written
+    into one list sized up front.
+    """
+    plan: list[tuple[int, type[ClashRule]]] = []
+    size = 0
+    for rule in rules:
+        if rule.type == "ip-asn":
+            raise NotImplementedError(
+                "`ip-asn` rule type not implemented yet for Clash"
+            )
+        entry = _CLASH_DISPATCH.get(rule.type)
+        if entry is None:
+            raise ValueError("Invalid rule type")
+        plan.append(entry)
+        size += len(rule.matcher) if entry[0] >= _GROUP else 1  # type: ignore[reportAttributeAccessIssue]
+
+    names: dict[int, str] = {}
+    out: list[ClashRule] = [None] * size  # type: ignore[reportAssignmentType]
+    i = 0
+    for rule, (kind, cls) in zip(rules, plan):
+        policy = names.get(id(rule.policy))
+        if policy is None:
+            policy = names[id(rule.policy)] = to_name(rule.policy)
+        if kind == _BASIC:
+            out[i] = cls(matcher=to_name(rule.matcher), policy=policy)  # type: ignore
+            i += 1
+        elif kind == _NO_RESOLVE:
+            out[i] = cls(  # type: ignore
+                matcher=to_name(rule.matcher),  # type: ignore
+                policy=policy,
+                no_resolve=rule.no_resolve,  # type: ignore
+            )
+            i += 1
+        elif kind == _GROUP:
+            for each in rule.matcher:  # type: ignore
+                out[i] = cls(matcher=str(each), policy=policy)  # type: ignore
+                i += 1
+        elif kind == _GROUP_NO_RESOLVE:
+            no_resolve = rule.no_resolve  # type: ignore
+            for each in rule.matcher:  # type: ignore
+                out[i] = cls(matcher=str(each), policy=policy, no_resolve=no_resolve)  # type: ignore
+                i += 1
+        else:
+            out[i] = FinalRule(policy=policy)
+            i += 1
+    return out
@@ -0,0 +1,401 @@
+from __future__ import annotations
+
+from typing import Callable, Iterable, Literal, TypeVar
+
+import asyncio
+import random
+import struct
+import time
+from ipaddress import IPv4Address, IPv6Address, ip_address
+
+from attrs import define, evolve, field
+
+from uniproxy.uniproxy.base import BaseProtocol
+from uniproxy.uniproxy.protocols import (
+    AnyTLSProtocol,
+    NaiveProtocol,
+    ShadowsocksObfsPlugin,
+    ShadowsocksProtocol,
+    ShadowsocksV2RayPlugin,
+    TrojanProtocol,
+    VmessH2Transport,
+    VmessProtocol,
+    VmessWsTransport,
+)
+from uniproxy.uniproxy.shared import TLS
+
+P = TypeVar("P", bound=BaseProtocol)
+
+type Address = IPv4Address | IPv6Address
+
+_QTYPES = {"A": 1, "AAAA": 28}
+_RCODE_NXDOMAIN = 3
+_HEADER = struct.Struct("!HHHHHH")
+_RR = struct.Struct("!HHIH")
+
+_TLS_ONLY = (TrojanProtocol, AnyTLSProtocol, NaiveProtocol)
+"""Protocols which use TLS (with the server as SNI) even if `tls` is `None`."""
+
+
+class DnsError(Exception):
+    """Raised if a hostname could not be resolved."""
+
+    def __init__(self, hostname: str, reason: str) -> None:
+        super().__init__(f"Failed to resolve '{hostname}': {reason}")
+        self.hostname = hostname
+        self.reason = reason
+
+
+def _build_query(qid: int, hostname: str, qtype: int) -> bytes:
+    labels = hostname.rstrip(".").encode("idna").split(b".")
+    qname = b"".join(bytes((len(label),)) + label for label in labels) + b"\0"
+    # recursion desired, one question
+    return _HEADER.pack(qid, 0x0100, 1, 0, 0, 0) + qname + struct.pack("!HH", qtype, 1)
+
+
+def _skip_name(data: bytes, offset: int) -> int:
+    while True:
+        length = data[offset]
+        if length & 0xC0 == 0xC0:  # compression pointer
+            return offset + 2
+        offset += length + 1
+        if length == 0:
+            return offset
+
+
+def _parse_response(
+    data: bytes, qtype: int
+) -> tuple[int, bool, list[tuple[Address, int]]]:
+    """Parse a response into its rcode, truncation bit and `(address, ttl)` pairs.
+
+    CNAME chains are followed implicitly, recursive resolvers include the
+    address records of the target in the same answer.
+    """
+    _, flags, qdcount, ancount, _, _ = _HEADER.unpack_from(data)
+    offset = _HEADER.size
+    for _ in range(qdcount):
+        offset = _skip_name(data, offset) + 4
+
+    records: list[tuple[Address, int]] = []
+    for _ in range(ancount):
+        offset = _skip_name(data, offset)
+        rtype, _, ttl, rdlength = _RR.unpack_from(data, offset)
+        offset += _RR.size
+        rdata = data[offset : offset + rdlength]
+        offset += rdlength
+        if rtype != qtype:
+            continue
+        if rtype == 1 and rdlength == 4:
+            records.append((IPv4Address(rdata), ttl))
+        elif rtype == 28 and rdlength == 16:
+            records.append((IPv6Address(rdata), ttl))
+    return flags & 0x000F, bool(flags & 0x0200), records
+
+
+class _DnsProtocol(asyncio.DatagramProtocol):
+    """Demultiplex responses of concurrent queries on one socket by their id."""
+
+    def __init__(self) -> None:
+        self.pending: dict[int, asyncio.Future[bytes]] = {}
+
+    def datagram_received(self, data: bytes, addr: object) -> None:
+        if len(data) < _HEADER.size:
+            return
+        qid = int.from_bytes(data[:2])
+        future = self.pending.pop(qid, None)
+        if future is not None and not future.done():
+            future.set_result(data)
+
+    def error_received(self, exc: Exception) -> None:
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(exc)
+        self.pending.clear()
+
+
+@define
+class Resolver:
+    """Asyncio stub resolver with a TTL aware cache.
+
+    Queries are sent over UDP to a single recursive resolver at `nameserver`,
+    truncated responses are retried over TCP. At most `concurrency` lookups
+    are in flight at once, concurrent lookups of the same hostname share one
+    query, and answers are cached for their TTL clamped to `min_ttl` and
+    `max_ttl`. Failed lookups are cached for `negative_ttl`.
+
+    Example:
+
+    ```python
+    async with Resolver(nameserver="1.1.1.1") as resolver:
+        addresses = await resolver.resolve("example.com")
+    ```
+    """
+
+    nameserver: str = "1.1.1.1"
+    port: int = 53
+    timeout: float = 2
+    retries: int = 2
+    concurrency: int = 64
+    record_types: tuple[Literal["A", "AAAA"], ...] = ("A", "AAAA")
+    min_ttl: float = 0
+    max_ttl: float = 86400
+    negative_ttl: float = 30
+    clock: Callable[[], float] = time.monotonic
+
+    _cache: dict[str, tuple[float, tuple[Address, ...] | DnsError]] = field(
+        factory=dict, init=False
+    )
+    _inflight: dict[str, asyncio.Future[tuple[Address, ...]]] = field(
+        factory=dict, init=False
+    )
+    _limit: asyncio.Semaphore | None = field(default=None, init=False)
+    _transport: asyncio.DatagramTransport | None = field(default=None, init=False)
+    _protocol: _DnsProtocol | None = field(default=None, init=False)
+
+    async def __aenter__(self) -> Resolver:
+        return self
+
+    async def __aexit__(self, *exc_info: object) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Close the UDP socket, the cache is kept."""
+        if self._transport is not None:
+            self._transport.close()
+        self._transport = self._protocol = self._limit = None
+
+    def cached(self, hostname: str) -> tuple[Address, ...] | None:
+        """Addresses of a hostname if they are cached and not expired."""
+        entry = self._cache.get(hostname.lower().rstrip("."))
+        if entry is None or entry[0] <= self.clock():
+            return None
+        return entry[1] if isinstance(entry[1], tuple) else None
+
+    async def resolve(self, hostname: str) -> tuple[Address, ...]:
+        """Addresses of a hostname, A records first.
+
+        Raises:
+          DnsError: If the hostname does not exist or has no address records.
+        """
+        key = hostname.lower().rstrip(".")
+        entry = self._cache.get(key)
+        if entry is not None and entry[0] > self.clock():
+            if isinstance(entry[1], DnsError):
+                raise entry[1]
+            return entry[1]
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            return await asyncio.shield(inflight)
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            addresses, ttl = await self._lookup(key)
+        except DnsError as e:
+            self._cache[key] = (self.clock() + self.negative_ttl, e)
+            future.set_exception(e)
+            raise
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            ttl = min(max(ttl, self.min_ttl), self.max_ttl)
+            self._cache[key] = (self.clock() + ttl, addresses)
+            future.set_result(addresses)
+            return addresses
+        finally:
+            del self._inflight[key]
+            # waiters are optional, do not warn about unretrieved exceptions
+            if future.done() and not future.cancelled():
+                future.exception()
+
+    async def resolve_all(
+        self, hostnames: Iterable[str]
+    ) -> dict[str, tuple[Address, ...] | BaseException]:
+        """Resolve many hostnames concurrently.
+
+        Returns:
+          dict[str, tuple[Address, ...] | BaseException]:
+            Addresses keyed by hostname, failed lookups map to their exception.
+        """
+        unique = list(dict.fromkeys(hostnames))
+        results = await asyncio.gather(
+            *(self.resolve(h) for h in unique), return_exceptions=True
+        )
+        return dict(zip(unique, results))
+
+    async def _lookup(self, hostname: str) -> tuple[tuple[Address, ...], float]:
+        if self._limit is None:
+            self._limit = asyncio.Semaphore(self.concurrency)
+        async with self._limit:
+            answers = await asyncio.gather(
+                *(self._query(hostname, _QTYPES[t]) for t in self.record_types),
+                return_exceptions=True,
+            )
+        addresses: list[Address] = []
+        ttls: list[int] = []
+        errors: list[BaseException] = []
+        for answer in answers:
+            if isinstance(answer, BaseException):
+                errors.append(answer)
+                continue
+            for address, ttl in answer:
+                addresses.append(address)
+                ttls.append(ttl)
+        if addresses:
+            return tuple(addresses), min(ttls)
+        for e in errors:
+            if not isinstance(e, DnsError):
+                raise e
+        raise errors[0] if errors else DnsError(hostname, "no address records")
+
+    async def _query(self, hostname: str, qtype: int) -> list[tuple[Address, int]]:
+        protocol = await self._endpoint()
+        loop = asyncio.get_running_loop()
+        for _ in range(self.retries + 1):
+            qid = random.getrandbits(16)
+            while qid in protocol.pending:
+                qid = random.getrandbits(16)
+            query = _build_query(qid, hostname, qtype)
+            future: asyncio.Future[bytes] = loop.create_future()
+            protocol.pending[qid] = future
+            assert self._transport is not None
+            self._transport.sendto(query)
+            try:
+                async with asyncio.timeout(self.timeout):
+                    data = await future
+            except TimeoutError:
+                protocol.pending.pop(qid, None)
+                continue
+            rcode, truncated, records = _parse_response(data, qtype)
+            if truncated:
+                rcode, _, records = _parse_response(await self._query_tcp(query), qtype)
+            if rcode == _RCODE_NXDOMAIN:
+                raise DnsError(hostname, "no such domain")
+            if rcode != 0:
+                raise DnsError(hostname, f"server failure (rcode {rcode})")
+            return records
+        raise DnsError(hostname, "timed out")
+
+    async def _query_tcp(self, query: bytes) -> bytes:
+        async with asyncio.timeout(self.timeout):
+            reader, writer = await asyncio.open_connection(self.nameserver, self.port)
+            try:
+                writer.write(len(query).to_bytes(2) + query)
+                await writer.drain()
+                size = int.from_bytes(await reader.readexactly(2))
+                return await reader.readexactly(size)
+            finally:
+                writer.close()
+
+    async def _endpoint(self) -> _DnsProtocol:
+        if self._protocol is None:
+            loop = asyncio.get_running_loop()
+            transport, protocol = await loop.create_datagram_endpoint(
+                _DnsProtocol, remote_addr=(self.nameserver, self.port)
+            )
+            self._transport, self._protocol = transport, protocol
+        return self._protocol
+
+
+def _is_ip(server: str | Address) -> bool:
+    if not isinstance(server, str):
+        return True
+    try:
+        ip_address(server)
+    except ValueError:
+        return False
+    return True
+
+
+def _pin(protocol: P, address: Address) -> P:
+    """Point a protocol to an address, keeping its hostname for TLS and hosts."""
+    hostname = str(protocol.server)
+    changes: dict[str, object] = {"server": address}
+
+    tls = getattr(protocol, "tls", None)
+    if isinstance(tls, TLS):
+        if tls.server_name is None:
+            changes["tls"] = evolve(tls, server_name=hostname)
+    elif tls is None and isinstance(protocol, _TLS_ONLY):
+        changes["tls"] = TLS(server_name=hostname)
+
+    if isinstance(protocol, ShadowsocksProtocol):
+        plugin = protocol.plugin
+        if isinstance(plugin, ShadowsocksObfsPlugin) and not plugin.obfs_host:
+            changes["plugin"] = evolve(plugin, obfs_host=hostname)
+        elif isinstance(plugin, ShadowsocksV2RayPlugin) and not plugin.host:
+            changes["plugin"] = evolve(plugin, host=hostname)
+    elif isinstance(protocol, VmessProtocol):
+        transport = protocol.transport
+        if isinstance(transport, VmessWsTransport | VmessH2Transport):
+            headers = transport.headers or {}
+            if not any(key.lower() == "host" for key in headers):
+                changes["transport"] = evolve(
+                    transport, headers={**headers, "Host": hostname}
+                )
+    return evolve(protocol, **changes)
+
+
+async def resolve_protocols(
+    protocols: Iterable[P],
+    resolver: Resolver,
+    *,
+    rewrite: bool = False,
+    prefer: Literal["ipv4", "ipv6"] = "ipv4",
+) -> tuple[list[P], dict[str, BaseException]]:
+    """Resolve the server hostnames of protocols in bulk.
+
+    Every distinct hostname is looked up once, servers which already are IP
+    addresses are skipped. This warms the resolver cache, and with `rewrite`
+    servers are replaced by one of their addresses, so clients do not need to
+    resolve thousands of hostnames on their first connections. The hostname is
+    kept where the server name is still needed: as the SNI of TLS, as the
+    host of obfs and v2ray plugins and as the `Host` header of VMess WebSocket
+    and HTTP/2 transports.
+
+    Example:
+
+    ```python
+    async with Resolver(nameserver="223.5.5.5") as resolver:
+        protocols, errors = await resolve_protocols(
+            protocols, resolver, rewrite=True
+        )
+    ```
+
+    Args:
+      protocols (Iterable[BaseProtocol]):
+        Protocols to resolve.
+      resolver (Resolver):
+        Resolver to use, its cache is shared between calls.
+      rewrite (bool):
+        Replace hostnames with their addresses.
+      prefer (Literal["ipv4", "ipv6"]):
+        Family of the address used to rewrite, if a hostname has both.
+
+    Returns:
+      tuple[list[BaseProtocol], dict[str, BaseException]]:
+        The protocols in input order, rewritten if requested, and the errors of
+        hostnames which could not be resolved. Their protocols are unchanged.
+    """
+    protocols = list(protocols)
+    hostnames = [str(p.server) for p in protocols if not _is_ip(p.server)]
+    resolved = await resolver.resolve_all(hostnames)
+    errors = {h: e for h, e in resolved.items() if isinstance(e, BaseException)}
+    if not rewrite:
+        return protocols, errors
+
+    family = IPv4Address if prefer == "ipv4" else IPv6Address
+    rewritten: list[P] = []
+    for protocol in protocols:
+        addresses = resolved.get(str(protocol.server))
+        if isinstance(addresses, tuple):
+            address = next(
+                (a for a in addresses if isinstance(a, family)), addresses[0]
+            )
+            protocol = _pin(protocol, address)
+        rewritten.append(protocol)
+    return rewritten, errors
@@ -0,0 +1,265 @@
+from __future__ import annotations
+
+from typing import Any, Callable, Iterable, Mapping, Sequence
+
+import random
+from collections import Counter
+from ipaddress import ip_network
+
+from attrs import frozen
+
+from uniproxy.clash import rules as clash
+from uniproxy.matcher import RuleMatcher
+from uniproxy.surge import rules as surge
+from uniproxy.to.singbox.uniproxy.rules import route_rules_from_uniproxy_many
+from uniproxy.uniproxy.base import BaseGroupRule
+from uniproxy.uniproxy.rules import UniproxyRule
+from uniproxy.utils import to_tag
+
+type Request = tuple[str | None, str | None, int | None]
+"""Domain, destination IP and destination port of a request."""
+
+REFERENCE = "uniproxy"
+"""Name of the backend evaluating the unconverted rules."""
+
+
+@frozen
+class Disagreement:
+    """A request decided differently by some backends."""
+
+    request: Request
+    count: int
+    """Number of occurrences in the corpus."""
+    policies: Mapping[str, str | None]
+    """Policy chosen by each backend, `None` if no rule matched."""
+    indices: Mapping[str, int | None]
+    """Index of the winning rule in the converted rules of each backend."""
+
+
+@frozen
+class EquivalenceReport:
+    """Result of `check_equivalence`."""
+
+    total: int
+    """Number of requests checked."""
+    unique: int
+    """Number of distinct requests, each is evaluated once per backend."""
+    disagreeing: int
+    """Number of requests not decided alike by all backends."""
+    by_backend: Mapping[str, int]
+    """Number of requests each backend decides unlike the reference."""
+    skipped: Mapping[str, int]
+    """Number of rules each backend could not convert, plus the number of
+    converted rules it could not evaluate."""
+    errors: Mapping[str, str]
+    """Backends whose rules could not be compiled, and why."""
+    examples: tuple[Disagreement, ...]
+    """The most frequent disagreements."""
+
+    def to_dict(self) -> dict[str, Any]:
+        """Plain representation, e.g. for `json.dumps`."""
+        return {
+            "total": self.total,
+            "unique": self.unique,
+            "disagreeing": self.disagreeing,
+            "by_backend": dict(self.by_backend),
+            "skipped": dict(self.skipped),
+            "errors": dict(self.errors),
+            "examples": [
+                {
+                    "request": list(e.request),
+                    "count": e.count,
+                    "policies": dict(e.policies),
+                    "indices": dict(e.indices),
+                }
+                for e in self.examples
+            ],
+        }
+
+
+BACKENDS: Mapping[str, Callable[[Sequence[UniproxyRule]], Sequence[Any]]] = {
+    REFERENCE: list,
+    "surge": surge.make_rules_from_uniproxy_many,
+    "clash": clash.make_rules_from_uniproxy_many,
+    "sing-box": route_rules_from_uniproxy_many,
+}
+"""Convert uniproxy rules for each backend."""
+
+
+def _convert(
+    convert: Callable[[Sequence[UniproxyRule]], Sequence[Any]],
+    rules: Sequence[UniproxyRule],
+) -> tuple[list[Any], int]:
+    """Converted rules, and the number of rules which could not be converted."""
+    try:
+        return list(convert(rules)), 0
+    except (ValueError, NotImplementedError):
+        pass
+    # convert one by one, so a single unsupported rule spoils only itself
+    out: list[Any] = []
+    failed = 0
+    for rule in rules:
+        try:
+            out.extend(convert([rule]))
+        except (ValueError, NotImplementedError):
+            failed += 1
+    return out, failed
+
+
+def _compile(
+    name: str, converted: Sequence[Any], rules: Sequence[UniproxyRule]
+) -> RuleMatcher:
+    if name != "sing-box":
+        return RuleMatcher(converted)
+    # `route.final` takes the place of `FinalRule`
+    final = next((r for r in rules if r.type == "final"), None)
+    return RuleMatcher.from_singbox(
+        converted, final=None if final is None else to_tag(final.policy)
+    )
+
+
+def check_equivalence(
+    rules: Sequence[UniproxyRule],
+    requests: Iterable[Request],
+    backends: Iterable[str] = BACKENDS,
+    examples: int = 100,
+) -> EquivalenceReport:
+    """Evaluate a corpus of requests against the converted rules of each backend.
+
+    The rules are converted with the batch converters of every backend and
+    compiled into a `RuleMatcher` each. Rules a backend cannot convert are
+    left out of its rules only, and counted in `skipped`. Every distinct request is evaluated
+    once per backend, and the backends' policies are compared to those of the
+    unconverted rules. Known divergences surface this way, e.g. `REJECT` rules
+    of any type turned into `domain_suffix` rules for sing-box. Rules none of
+    the backends can evaluate offline, such as `GEOIP` rules or sing-box
+    `rule_set` references, are counted in `skipped` instead.
+
+    Example:
+
+    ```python
+    report = check_equivalence(rules, synthetic_requests(rules, 1_000_000))
+    print(json.dumps(report.to_dict(), indent=2))
+    ```
+
+    Args:
+      rules: Rules to convert, in order.
+      requests: Corpus of `(domain, ip, port)` tuples, any item may be `None`.
+      backends: Names of the backends to compare, keys of `BACKENDS`.
+      examples: Maximum number of disagreements to report in detail.
+    """
+    corpus = Counter(requests)
+    matchers: dict[str, RuleMatcher] = {}
+    unconverted: dict[str, int] = {}
+    errors: dict[str, str] = {}
+    for name in dict.fromkeys([REFERENCE, *backends]):
+        converted, unconverted[name] = _convert(BACKENDS[name], rules)
+        try:
+            matchers[name] = _compile(name, converted, rules)
+        except (ValueError, NotImplementedError) as e:
+            errors[name] = f"{type(e).__name__}: {e}"
+    if REFERENCE not in matchers:
+        raise ValueError(f"Rules cannot be evaluated: {errors[REFERENCE]}")
+
+    names = [name for name in matchers if name != REFERENCE]
+    by_backend = dict.fromkeys(names, 0)
+    found: list[Disagreement] = []
+    disagreeing = 0
+    reference = matchers[REFERENCE].match
+    others = [(name, matchers[name].match) for name in names]
+    for request, count in corpus.items():
+        domain, ip, port = request
+        expected = reference(domain, ip, port)
+        policy = None if expected is None else expected.policy
+        differs = False
+        for name, match in others:
+            hit = match(domain, ip, port)
+            if (None if hit is None else hit.policy) != policy:
+                by_backend[name] += count
+                differs = True
+        if not differs:
+            continue
+        disagreeing += count
+        hits = {
+            REFERENCE: expected,
+            **{name: m(domain, ip, port) for name, m in others},
+        }
+        found.append(
+            Disagreement(
+                request=request,
+                count=count,
+                policies={k: None if h is None else h.policy for k, h in hits.items()},
+                indices={k: None if h is None else h.index for k, h in hits.items()},
+            )
+        )
+
+    found.sort(key=lambda d: -d.count)
+    return EquivalenceReport(
+        total=corpus.total(),
+        unique=len(corpus),
+        disagreeing=disagreeing,
+        by_backend=by_backend,
+        skipped={
+            name: unconverted[name] + len(m.skipped) for name, m in matchers.items()
+        },
+        errors=errors,
+        examples=tuple(found[:examples]),
+    )
+
+
+def _sample_ip(network: str, rng: random.Random) -> str:
+    net = ip_network(network.strip(), strict=False)
+    offset = rng.randrange(net.num_addresses)
+    return str(net.network_address + offset)
+
+
+def synthetic_requests(
+    rules: Sequence[UniproxyRule], n: int, seed: int = 0
+) -> list[Request]:
+    """Generate requests hitting the matchers of `rules` and their edges.
+
+    Domains are taken from `DOMAIN` rules, subdomains and parents of
+    `DOMAIN-SUFFIX` rules and hosts containing `DOMAIN-KEYWORD` rules.
+    Addresses are sampled from `IP-CIDR` rules, both as IP requests and as
+    resolved domain requests, and ports from `DEST-PORT` rules. A fraction
+    of requests matches nothing.
+    """
+    rng = random.Random(seed)
+    domains: list[str] = ["unmatched.invalid"]
+    ips: list[str] = ["192.0.2.1", "2001:db8::1"]
+    ports: list[int] = [80, 443]
+    for rule in rules:
+        matchers = (
+            list(rule.matcher)
+            if isinstance(rule, BaseGroupRule)
+            else [getattr(rule, "matcher", None)]
+        )
+        for each in matchers:
+            match rule.type.removesuffix("-group"):
+                case "domain":
+                    domains.append(each)
+                case "domain-suffix":
+                    name = each.lstrip(".")
+                    parent = name.partition(".")[2]
+                    domains.extend((name, f"www.{name}", parent or name))
+                case "domain-keyword":
+                    domains.append(f"a{each}z.example")
+                case "ip-cidr" | "ip-cidr6":
+                    ips.append(_sample_ip(each, rng))
+                case "dest-port":
+                    lo, _, hi = str(each).partition("-")
+                    ports.append(rng.randint(int(lo), int(hi or lo)))
+                case _:
+                    pass
+
+    out: list[Request] = []
+    for _ in range(n):
+        port = rng.choice(ports) if rng.random() < 0.5 else None
+        match rng.randrange(3):
+            case 0:
+                out.append((rng.choice(domains), None, port))
+            case 1:
+                out.append((None, rng.choice(ips), port))
+            case _:
+                out.append((rng.choice(domains), rng.choice(ips), port))
+    return out
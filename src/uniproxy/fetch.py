@@ -0,0 +1,337 @@
+from __future__ import annotations
+
+from typing import Iterable, Mapping
+
+import asyncio
+import gzip
+import json
+import ssl
+import zlib
+from hashlib import sha256
+from pathlib import Path
+from urllib.parse import urljoin, urlsplit
+
+from attrs import define, field, frozen
+
+from uniproxy.surge.providers import ExternalPoliciesProvider
+from uniproxy.uniproxy.base import BaseProxyProvider, BaseRuleProvider
+
+type _Connection = tuple[asyncio.StreamReader, asyncio.StreamWriter]
+type _Origin = tuple[str, str, int]
+
+_REDIRECT_STATUS = frozenset((301, 302, 303, 307, 308))
+_MAX_LINE = 64 * 1024
+
+
+class FetchError(Exception):
+    """Raised for unexpected responses while fetching a URL."""
+
+    def __init__(self, url: str, reason: str) -> None:
+        super().__init__(f"Failed to fetch '{url}': {reason}")
+        self.url = url
+        self.reason = reason
+
+
+@frozen
+class FetchResult:
+    url: str
+    status: int
+    """Status of the last response, `304` if the cached content was reused."""
+    content: bytes
+    etag: str | None = None
+    last_modified: str | None = None
+
+    @property
+    def not_modified(self) -> bool:
+        return self.status == 304
+
+
+@frozen
+class _Response:
+    status: int
+    headers: Mapping[str, str]
+    content: bytes
+    reusable: bool
+
+
+def provider_url(provider: BaseProxyProvider | BaseRuleProvider) -> str:
+    """URL of a uniproxy or Surge provider."""
+    if isinstance(provider, ExternalPoliciesProvider):
+        return provider.policy_path
+    return provider.url
+
+
+@define
+class Fetcher:
+    """Asyncio HTTP/1.1 fetcher for provider URLs.
+
+    - Connections are kept alive and reused per origin.
+    - At most `per_host_limit` requests run concurrently against one origin.
+    - With a `cache_dir`, contents are stored on disk together with their
+      `ETag` and `Last-Modified` headers, and later fetches are conditional
+      requests which reuse the stored content on `304 Not Modified`.
+
+    Example:
+
+    ```python
+    async with Fetcher(cache_dir=Path("~/.cache/uniproxy").expanduser()) as f:
+        results = await f.fetch_providers(providers)
+    ```
+    """
+
+    cache_dir: Path | None = None
+    per_host_limit: int = 4
+    timeout: float = 30
+    max_redirects: int = 5
+    user_agent: str = "uniproxy"
+    ssl_context: ssl.SSLContext | None = None
+
+    _idle: dict[_Origin, list[_Connection]] = field(factory=dict, init=False)
+    _limits: dict[_Origin, asyncio.Semaphore] = field(factory=dict, init=False)
+
+    async def __aenter__(self) -> Fetcher:
+        return self
+
+    async def __aexit__(self, *exc_info: object) -> None:
+        await self.aclose()
+
+    async def aclose(self) -> None:
+        """Close all idle connections."""
+        idle = [conn for conns in self._idle.values() for conn in conns]
+        self._idle.clear()
+        for _, writer in idle:
+            writer.close()
+        for _, writer in idle:
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
+
+    async def fetch(self, url: str) -> FetchResult:
+        """Fetch a single URL, conditionally if its content is cached."""
+        cached = self._load_cache(url)
+        headers: dict[str, str] = {}
+        if cached is not None:
+            if cached.etag is not None:
+                headers["If-None-Match"] = cached.etag
+            if cached.last_modified is not None:
+                headers["If-Modified-Since"] = cached.last_modified
+
+        target = url
+        for _ in range(self.max_redirects + 1):
+            async with asyncio.timeout(self.timeout):
+                resp = await self._request(target, headers)
+            if resp.status in _REDIRECT_STATUS and "location" in resp.headers:
+                target = urljoin(target, resp.headers["location"])
+                continue
+            break
+        else:
+            raise FetchError(url, "too many redirects")
+
+        if resp.status == 304 and cached is not None:
+            return FetchResult(
+                url=url,
+                status=304,
+                content=cached.content,
+                etag=resp.headers.get("etag", cached.etag),
+                last_modified=resp.headers.get("last-modified", cached.last_modified),
+            )
+        if resp.status != 200:
+            raise FetchError(url, f"unexpected status {resp.status}")
+
+        result = FetchResult(
+            url=url,
+            status=resp.status,
+            content=resp.content,
+            etag=resp.headers.get("etag"),
+            last_modified=resp.headers.get("last-modified"),
+        )
+        self._store_cache(result)
+        return result
+
+    async def fetch_all(
+        self, urls: Iterable[str]
+    ) -> dict[str, FetchResult | BaseException]:
+        """Fetch many URLs concurrently.
+
+        Returns:
+          dict[str, FetchResult | BaseException]:
+            Results keyed by URL, failed fetches map to their exception.
+        """
+        unique = list(dict.fromkeys(urls))
+        results = await asyncio.gather(
+            *(self.fetch(url) for url in unique), return_exceptions=True
+        )
+        return dict(zip(unique, results))
+
+    async def fetch_providers(
+        self, providers: Iterable[BaseProxyProvider | BaseRuleProvider]
+    ) -> dict[str, FetchResult | BaseException]:
+        """Fetch the contents of providers, keyed by provider name.
+
+        Providers sharing a URL are fetched once.
+        """
+        providers = list(providers)
+        by_url = await self.fetch_all(provider_url(p) for p in providers)
+        return {p.name: by_url[provider_url(p)] for p in providers}
+
+    #
+    # HTTP/1.1
+    #
+
+    async def _request(self, url: str, headers: Mapping[str, str]) -> _Response:
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https") or not parts.hostname:
+            raise FetchError(url, "only absolute http(s) URLs are supported")
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        origin = (parts.scheme, parts.hostname, port)
+        path = parts.path or "/"
+        if parts.query:
+            path = f"{path}?{parts.query}"
+
+        host = parts.hostname if ":" not in parts.hostname else f"[{parts.hostname}]"
+        if port != (443 if parts.scheme == "https" else 80):
+            host = f"{host}:{port}"
+        lines = [
+            f"GET {path} HTTP/1.1",
+            f"Host: {host}",
+            f"User-Agent: {self.user_agent}",
+            "Accept-Encoding: gzip, deflate",
+            "Connection: keep-alive",
+            *(f"{k}: {v}" for k, v in headers.items()),
+        ]
+        request = ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+        limit = self._limits.setdefault(origin, asyncio.Semaphore(self.per_host_limit))
+        async with limit:
+            while True:
+                conn, reused = await self._acquire(origin)
+                try:
+                    resp = await self._exchange(conn, request)
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    conn[1].close()
+                    if reused:
+                        continue  # the server closed the idle connection, retry
+                    raise
+                except BaseException:
+                    conn[1].close()
+                    raise
+                if resp.reusable:
+                    self._idle.setdefault(origin, []).append(conn)
+                else:
+                    conn[1].close()
+                return resp
+
+    async def _acquire(self, origin: _Origin) -> tuple[_Connection, bool]:
+        idle = self._idle.get(origin)
+        while idle:
+            reader, writer = idle.pop()
+            if not (writer.is_closing() or reader.at_eof()):
+                return (reader, writer), True
+            writer.close()
+
+        scheme, hostname, port = origin
+        ctx = None
+        if scheme == "https":
+            ctx = self.ssl_context or ssl.create_default_context()
+        reader, writer = await asyncio.open_connection(
+            hostname, port, ssl=ctx, limit=_MAX_LINE
+        )
+        return (reader, writer), False
+
+    async def _exchange(self, conn: _Connection, request: bytes) -> _Response:
+        reader, writer = conn
+        writer.write(request)
+        await writer.drain()
+
+        status_line = await reader.readuntil(b"\r\n")
+        version, status, *_ = status_line.decode("latin-1").split(" ", 2)
+        headers: dict[str, str] = {}
+        while (line := await reader.readuntil(b"\r\n")) != b"\r\n":
+            key, _, value = line.decode("latin-1").partition(":")
+            headers[key.strip().lower()] = value.strip()
+
+        code = int(status)
+        connection = headers.get("connection", "").lower()
+        reusable = version == "HTTP/1.1" and connection != "close"
+        if code in (204, 304) or 100 <= code < 200:
+            content = b""
+        elif headers.get("transfer-encoding", "").lower() == "chunked":
+            content = await self._read_chunked(reader)
+        elif "content-length" in headers:
+            content = await reader.readexactly(int(headers["content-length"]))
+        else:
+            content = await reader.read()
+            reusable = False
+
+        match headers.get("content-encoding", "").lower():
+            case "gzip":
+                content = gzip.decompress(content)
+            case "deflate":
+                content = zlib.decompress(content)
+            case _:
+                pass
+        return _Response(
+            status=code, headers=headers, content=content, reusable=reusable
+        )
+
+    @staticmethod
+    async def _read_chunked(reader: asyncio.StreamReader) -> bytes:
+        chunks: list[bytes] = []
+        while True:
+            size_line = await reader.readuntil(b"\r\n")
+            size = int(size_line.split(b";", 1)[0], 16)
+            if size == 0:
+                # skip trailers
+                while await reader.readuntil(b"\r\n") != b"\r\n":
+                    pass
+                return b"".join(chunks)
+            chunks.append(await reader.readexactly(size))
+            await reader.readexactly(2)
+
+    #
+    # On-disk cache
+    #
+
+    def _cache_path(self, url: str) -> Path | None:
+        if self.cache_dir is None:
+            return None
+        return self.cache_dir / sha256(url.encode()).hexdigest()
+
+    def _load_cache(self, url: str) -> FetchResult | None:
+        path = self._cache_path(url)
+        if path is None:
+            return None
+        try:
+            meta = json.loads(path.with_suffix(".json").read_text())
+            content = path.with_suffix(".body").read_bytes()
+        except (OSError, ValueError):
+            return None
+        if meta.get("url") != url:
+            return None
+        return FetchResult(
+            url=url,
+            status=200,
+            content=content,
+            etag=meta.get("etag"),
+            last_modified=meta.get("last_modified"),
+        )
+
+    def _store_cache(self, result: FetchResult) -> None:
+        path = self._cache_path(result.url)
+        if path is None:
+            return
+        path.parent.mkdir(parents=True, exist_ok=True)
+        meta = {
+            "url": result.url,
+            "etag": result.etag,
+            "last_modified": result.last_modified,
+        }
+        # write the body first, so metadata never points to a partial body
+        for suffix, data in (
+            (".body", result.content),
+            (".json", json.dumps(meta).encode()),
+        ):
+            tmp = path.with_suffix(suffix + ".tmp")
+            tmp.write_bytes(data)
+            tmp.replace(path.with_suffix(suffix))
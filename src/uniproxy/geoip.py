@@ -0,0 +1,464 @@
+"""Compile GeoIP databases into per-country CIDR tables.
+
+Clients resolve `GEOIP` rules against their own, differently dated databases,
+and sing-box needs a `rs-geoip-xx` rule-set for each country. Compiling a
+local database once into CIDR tables makes country routing identical across
+clients, without any lookups at runtime:
+
+```python
+table = load_geoip("GeoLite2-Country.mmdb", cache_dir=".cache")
+rule_sets = geoip_rule_sets(table, ["cn"], "rule-sets")  # sing-box
+rules = expand_geoip_rules(rules, table)  # any backend
+```
+
+MaxMind DB files (`.mmdb`) are memory-mapped and their search tree walked
+once. CSV files hold either `network,country` or `first,last,country` rows,
+or are GeoLite2 `Blocks` files with a `Locations` file for the country codes.
+"""
+
+from __future__ import annotations
+
+from typing import Any, Iterable, Iterator, Literal, Mapping, Sequence
+
+import csv
+import hashlib
+import json
+import mmap
+import os
+import struct
+import tempfile
+from ipaddress import (
+    IPv4Address,
+    IPv6Address,
+    ip_address,
+    ip_network,
+    summarize_address_range,
+)
+from os import PathLike
+from pathlib import Path
+
+from attrs import frozen
+
+from uniproxy.singbox.route import LocalRuleSet
+from uniproxy.singbox.rule_sets import dumps_binary_rule_set, dumps_source_rule_set
+from uniproxy.uniproxy.rules import (
+    GeoIPRule,
+    IPCidr6GroupRule,
+    IPCidrGroupRule,
+    UniproxyRule,
+)
+
+type _Ranges = dict[str, list[tuple[int, int, int]]]
+"""IP version, first and last address of the networks of each country."""
+
+_METADATA_MARKER = b"\xab\xcd\xefMaxMind.com"
+
+_CACHE_VERSION = 1
+
+
+@frozen
+class GeoIPTable:
+    """Aggregated networks of every country of a GeoIP database."""
+
+    countries: Mapping[str, tuple[str, ...]]
+    """Networks by upper case ISO 3166 code, IPv4 ones first."""
+
+    def cidrs(self, country: str) -> tuple[str, ...]:
+        """Networks of `country`, empty if the database has none."""
+        return self.countries.get(country.upper(), ())
+
+
+def _aggregate(ranges: _Ranges) -> GeoIPTable:
+    countries: dict[str, tuple[str, ...]] = {}
+    for country in sorted(ranges):
+        cidrs: list[str] = []
+        for version, cls in ((4, IPv4Address), (6, IPv6Address)):
+            merged: list[list[int]] = []
+            for _, first, last in sorted(r for r in ranges[country] if r[0] == version):
+                if merged and first <= merged[-1][1] + 1:
+                    merged[-1][1] = max(merged[-1][1], last)
+                else:
+                    merged.append([first, last])
+            for first, last in merged:
+                networks = summarize_address_range(cls(first), cls(last))
+                cidrs.extend(str(n) for n in networks)
+        countries[country] = tuple(cidrs)
+    return GeoIPTable(countries=countries)
+
+
+#
+# MaxMind DB
+#
+
+
+class _MaxMindReader:
+    """Decoder of the MaxMind DB format, version 2."""
+
+    def __init__(self, buf: bytes | mmap.mmap) -> None:
+        self._buf = buf
+        start = buf.rfind(_METADATA_MARKER)
+        if start < 0:
+            raise ValueError("Not a MaxMind DB file")
+        start += len(_METADATA_MARKER)
+        metadata, _ = self._decode(start, start)
+        self.node_count: int = metadata["node_count"]
+        self.record_size: int = metadata["record_size"]
+        self.ip_version: int = metadata["ip_version"]
+        if self.record_size not in (24, 28, 32):
+            raise ValueError(f"Unsupported MaxMind DB record size: {self.record_size}")
+        self._node_bytes = self.record_size // 4
+        self._data = self._node_bytes * self.node_count + 16
+
+    def _decode(self, offset: int, base: int) -> tuple[Any, int]:
+        buf = self._buf
+        ctrl = buf[offset]
+        offset += 1
+        kind = ctrl >> 5
+        if kind == 1:  # pointer
+            size = ctrl >> 3 & 3
+            if size == 3:
+                pointer = int.from_bytes(buf[offset : offset + 4])
+            else:
+                pointer = (ctrl & 7) << 8 * (size + 1)
+                pointer |= int.from_bytes(buf[offset : offset + size + 1])
+                pointer += (0, 2048, 526336)[size]
+            value, _ = self._decode(base + pointer, base)
+            return value, offset + size + 1
+        if kind == 0:  # extended
+            kind = 7 + buf[offset]
+            offset += 1
+        size = ctrl & 0x1F
+        if size >= 29:
+            n = size - 28
+            size = (29, 285, 65821)[n - 1] + int.from_bytes(buf[offset : offset + n])
+            offset += n
+
+        end = offset + size
+        match kind:
+            case 2:
+                return bytes(buf[offset:end]).decode(), end
+            case 3:
+                return struct.unpack(">d", buf[offset:end])[0], end
+            case 4:
+                return bytes(buf[offset:end]), end
+            case 5 | 6 | 9 | 10:
+                return int.from_bytes(buf[offset:end]), end
+            case 7:
+                out: dict[str, Any] = {}
+                for _ in range(size):
+                    key, offset = self._decode(offset, base)
+                    out[key], offset = self._decode(offset, base)
+                return out, offset
+            case 8:
+                value = int.from_bytes(buf[offset:end])
+                return value - (1 << 32) if size == 4 and value >> 31 else value, end
+            case 11:
+                items: list[Any] = []
+                for _ in range(size):
+                    item, offset = self._decode(offset, base)
+                    items.append(item)
+                return items, offset
+            case 14:
+                return bool(size), offset
+            case 15:
+                return struct.unpack(">f", buf[offset:end])[0], end
+            case _:
+                raise ValueError(f"Unsupported MaxMind DB data type: {kind}")
+
+    def record(self, offset: int) -> Any:
+        """Data of a search tree record pointing past the nodes."""
+        return self._decode(self._data + offset, self._data)[0]
+
+    def _children(self, node: int) -> tuple[int, int]:
+        n = self._node_bytes
+        raw = self._buf[node * n : node * n + n]
+        match self.record_size:
+            case 24:
+                return int.from_bytes(raw[:3]), int.from_bytes(raw[3:])
+            case 28:
+                left = (raw[3] & 0xF0) << 20 | int.from_bytes(raw[:3])
+                return left, (raw[3] & 0x0F) << 24 | int.from_bytes(raw[4:])
+            case _:
+                return int.from_bytes(raw[:4]), int.from_bytes(raw[4:])
+
+    def networks(self) -> Iterator[tuple[int, int, int, int]]:
+        """IP version, first and last address, and data offset of each network."""
+        count = self.node_count
+        bits = 128 if self.ip_version == 6 else 32
+        # IPv4 lives at ::/96 of IPv6 trees, aliased from ::ffff:0:0/96 and
+        # 2002::/16, which must not be reported twice
+        ipv4 = 0
+        for _ in range(96 if bits == 128 else 0):
+            if ipv4 >= count:
+                break
+            ipv4 = self._children(ipv4)[0]
+
+        stack = [(0, 0, 0)]
+        while stack:
+            record, depth, value = stack.pop()
+            if record < count:
+                if record == ipv4 and value and bits == 128:
+                    continue
+                left, right = self._children(record)
+                stack.append((right, depth + 1, value | 1 << (bits - depth - 1)))
+                stack.append((left, depth + 1, value))
+            elif record > count:
+                last = value | (1 << (bits - depth)) - 1
+                if bits == 128 and depth >= 96 and value >> 32 == 0:
+                    yield 4, value, last, record - count - 16
+                else:
+                    yield (6 if bits == 128 else 4), value, last, record - count - 16
+
+
+def _mmdb_country(data: Any) -> str | None:
+    if not isinstance(data, dict):
+        return None
+    for key in ("country", "registered_country"):
+        match data.get(key):
+            case str(code):
+                return code
+            case {"iso_code": str(code)}:
+                return code
+            case _:
+                pass
+    return None
+
+
+def load_mmdb(path: str | PathLike[str]) -> GeoIPTable:
+    """Build the CIDR table of a MaxMind DB file, e.g. `GeoLite2-Country.mmdb`.
+
+    The country of a network is `country.iso_code`, or
+    `registered_country.iso_code` if missing. Plain string `country` values,
+    as written by some other vendors, are accepted as well.
+
+    Raises:
+      ValueError: If `path` is not a supported MaxMind DB file.
+    """
+    ranges: _Ranges = {}
+    with (
+        open(path, "rb") as f,
+        mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf,
+    ):
+        reader = _MaxMindReader(buf)
+        countries: dict[int, str | None] = {}
+        for version, first, last, offset in reader.networks():
+            if offset not in countries:
+                countries[offset] = _mmdb_country(reader.record(offset))
+            country = countries[offset]
+            if country:
+                ranges.setdefault(country.upper(), []).append((version, first, last))
+    return _aggregate(ranges)
+
+
+#
+# CSV
+#
+
+
+def _address(value: str) -> tuple[int, int] | None:
+    """IP version and integer value, for addresses or integers as in IP2Location."""
+    value = value.strip()
+    if value.isdigit():
+        number = int(value)
+        return (4 if number < 1 << 32 else 6), number
+    try:
+        address = ip_address(value)
+    except ValueError:
+        return None
+    return address.version, int(address)
+
+
+def load_csv(
+    path: str | PathLike[str], locations: str | PathLike[str] | None = None
+) -> GeoIPTable:
+    """Build the CIDR table of a CSV file.
+
+    Rows are `network,country[,...]` or `first,last,country[,...]`, where
+    addresses may be given as integers. Header rows and rows of unknown
+    countries (`-`, `ZZ`) are skipped.
+
+    For GeoLite2 `Blocks` files, whose header has `network` and `geoname_id`
+    columns, `locations` is the matching `Locations` file mapping the ids to
+    country codes.
+
+    Raises:
+      ValueError: If a GeoLite2 `Blocks` file is given without `locations`.
+    """
+    ranges: _Ranges = {}
+
+    def add(country: str, version: int, first: int, last: int) -> None:
+        country = country.strip().upper()
+        if country and country not in ("-", "ZZ"):
+            ranges.setdefault(country, []).append((version, first, last))
+
+    with open(path, newline="", encoding="utf-8") as f:
+        rows: Iterable[list[str]] = csv.reader(f)
+        header = next(iter(rows), [])
+        if "network" in header and "geoname_id" in header:
+            if locations is None:
+                raise ValueError("GeoLite2 Blocks files need their Locations file")
+            with open(locations, newline="", encoding="utf-8") as lf:
+                codes = {
+                    row["geoname_id"]: row["country_iso_code"]
+                    for row in csv.DictReader(lf)
+                }
+            network_at = header.index("network")
+            ids = [
+                header.index(name)
+                for name in ("geoname_id", "registered_country_geoname_id")
+                if name in header
+            ]
+            for row in rows:
+                net = ip_network(row[network_at])
+                # continent level locations, e.g. EU, have no country code
+                country = next((codes[row[i]] for i in ids if codes.get(row[i])), "")
+                first = int(net.network_address)
+                add(country, net.version, first, int(net.broadcast_address))
+            return _aggregate(ranges)
+
+        for row in [header, *rows]:
+            if len(row) < 2:
+                continue
+            if (
+                len(row) >= 3
+                and (first := _address(row[0]))
+                and (last := _address(row[1]))
+            ):
+                version = 6 if 6 in (first[0], last[0]) else 4
+                add(row[2], version, first[1], last[1])
+                continue
+            try:
+                net = ip_network(row[0].strip(), strict=False)
+            except ValueError:
+                continue  # header
+            first = int(net.network_address)
+            add(row[1], net.version, first, int(net.broadcast_address))
+    return _aggregate(ranges)
+
+
+def load_geoip(
+    path: str | PathLike[str],
+    cache_dir: str | PathLike[str] | None = None,
+    locations: str | PathLike[str] | None = None,
+) -> GeoIPTable:
+    """Build the CIDR table of a MaxMind DB or, for `.csv` files, CSV file.
+
+    Tables are cached as JSON in `cache_dir`, keyed by the path, size and
+    modification time of the database, so a database is compiled only once.
+
+    See `load_mmdb` and `load_csv`.
+    """
+    path = Path(path)
+    cache: Path | None = None
+    if cache_dir is not None:
+        key = ":".join(
+            f"{p.resolve()}:{p.stat().st_size}:{p.stat().st_mtime_ns}"
+            for p in (path, *([Path(locations)] if locations else []))
+        )
+        digest = hashlib.sha256(key.encode()).hexdigest()[:16]
+        cache = Path(cache_dir) / f"geoip-{digest}.json"
+        try:
+            data = json.loads(cache.read_text(encoding="utf-8"))
+            if data["version"] == _CACHE_VERSION:
+                return GeoIPTable(
+                    countries={k: tuple(v) for k, v in data["countries"].items()}
+                )
+        except (OSError, ValueError, KeyError, TypeError, AttributeError):
+            pass  # missing or corrupt, compile again
+
+    if path.suffix.lower() == ".csv":
+        table = load_csv(path, locations)
+    else:
+        table = load_mmdb(path)
+
+    if cache is not None:
+        cache.parent.mkdir(parents=True, exist_ok=True)
+        data = {"version": _CACHE_VERSION, "countries": dict(table.countries)}
+        # concurrent writers each replace the cache with a complete file
+        fd, tmp = tempfile.mkstemp(dir=cache.parent, prefix=cache.name, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(data, f, separators=(",", ":"))
+            os.replace(tmp, cache)
+        except BaseException:
+            Path(tmp).unlink(missing_ok=True)
+            raise
+    return table
+
+
+#
+# Compiling
+#
+
+
+def geoip_rule_sets(
+    table: GeoIPTable,
+    countries: Iterable[str],
+    directory: str | PathLike[str],
+    format: Literal["binary", "source"] = "binary",
+) -> list[LocalRuleSet]:
+    """Write a local sing-box rule-set per country.
+
+    Rule-sets are tagged `rs-geoip-<country>`, as referenced by the sing-box
+    rules converted from `GeoIPRule`, and written to
+    `directory/<tag>.srs` (or `.json` for the source format).
+
+    Raises:
+      ValueError: If the table has no networks of a country.
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    rule_sets: list[LocalRuleSet] = []
+    for country in countries:
+        cidrs = table.cidrs(country)
+        if not cidrs:
+            raise ValueError(f"No networks of country '{country}' in GeoIP table")
+        tag = f"rs-geoip-{country}".lower()
+        headless = [{"ip_cidr": list(cidrs)}]
+        if format == "binary":
+            path = directory / f"{tag}.srs"
+            path.write_bytes(dumps_binary_rule_set(headless))
+        else:
+            path = directory / f"{tag}.json"
+            path.write_text(dumps_source_rule_set(headless), encoding="utf-8")
+        rule_sets.append(LocalRuleSet(tag=tag, format=format, path=str(path)))
+    return rule_sets
+
+
+def expand_geoip_rules(
+    rules: Sequence[UniproxyRule], table: GeoIPTable
+) -> list[UniproxyRule]:
+    """Replace `GeoIPRule` by the CIDR groups of its country.
+
+    Each `GeoIPRule` becomes an `IPCidrGroupRule` and an `IPCidr6GroupRule`
+    of the same policy and `no_resolve` flag, for the families the country
+    has networks of, so every backend converts it. Large groups are best
+    moved out of the configuration with e.g. `compile_uniproxy_rule_sets`,
+    `compile_mrs_providers` or `make_rules_from_uniproxy_external`.
+
+    Raises:
+      ValueError: If the table has no networks of a country.
+    """
+    out: list[UniproxyRule] = []
+    for rule in rules:
+        if not isinstance(rule, GeoIPRule):
+            out.append(rule)
+            continue
+        cidrs = table.cidrs(rule.matcher)
+        if not cidrs:
+            raise ValueError(f"No networks of country '{rule.matcher}' in GeoIP table")
+        ipv4 = [c for c in cidrs if ":" not in c]
+        ipv6 = [c for c in cidrs if ":" in c]
+        if ipv4:
+            out.append(
+                IPCidrGroupRule(
+                    matcher=ipv4, policy=rule.policy, no_resolve=rule.no_resolve
+                )
+            )
+        if ipv6:
+            out.append(
+                IPCidr6GroupRule(
+                    matcher=ipv6, policy=rule.policy, no_resolve=rule.no_resolve
+                )
+            )
+    return out
@@ -0,0 +1,349 @@
+from __future__ import annotations
+
+from typing import Any, Mapping, Sequence
+
+from ipaddress import IPv4Address, IPv4Network, IPv6Address, ip_network
+from socket import AF_INET, AF_INET6, inet_pton
+
+from attrs import fields, frozen
+
+from uniproxy.analysis import _SINGBOX_ACTION_FIELDS, _port_range
+from uniproxy.clash.rules import ClashRule
+from uniproxy.optimize import DomainTrie
+from uniproxy.singbox.route_rules import RejectRule, RouteRule
+from uniproxy.singbox.route_rules import Rule as SingBoxRule
+from uniproxy.surge.rules import SurgeRule
+from uniproxy.uniproxy.base import BaseGroupRule
+from uniproxy.uniproxy.rules import UniproxyRule
+from uniproxy.utils import to_name
+
+_SINGBOX_TYPES: Mapping[str, tuple[str, str]] = {
+    "domain": ("destination", "domain"),
+    "domain_suffix": ("destination", "domain-suffix"),
+    "domain_keyword": ("destination", "domain-keyword"),
+    "domain_regex": ("destination", ""),
+    "ip_cidr": ("destination", "ip-cidr"),
+    "ip_is_private": ("destination", ""),
+    "port": ("port", "dest-port"),
+    "port_range": ("port", "dest-port"),
+    "process_name": ("process_name", "process-name"),
+}
+"""Group of sing-box rule fields ORed together, and the equal uniproxy type.
+
+Fields of different groups are ANDed. Fields not listed are groups of their
+own, `process_name` being the only one which can be compiled.
+"""
+
+_NONE = 1 << 62
+"""Index larger than every rule index, for branch-free `min`."""
+
+
+@frozen
+class RuleMatch:
+    """The rule deciding a request, see `RuleMatcher.match`."""
+
+    index: int
+    """Index of the winning rule in the compiled list."""
+    policy: str
+
+
+class KeywordAutomaton:
+    """Aho-Corasick automaton over keywords, finding the earliest rule.
+
+    Every keyword carries the index of the rule it belongs to. A search scans
+    the text once and returns the lowest index of all keywords occurring in it,
+    however many there are.
+    """
+
+    def __init__(self) -> None:
+        self._goto: list[dict[str, int]] = [{}]
+        self._fail: list[int] = [0]
+        self._out: list[int] = [_NONE]
+        self._built = True
+
+    def add(self, keyword: str, index: int) -> None:
+        state = 0
+        for char in keyword.lower():
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append(_NONE)
+            state = next_state
+        self._out[state] = min(self._out[state], index)
+        self._built = False
+
+    def build(self) -> None:
+        """Compute failure links, called on the first search after `add`."""
+        goto, fail, out = self._goto, self._fail, self._out
+        queue = list(goto[0].values())
+        for state in queue:
+            fail[state] = 0
+        # breadth first, so failure targets are always complete
+        for state in queue:
+            for char, child in goto[state].items():
+                target = fail[state]
+                while target and char not in goto[target]:
+                    target = fail[target]
+                fail[child] = goto[target].get(char, 0)
+                out[child] = min(out[child], out[fail[child]])
+                queue.append(child)
+        self._built = True
+
+    def search(self, text: str) -> int | None:
+        """Lowest index of the keywords occurring in `text`."""
+        if not self._built:
+            self.build()
+        goto, fail, out = self._goto, self._fail, self._out
+        best = _NONE
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if out[state] < best:
+                best = out[state]
+        return None if best == _NONE else best
+
+
+class PrefixTable:
+    """Level-compressed prefix tree of IP networks.
+
+    Networks are grouped by family and prefix length into hash tables keyed by
+    the network bits, so a lookup takes one shift and one hash probe per
+    distinct prefix length instead of a walk over every bit.
+    """
+
+    def __init__(self) -> None:
+        self._tables: dict[int, dict[int, dict[int, int]]] = {4: {}, 6: {}}
+
+    def add(self, network: str, index: int) -> None:
+        net = ip_network(network.strip(), strict=False)
+        family, bits = (4, 32) if isinstance(net, IPv4Network) else (6, 128)
+        shift = bits - net.prefixlen
+        table = self._tables[family].setdefault(shift, {})
+        table.setdefault(int(net.network_address) >> shift, index)
+
+    def lookup(self, ip: str | IPv4Address | IPv6Address) -> int | None:
+        """Lowest index of the networks containing `ip`.
+
+        Raises:
+          ValueError: If `ip` is not a valid IP address.
+        """
+        if isinstance(ip, str):
+            # much faster than `ipaddress.ip_address`
+            try:
+                value, family = int.from_bytes(inet_pton(AF_INET, ip)), 4
+            except OSError:
+                try:
+                    value, family = int.from_bytes(inet_pton(AF_INET6, ip)), 6
+                except OSError:
+                    raise ValueError(f"{ip!r} is not a valid IP address") from None
+        else:
+            value, family = int(ip), ip.version
+        best = _NONE
+        for shift, table in self._tables[family].items():
+            index = table.get(value >> shift, _NONE)
+            if index < best:
+                best = index
+        return None if best == _NONE else best
+
+
+class RuleMatcher:
+    """Decide requests offline against a compiled list of rules.
+
+    Rules are compiled once into indexes: a `DomainTrie` for `DOMAIN` and
+    `DOMAIN-SUFFIX`, a `KeywordAutomaton` for `DOMAIN-KEYWORD`, a `PrefixTable`
+    per resolving behaviour for `IP-CIDR` and `IP-CIDR6`, and hash tables for
+    `DEST-PORT` and `PROCESS-NAME`. Each index yields the earliest rule
+    matching its part of a request, the winner is the earliest of those, or
+    the `FinalRule`.
+
+    Other rule types (`GEOIP`, `USER-AGENT`, logical rules, ...) cannot be
+    decided from the request fields and are skipped, see `skipped`. Surge and
+    Clash rules are compiled alike, sing-box rules with `from_singbox`.
+
+    Example:
+
+    ```python
+    matcher = RuleMatcher(rules)
+    hit = matcher.match(domain="api.foo.com", port=443, process="curl")
+    print(hit.policy, rules[hit.index])
+    ```
+    """
+
+    def __init__(
+        self,
+        rules: Sequence[UniproxyRule | SurgeRule | ClashRule],
+        cache_size: int = 65536,
+    ) -> None:
+        self._policies: list[str] = []
+        self._domains = DomainTrie()
+        self._keywords = KeywordAutomaton()
+        self._has_keywords = False
+        # `no_resolve` rules never match domain requests
+        self._resolving = PrefixTable()
+        self._ips = PrefixTable()
+        self._ports: dict[int, int] = {}
+        self._processes: dict[str, int] = {}
+        self._final = _NONE
+        self._cache_size = cache_size
+        self._domain_cache: dict[str, int] = {}
+        self._matches: dict[int, RuleMatch] = {}
+        self._skipped: list[int] = []
+
+        # Surge and Clash rules share the types and fields of uniproxy rules
+        for index, rule in enumerate(rules):
+            self._policies.append(to_name(rule.policy))
+            matchers = (
+                list(rule.matcher)
+                if isinstance(rule, BaseGroupRule)
+                else [getattr(rule, "matcher", None)]
+            )
+            no_resolve = bool(getattr(rule, "no_resolve", None))
+            self._add(index, rule.type.removesuffix("-group"), matchers, no_resolve)
+        self._keywords.build()
+
+    @classmethod
+    def from_singbox(
+        cls,
+        rules: Sequence[SingBoxRule],
+        final: str | None = None,
+        cache_size: int = 65536,
+    ) -> RuleMatcher:
+        """Compile sing-box route rules, `final` being the `route.final` outbound.
+
+        Only rules matching on fields of a single group (e.g. `domain`,
+        `domain_suffix` and `ip_cidr`, which are ORed) are compiled, rules
+        with fields of several groups, `rule_set` or `invert` are skipped.
+        `ip_cidr` never matches domain requests, as without a `resolve`
+        action sing-box does not look the domain up. The policy of a
+        `RejectRule` is `REJECT`, or `REJECT-DROP` for the `drop` method.
+        """
+        self = cls([], cache_size=cache_size)
+        for index, rule in enumerate(rules):
+            if isinstance(rule, RejectRule):
+                policy = "REJECT-DROP" if rule.method == "drop" else "REJECT"
+            else:
+                policy = getattr(rule, "outbound", "")
+            self._policies.append(policy)
+            if not isinstance(rule, (RouteRule, RejectRule)):
+                self._skipped.append(index)
+                continue
+
+            entries: list[tuple[str, list[Any]]] = []
+            groups: set[str] = set()
+            for attr in fields(type(rule)):
+                value = getattr(rule, attr.name)
+                if value is None or attr.name in _SINGBOX_ACTION_FIELDS:
+                    continue
+                group, typ = _SINGBOX_TYPES.get(attr.name, (attr.name, ""))
+                groups.add(group)
+                matchers = [value] if isinstance(value, (str, int)) else list(value)
+                entries.append((typ, matchers))
+            if len(groups) != 1 or not all(typ for typ, _ in entries):
+                self._skipped.append(index)
+                continue
+            for typ, matchers in entries:
+                self._add(index, typ, matchers, no_resolve=True)
+
+        if final is not None:
+            self._final = len(self._policies)
+            self._policies.append(final)
+        self._keywords.build()
+        return self
+
+    @property
+    def skipped(self) -> tuple[int, ...]:
+        """Indices of rules which cannot be decided and never match."""
+        return tuple(self._skipped)
+
+    def _add(self, index: int, typ: str, matchers: list[Any], no_resolve: bool) -> None:
+        match typ:
+            case "domain":
+                for each in matchers:
+                    self._domains.add_domain(each, index)
+            case "domain-suffix":
+                for each in matchers:
+                    self._domains.add_suffix(each, index)
+            case "domain-keyword":
+                for each in matchers:
+                    self._keywords.add(each, index)
+                self._has_keywords = True
+            case "ip-cidr" | "ip-cidr6":
+                for each in matchers:
+                    self._ips.add(each, index)
+                    if not no_resolve:
+                        self._resolving.add(each, index)
+            case "dest-port":
+                for each in matchers:
+                    lo, hi = _port_range(each)
+                    for port in range(lo, hi + 1):
+                        self._ports.setdefault(port, index)
+            case "process-name":
+                for each in matchers:
+                    self._processes.setdefault(each, index)
+            case "final":
+                self._final = min(self._final, index)
+            case _:
+                self._skipped.append(index)
+
+    def _domain_index(self, domain: str) -> int:
+        name = domain.lower().rstrip(".")
+        covering = self._domains.covering_domain(name)
+        index = _NONE if covering is None else covering
+        if self._has_keywords:
+            keyword = self._keywords.search(name)
+            if keyword is not None and keyword < index:
+                index = keyword
+        if len(self._domain_cache) >= self._cache_size:
+            self._domain_cache.clear()
+        self._domain_cache[domain] = index
+        return index
+
+    def match(
+        self,
+        domain: str | None = None,
+        ip: str | IPv4Address | IPv6Address | None = None,
+        port: int | None = None,
+        process: str | None = None,
+    ) -> RuleMatch | None:
+        """The rule deciding a request, `None` if no rule matches.
+
+        Args:
+          domain: Requested host name.
+          ip: Destination address. For domain requests, the address the
+            domain resolved to, which `no_resolve` rules do not look at.
+          port: Destination port.
+          process: Name or path of the process making the request.
+        """
+        index = self._final
+        if domain is not None:
+            found = self._domain_cache.get(domain)
+            if found is None:
+                found = self._domain_index(domain)
+            if found < index:
+                index = found
+        if ip is not None:
+            table = self._ips if domain is None else self._resolving
+            found = table.lookup(ip)
+            if found is not None and found < index:
+                index = found
+        if port is not None:
+            found = self._ports.get(port, _NONE)
+            if found < index:
+                index = found
+        if process is not None:
+            found = self._processes.get(process, _NONE)
+            if found == _NONE:
+                found = self._processes.get(process.rpartition("/")[2], _NONE)
+            if found < index:
+                index = found
+        if index == _NONE:
+            return None
+        hit = self._matches.get(index)
+        if hit is None:
+            hit = self._matches[index] = RuleMatch(index, self._policies[index])
+        return hit
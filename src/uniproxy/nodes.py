@@ -0,0 +1,368 @@
+from __future__ import annotations
+
+from typing import Any, Hashable, Iterable, Mapping, Sequence, TypeVar
+
+import re
+from enum import Enum
+from ipaddress import IPv4Address, IPv6Address, ip_address
+from pathlib import Path
+
+from attrs import define, evolve, field, fields, frozen, has
+
+from uniproxy.uniproxy.base import BaseProtocol, BaseProxyProvider
+
+P = TypeVar("P", bound=BaseProtocol)
+
+_IDENTITY_FIELDS: dict[type, tuple[str, ...]] = {}
+
+
+def _identity_fields(cls: type) -> tuple[str, ...]:
+    try:
+        return _IDENTITY_FIELDS[cls]
+    except KeyError:
+        names = tuple(f.name for f in fields(cls) if f.name != "name")
+        _IDENTITY_FIELDS[cls] = names
+        return names
+
+
+def _canonical_server(server: str | IPv4Address | IPv6Address) -> str:
+    if isinstance(server, str):
+        server = server.strip().rstrip(".").lower()
+        try:
+            # `::0:1` and `::1` are the same node
+            return ip_address(server).compressed
+        except ValueError:
+            return server
+    return server.compressed
+
+
+def _freeze(value: Any) -> Hashable:
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    elif has(type(value)):
+        cls = type(value)
+        return (
+            cls.__name__,
+            *(_freeze(getattr(value, n)) for n in _identity_fields(cls)),
+        )
+    elif isinstance(value, dict):
+        return tuple(sorted((str(k), _freeze(v)) for k, v in value.items()))
+    elif isinstance(value, (list, tuple)):
+        return tuple(_freeze(each) for each in value)
+    elif isinstance(value, (set, frozenset)):
+        return tuple(sorted(_freeze(each) for each in value))
+    elif isinstance(value, (IPv4Address, IPv6Address, Path)):
+        return str(value)
+    elif isinstance(value, Enum):
+        return value.value
+    else:
+        return repr(value)
+
+
+def protocol_identity(protocol: BaseProtocol) -> tuple[Hashable, ...]:
+    """Canonical identity of the node behind a protocol.
+
+    Two protocols with the same identity connect to the same server with the
+    same credentials, transport and TLS settings. Only the `name` is ignored,
+    the server is lowercased and IP addresses are normalized.
+    """
+    cls = type(protocol)
+    return (
+        cls.__name__,
+        *(
+            _canonical_server(protocol.server)
+            if n == "server"
+            else _freeze(getattr(protocol, n))
+            for n in _identity_fields(cls)
+        ),
+    )
+
+
+@frozen
+class DroppedProtocol:
+    """A protocol removed by `dedup_protocols`."""
+
+    protocol: BaseProtocol
+    duplicate_of: BaseProtocol
+    """The protocol with the same identity which is kept."""
+
+
+def dedup_protocols(
+    protocols: Iterable[P], *, suffix: str = " #{n}"
+) -> tuple[list[P], list[DroppedProtocol]]:
+    """Remove protocols pointing to the same node, keeping the first occurrence.
+
+    Duplicates are found with a hash index on `protocol_identity`, so the cost is
+    linear in the number of protocols. Distinct nodes sharing a name get a
+    deterministic suffix (`HK 01`, `HK 01 #2`, `HK 01 #3`, ...) in input order,
+    renamed protocols are copies, the inputs are never mutated.
+
+    Example:
+
+    ```python
+    protocols, dropped = dedup_protocols(chain(provider_a, provider_b))
+    for each in dropped:
+        print(f"{each.protocol.name} is a duplicate of {each.duplicate_of.name}")
+    ```
+
+    Args:
+      protocols (Iterable[BaseProtocol]):
+        Protocols in order of preference.
+      suffix (str):
+        Format of the suffix appended to colliding names, `{n}` is replaced with
+        the occurrence of the name starting from 2.
+
+    Returns:
+      tuple[list[BaseProtocol], list[DroppedProtocol]]:
+        Unique protocols in input order and the dropped duplicates.
+    """
+    index: dict[tuple[Hashable, ...], P] = {}
+    dropped: list[DroppedProtocol] = []
+    for protocol in protocols:
+        key = protocol_identity(protocol)
+        first = index.get(key)
+        if first is None:
+            index[key] = protocol
+        else:
+            dropped.append(DroppedProtocol(protocol=protocol, duplicate_of=first))
+
+    kept: list[P] = []
+    taken = {p.name for p in index.values()}
+    seen: dict[str, int] = {}
+    for protocol in index.values():
+        name = protocol.name
+        count = seen.get(name, 0) + 1
+        seen[name] = count
+        if count > 1:
+            renamed = name + suffix.format(n=count)
+            while renamed in taken:
+                count += 1
+                renamed = name + suffix.format(n=count)
+            seen[name] = count
+            taken.add(renamed)
+            protocol = evolve(protocol, name=renamed)
+        kept.append(protocol)
+    return kept, dropped
+
+
+@frozen
+class ProtocolDiff:
+    """Changes between two collections of protocols, see `diff_protocols`."""
+
+    added: list[BaseProtocol]
+    removed: list[BaseProtocol]
+    modified: list[tuple[BaseProtocol, BaseProtocol]]
+    """Pairs of `(previous, current)` protocols."""
+
+    def __bool__(self) -> bool:
+        return bool(self.added or self.removed or self.modified)
+
+
+def diff_protocols(
+    previous: Iterable[BaseProtocol], current: Iterable[BaseProtocol]
+) -> ProtocolDiff:
+    """Compare the protocols of two refreshes of a provider.
+
+    Protocols are matched by name first. A protocol with the same name but a
+    different `protocol_identity` is modified, and so is a protocol which kept its
+    identity under a new name. Everything else is added or removed. Both inputs
+    are indexed once, so the cost is linear in their sizes.
+
+    Example:
+
+    ```python
+    diff = diff_protocols(cached, fresh)
+    if not diff:
+        return  # nothing to regenerate
+    ```
+
+    Returns:
+      ProtocolDiff:
+        `added` and `modified` follow the order of `current`, `removed` follows
+        the order of `previous`.
+    """
+    previous_by_name = {p.name: p for p in previous}
+
+    modified: list[tuple[BaseProtocol, BaseProtocol]] = []
+    unmatched: list[tuple[tuple[Hashable, ...], BaseProtocol]] = []
+    matched_names: set[str] = set()
+    for protocol in current:
+        before = previous_by_name.get(protocol.name)
+        if before is None:
+            unmatched.append((protocol_identity(protocol), protocol))
+            continue
+        matched_names.add(protocol.name)
+        if protocol_identity(before) != protocol_identity(protocol):
+            modified.append((before, protocol))
+
+    # protocols only renamed are found by their identity
+    gone: dict[tuple[Hashable, ...], list[BaseProtocol]] = {}
+    for name, p in previous_by_name.items():
+        if name not in matched_names:
+            gone.setdefault(protocol_identity(p), []).append(p)
+
+    added: list[BaseProtocol] = []
+    renamed: set[str] = set()
+    for identity, protocol in unmatched:
+        candidates = gone.get(identity)
+        if candidates:
+            before = candidates.pop(0)
+            renamed.add(before.name)
+            modified.append((before, protocol))
+        else:
+            added.append(protocol)
+
+    removed = [
+        p
+        for name, p in previous_by_name.items()
+        if name not in matched_names and name not in renamed
+    ]
+    return ProtocolDiff(added=added, removed=removed, modified=modified)
+
+
+@frozen
+class NodeFilter:
+    """Regex filter on protocol names.
+
+    A name passes if any `include` pattern matches (or `include` is empty) and
+    no `exclude` pattern matches. Patterns are searched anywhere in the name,
+    like `ProxyProvider.filter`.
+    """
+
+    include: Sequence[str] = ()
+    exclude: Sequence[str] = ()
+
+    @classmethod
+    def from_provider(cls, provider: BaseProxyProvider) -> NodeFilter:
+        pattern = getattr(provider, "filter", None)
+        return cls(include=() if pattern is None else (pattern,))
+
+
+_GLOBAL_FLAGS = re.compile(r"^\(\?([aiLmsux]+)\)")
+_BACKREFERENCE = re.compile(r"\\[1-9]")
+
+
+def _scoped(pattern: str) -> str:
+    # Go style `(?i)hk|hong kong` filters are common, but global flags must be
+    # at the start of the whole expression, so turn them into scoped flags.
+    if m := _GLOBAL_FLAGS.match(pattern):
+        return f"(?{m[1]}:{pattern[m.end() :]})"
+    return f"(?:{pattern})"
+
+
+@define
+class FilterEngine:
+    """Assign protocols to groups by name with one fused regex scan.
+
+    Every distinct pattern of all filters is compiled once into a single
+    expression, made of one optional lookahead per pattern. Matching a name
+    against it tells at once which patterns match, and so every group the
+    protocol belongs to.
+
+    Example:
+
+    ```python
+    engine = FilterEngine({
+        "HK": NodeFilter(include=["(?i)hk|hong kong"]),
+        "JP": NodeFilter(include=["(?i)jp|japan"], exclude=["(?i)test"]),
+        "All": NodeFilter(exclude=["(?i)expire|traffic"]),
+    })
+    groups = engine.assign(protocols)  # {"HK": [...], "JP": [...], "All": [...]}
+    ```
+    """
+
+    filters: Mapping[str, NodeFilter]
+
+    _patterns: list[str] = field(init=False, factory=list)
+    _compiled: list[re.Pattern[str]] = field(init=False, factory=list)
+    _fused: re.Pattern[str] | None = field(init=False, default=None)
+    _bits: tuple[int, ...] = field(init=False, default=())
+    """Bit of the pattern for each group of the fused expression, `0` for the
+    groups of the patterns themselves."""
+    _separate: list[tuple[int, re.Pattern[str]]] = field(init=False, factory=list)
+    """Bits and patterns which are searched on their own."""
+    _plan: list[tuple[str, int, int]] = field(init=False, factory=list)
+    """Group names with the bit masks of their include and exclude patterns."""
+    _groups_by_mask: dict[int, list[str]] = field(init=False, factory=dict)
+
+    def __attrs_post_init__(self) -> None:
+        index: dict[str, int] = {}
+        for group, node_filter in self.filters.items():
+            include = exclude = 0
+            for p in node_filter.include:
+                include |= 1 << index.setdefault(p, len(index))
+            for p in node_filter.exclude:
+                exclude |= 1 << index.setdefault(p, len(index))
+            self._plan.append((group, include, exclude))
+        self._patterns = list(index)
+        # fail early on invalid patterns, and keep them for the fallback
+        self._compiled = [re.compile(p) for p in self._patterns]
+
+        # numbered backreferences would point to other groups once fused
+        fusable = [
+            i for i, p in enumerate(self._patterns) if not _BACKREFERENCE.search(p)
+        ]
+        try:
+            fused = re.compile(
+                # only the injected prefix crosses newlines, user patterns keep
+                # the flags they have when searched on their own
+                "".join(
+                    f"(?:(?=(?s:.*?){_scoped(self._patterns[i])}(?P<_{i}>))|)"
+                    for i in fusable
+                )
+            )
+        except re.error:
+            fusable = []
+        else:
+            bits = [0] * fused.groups
+            for i in fusable:
+                bits[fused.groupindex[f"_{i}"] - 1] = 1 << i
+            self._fused = fused
+            self._bits = tuple(bits)
+        fused_set = set(fusable)
+        self._separate = [
+            (1 << i, p) for i, p in enumerate(self._compiled) if i not in fused_set
+        ]
+
+    def _mask(self, name: str) -> int:
+        """Bit mask of the patterns matching the name."""
+        mask = 0
+        if self._fused is not None:
+            m = self._fused.match(name)
+            assert m is not None  # every lookahead is optional
+            for bit, group in zip(self._bits, m.groups()):
+                if group is not None:
+                    mask |= bit
+        for bit, pattern in self._separate:
+            if pattern.search(name) is not None:
+                mask |= bit
+        return mask
+
+    def match(self, name: str) -> list[str]:
+        """Names of the groups accepting the given protocol name."""
+        mask = self._mask(name)
+        # names often match the same patterns, e.g. all nodes of a region
+        groups = self._groups_by_mask.get(mask)
+        if groups is None:
+            groups = [
+                group
+                for group, include, exclude in self._plan
+                if (not include or mask & include) and not mask & exclude
+            ]
+            self._groups_by_mask[mask] = groups
+        return groups
+
+    def assign(self, protocols: Iterable[P]) -> dict[str, list[P]]:
+        """Assign every protocol to all groups accepting it, in a single pass."""
+        groups: dict[str, list[P]] = {group: [] for group, _, _ in self._plan}
+        for protocol in protocols:
+            for group in self.match(protocol.name):
+                groups[group].append(protocol)
+        return groups
+
+
+def filter_protocols(protocols: Iterable[P], node_filter: NodeFilter | str) -> list[P]:
+    """Keep the protocols accepted by a single filter (or an include pattern)."""
+    if isinstance(node_filter, str):
+        node_filter = NodeFilter(include=(node_filter,))
+    return FilterEngine({"": node_filter}).assign(protocols)[""]
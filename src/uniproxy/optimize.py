@@ -0,0 +1,271 @@
+from __future__ import annotations
+
+from typing import Any, Sequence
+
+from ipaddress import IPv4Network, IPv6Network, collapse_addresses, ip_network
+
+from attrs import evolve
+
+from uniproxy.uniproxy.rules import (
+    DomainGroupRule,
+    DomainRule,
+    DomainSuffixGroupRule,
+    DomainSuffixRule,
+    IPCidr6GroupRule,
+    IPCidr6Rule,
+    IPCidrGroupRule,
+    IPCidrRule,
+    UniproxyRule,
+)
+from uniproxy.utils import to_name
+
+_EXACT = 0
+_SUFFIX = 1
+_SUBDOMAINS = 2
+"""Keys of a trie node holding the index of the rule which marked it.
+
+Label keys are strings, so the integer keys never collide with them.
+"""
+
+
+def _labels(name: str) -> tuple[list[str], bool]:
+    """Reversed labels of a domain, and whether it had a leading dot.
+
+    A leading dot restricts a suffix to subdomains, as in sing-box.
+    """
+    name = name.strip().lower().rstrip(".")
+    subdomains_only = name.startswith(".")
+    return name.lstrip(".").split(".")[::-1], subdomains_only
+
+
+class DomainTrie:
+    """Trie of reversed domain labels, recording which rule covers what.
+
+    `DOMAIN` matchers mark a single node, `DOMAIN-SUFFIX` matchers mark a node
+    and everything below it. Lookups return the index of the first rule added
+    which covers a domain or a whole suffix.
+    """
+
+    def __init__(self) -> None:
+        self._root: dict[Any, Any] = {}
+
+    def add_domain(self, name: str, index: int) -> None:
+        labels, _ = _labels(name)
+        self._node(labels).setdefault(_EXACT, index)
+
+    def add_suffix(self, name: str, index: int) -> None:
+        labels, subdomains_only = _labels(name)
+        self._node(labels).setdefault(
+            _SUBDOMAINS if subdomains_only else _SUFFIX, index
+        )
+
+    def _node(self, labels: list[str]) -> dict[Any, Any]:
+        node = self._root
+        for label in labels:
+            node = node.setdefault(label, {})
+        return node
+
+    def _walk(self, labels: list[str]) -> tuple[int | None, dict[Any, Any] | None]:
+        """Covering rule of a strict ancestor, and the node of the labels."""
+        found: int | None = None
+        node: dict[Any, Any] | None = self._root
+        for label in labels:
+            # both kinds of suffixes cover everything below their node
+            for key in (_SUFFIX, _SUBDOMAINS):
+                if key in node and (found is None or node[key] < found):
+                    found = node[key]
+            node = node.get(label)
+            if node is None:
+                break
+        return found, node
+
+    def covering_domain(self, name: str) -> int | None:
+        """Index of the first rule matching every request for a domain."""
+        labels, _ = _labels(name)
+        found, node = self._walk(labels)
+        return _first(found, node, (_EXACT, _SUFFIX))
+
+    def covering_suffix(self, name: str) -> int | None:
+        """Index of the first rule matching every request for a suffix."""
+        labels, subdomains_only = _labels(name)
+        found, node = self._walk(labels)
+        if subdomains_only:
+            return _first(found, node, (_SUFFIX, _SUBDOMAINS))
+        return _first(found, node, (_SUFFIX,))
+
+
+def _first(
+    found: int | None, node: dict[Any, Any] | None, keys: tuple[int, ...]
+) -> int | None:
+    if node is not None:
+        for key in keys:
+            if key in node and (found is None or node[key] < found):
+                found = node[key]
+    return found
+
+
+def _depth(name: str) -> int:
+    return name.count(".")
+
+
+def prune_subsumed_domains(
+    rules: Sequence[UniproxyRule],
+) -> tuple[list[UniproxyRule], int]:
+    """Remove domain rules covered by an earlier rule with the same policy.
+
+    `DOMAIN` and `DOMAIN-SUFFIX` rules (and the entries of their group rules)
+    are dropped if an earlier `DOMAIN-SUFFIX` (or identical `DOMAIN`) rule
+    with the same policy already matches every domain they match. Coverage is
+    only tracked within a run of rules sharing a policy, so a rule is never
+    removed across a rule with a different policy. Group rules are copied
+    without the covered entries, and dropped once empty, all other rules are
+    kept as is.
+
+    Example:
+
+    ```python
+    rules, removed = prune_subsumed_domains([
+        DomainSuffixRule(matcher="example.com", policy="Proxy"),
+        DomainRule(matcher="a.b.example.com", policy="Proxy"),  # removed
+        DomainSuffixRule(matcher="cdn.example.com", policy="Proxy"),  # removed
+    ])
+    ```
+
+    Returns:
+      tuple[list[UniproxyRule], int]:
+        The remaining rules in order, and the number of removed domain
+        matchers, counting every entry of group rules.
+    """
+    out: list[UniproxyRule] = []
+    removed = 0
+    trie = DomainTrie()
+    current: str | None = None
+    for index, rule in enumerate(rules):
+        policy = to_name(rule.policy)
+        if policy != current:
+            trie = DomainTrie()
+            current = policy
+
+        match rule:
+            case DomainRule(matcher=matcher):
+                if trie.covering_domain(matcher) is not None:
+                    removed += 1
+                    continue
+                trie.add_domain(matcher, index)
+            case DomainSuffixRule(matcher=matcher):
+                if trie.covering_suffix(matcher) is not None:
+                    removed += 1
+                    continue
+                trie.add_suffix(matcher, index)
+            case (
+                DomainGroupRule(matcher=matcher)
+                | DomainSuffixGroupRule(matcher=matcher)
+            ):
+                is_suffix = isinstance(rule, DomainSuffixGroupRule)
+                covering = trie.covering_suffix if is_suffix else trie.covering_domain
+                add = trie.add_suffix if is_suffix else trie.add_domain
+                # the order inside a group does not matter, so broader
+                # suffixes may cover entries listed before them
+                kept: set[int] = set()
+                for i in sorted(range(len(matcher)), key=lambda i: _depth(matcher[i])):
+                    if covering(matcher[i]) is None:
+                        add(matcher[i], index)
+                        kept.add(i)
+                if len(kept) < len(matcher):
+                    removed += len(matcher) - len(kept)
+                    if not kept:
+                        continue
+                    rule = evolve(
+                        rule, matcher=[m for i, m in enumerate(matcher) if i in kept]
+                    )
+            case _:
+                pass
+        out.append(rule)
+    return out, removed
+
+
+type _CidrRule = IPCidrRule | IPCidrGroupRule | IPCidr6Rule | IPCidr6GroupRule
+
+_CIDR_RULES = (IPCidrRule, IPCidrGroupRule, IPCidr6Rule, IPCidr6GroupRule)
+
+
+def _aggregate_run(run: list[_CidrRule]) -> tuple[list[UniproxyRule], int]:
+    v4: list[IPv4Network] = []
+    v6: list[IPv6Network] = []
+    for rule in run:
+        matchers = [rule.matcher] if isinstance(rule.matcher, str) else rule.matcher
+        for each in matchers:
+            network = ip_network(each.strip(), strict=False)
+            if isinstance(network, IPv4Network):
+                v4.append(network)
+            else:
+                v6.append(network)
+
+    collapsed_v4 = list(collapse_addresses(v4))
+    collapsed_v6 = list(collapse_addresses(v6))
+    saved = len(v4) + len(v6) - len(collapsed_v4) - len(collapsed_v6)
+    if len(run) == 1 and not saved:
+        return [run[0]], 0
+
+    policy, no_resolve = run[0].policy, run[0].no_resolve
+    out: list[UniproxyRule] = []
+    if collapsed_v4:
+        out.append(
+            IPCidrGroupRule(
+                matcher=[str(n) for n in collapsed_v4],
+                policy=policy,
+                no_resolve=no_resolve,
+            )
+        )
+    if collapsed_v6:
+        out.append(
+            IPCidr6GroupRule(
+                matcher=[str(n) for n in collapsed_v6],
+                policy=policy,
+                no_resolve=no_resolve,
+            )
+        )
+    return out, saved
+
+
+def aggregate_cidrs(rules: Sequence[UniproxyRule]) -> tuple[list[UniproxyRule], int]:
+    """Collapse runs of CIDR rules into the minimal set of covering prefixes.
+
+    A run is a sequence of consecutive `IP-CIDR` and `IP-CIDR6` rules (single
+    or group) with the same policy and `no_resolve` flag. Its prefixes are
+    merged with `ipaddress.collapse_addresses`, adjacent and overlapping
+    prefixes such as `1.0.0.0/24` and `1.0.1.0/24` become `1.0.0.0/23`. Each
+    run is replaced in place by one `IPCidrGroupRule` and one
+    `IPCidr6GroupRule`, so the order relative to all other rules is kept.
+    Runs of a single rule without anything to merge are kept as is.
+
+    Returns:
+      tuple[list[UniproxyRule], int]:
+        The rules in order, and the number of prefixes saved.
+
+    Raises:
+      ValueError: If a matcher is not a valid IP network.
+    """
+    out: list[UniproxyRule] = []
+    saved = 0
+    run: list[_CidrRule] = []
+    key: tuple[str, bool | None] | None = None
+    for rule in [*rules, None]:
+        if isinstance(rule, _CIDR_RULES):
+            rule_key = (to_name(rule.policy), rule.no_resolve)
+            if rule_key == key:
+                run.append(rule)
+                continue
+        else:
+            rule_key = None
+        if run:
+            aggregated, n = _aggregate_run(run)
+            out.extend(aggregated)
+            saved += n
+        if rule_key is not None:
+            run, key = [rule], rule_key  # type: ignore[reportAttributeAccessIssue]
+        else:
+            run, key = [], None
+            if rule is not None:
+                out.append(rule)
+    return out, saved
@@ -0,0 +1,464 @@
+from __future__ import annotations
+
+from typing import Any, Iterable, Iterator, Mapping, get_args
+from uniproxy.typing import ShadowsocksCipher
+
+import json
+import re
+
+from ruamel.yaml import YAML
+from ruamel.yaml.error import YAMLError
+
+from uniproxy.uniproxy.protocols import (
+    AnyTLSProtocol,
+    HttpProtocol,
+    ShadowsocksObfsPlugin,
+    ShadowsocksPlugin,
+    ShadowsocksProtocol,
+    ShadowsocksV2RayPlugin,
+    Socks5Protocol,
+    TrojanProtocol,
+    UniproxyProtocol,
+    VmessH2Transport,
+    VmessProtocol,
+    VmessWsTransport,
+)
+from uniproxy.uniproxy.shared import TLS
+from uniproxy.uri import UriParseError
+
+type _ReadResult = tuple[int, UniproxyProtocol | UriParseError]
+
+_SS_METHODS = frozenset(get_args(ShadowsocksCipher.__value__))
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_ENTRY_ERRORS = (KeyError, TypeError, ValueError)
+
+
+def _plugin_opts(opts: str) -> tuple[dict[str, str], set[str]]:
+    """Split SIP003 plugin options into `key=value` pairs and bare flags."""
+    pairs: dict[str, str] = {}
+    flags: set[str] = set()
+    for each in opts.split(";"):
+        key, sep, value = each.partition("=")
+        if sep:
+            pairs[key.strip()] = value.strip()
+        elif key.strip():
+            flags.add(key.strip())
+    return pairs, flags
+
+
+def _check_method(method: str) -> str:
+    if method not in _SS_METHODS:
+        raise ValueError("Invalid method value '%s'" % method)
+    return method
+
+
+def protocol_from_sip008(server: Mapping[str, Any]) -> ShadowsocksProtocol:
+    """Map one entry of the `servers` array of a SIP008 document to a protocol.
+
+    Raises:
+      KeyError: If a required field is missing.
+      ValueError: If a field has an invalid value.
+    """
+    host, port = server["server"], int(server["server_port"])
+    command, opts = server.get("plugin"), server.get("plugin_opts") or ""
+    match command:
+        case None | "":
+            plugin = None
+        case "obfs-local" | "simple-obfs":
+            pairs, _ = _plugin_opts(opts)
+            plugin = ShadowsocksObfsPlugin(
+                obfs=pairs["obfs"],  # pyright: ignore[reportArgumentType]
+                obfs_host=pairs.get("obfs-host", ""),
+                command="obfs-local",
+            )
+        case "v2ray-plugin":
+            pairs, flags = _plugin_opts(opts)
+            plugin = ShadowsocksV2RayPlugin(
+                mode=pairs.get("mode", "websocket"),  # pyright: ignore[reportArgumentType]
+                host=pairs.get("host", ""),
+                path=pairs.get("path", "/"),
+                tls="tls" in flags or None,
+            )
+        case _:
+            plugin = ShadowsocksPlugin(command=command, opts=opts)
+    return ShadowsocksProtocol(
+        name=server.get("remarks") or f"{host}:{port}",
+        server=host,
+        port=port,
+        password=server["password"],
+        method=_check_method(server["method"]),  # pyright: ignore[reportArgumentType]
+        plugin=plugin,
+    )
+
+
+def _clash_network(proxy: Mapping[str, Any]) -> str:
+    return "tcp_and_udp" if proxy.get("udp") else "tcp"
+
+
+def _clash_tls(proxy: Mapping[str, Any], server_name_key: str) -> TLS:
+    skip_cert_verify = proxy.get("skip-cert-verify")
+    return TLS(
+        server_name=proxy.get(server_name_key),
+        alpn=proxy.get("alpn"),
+        verify=None if skip_cert_verify is None else not skip_cert_verify,
+    )
+
+
+def protocol_from_clash(proxy: Mapping[str, Any]) -> UniproxyProtocol:
+    """Map one item of a Clash `proxies` list to a protocol.
+
+    Raises:
+      KeyError: If a required field is missing.
+      ValueError: If the proxy type or one of its options is not supported.
+    """
+    common = dict(name=proxy["name"], server=proxy["server"], port=int(proxy["port"]))
+    match proxy["type"]:
+        case "ss":
+            opts = proxy.get("plugin-opts") or {}
+            match proxy.get("plugin"):
+                case None:
+                    plugin = None
+                case "obfs":
+                    plugin = ShadowsocksObfsPlugin(
+                        obfs=opts["mode"], obfs_host=opts.get("host", "")
+                    )
+                case "v2ray-plugin":
+                    plugin = ShadowsocksV2RayPlugin(
+                        mode=opts.get("mode", "websocket"),
+                        host=opts.get("host", ""),
+                        path=opts.get("path", "/"),
+                        tls=opts.get("tls"),
+                        skip_cert_verify=opts.get("skip-cert-verify"),
+                        headers=opts.get("headers"),
+                    )
+                case other:
+                    raise ValueError("Unsupported plugin '%s'" % other)
+            return ShadowsocksProtocol(
+                **common,
+                password=str(proxy["password"]),
+                method=_check_method(proxy["cipher"]),  # pyright: ignore[reportArgumentType]
+                network=_clash_network(proxy),  # pyright: ignore[reportArgumentType]
+                plugin=plugin,
+            )
+        case "trojan" | "anytls" as kind:
+            if proxy.get("network", "tcp") != "tcp":
+                raise ValueError("Unsupported network '%s'" % proxy["network"])
+            cls = TrojanProtocol if kind == "trojan" else AnyTLSProtocol
+            return cls(
+                **common,
+                password=str(proxy["password"]),
+                tls=_clash_tls(proxy, "sni"),
+                network=_clash_network(proxy),  # pyright: ignore[reportArgumentType]
+            )
+        case "http":
+            return HttpProtocol(
+                **common,
+                username=proxy.get("username"),
+                password=proxy.get("password"),
+                tls=_clash_tls(proxy, "sni") if proxy.get("tls") else None,
+            )
+        case "socks5":
+            return Socks5Protocol(
+                **common,
+                username=proxy.get("username"),
+                password=proxy.get("password"),
+                tls=_clash_tls(proxy, "sni") if proxy.get("tls") else None,
+                network=_clash_network(proxy),  # pyright: ignore[reportArgumentType]
+            )
+        case "vmess":
+            match proxy.get("network", "tcp"):
+                case "tcp":
+                    transport = None
+                case "ws":
+                    ws_opts = proxy.get("ws-opts") or {}
+                    transport = VmessWsTransport(
+                        path=ws_opts.get("path"),
+                        headers=ws_opts.get("headers"),
+                        max_early_data=ws_opts.get("max-early-data"),
+                        early_data_header_name=ws_opts.get("early-data-header-name"),
+                    )
+                case "h2":
+                    h2_opts = proxy.get("h2-opts") or {}
+                    transport = VmessH2Transport(
+                        path=h2_opts.get("path"), headers=h2_opts.get("headers")
+                    )
+                case other:
+                    raise ValueError("Unsupported network '%s'" % other)
+            return VmessProtocol(
+                **common,
+                uuid=proxy["uuid"],
+                alter_id=int(proxy.get("alterId", 0)),
+                security=proxy.get("cipher", "auto"),
+                network=_clash_network(proxy),  # pyright: ignore[reportArgumentType]
+                tls=_clash_tls(proxy, "servername") if proxy.get("tls") else None,
+                transport=transport,
+            )
+        case other:
+            raise ValueError("Unsupported proxy type '%s'" % other)
+
+
+class _JsonStream:
+    """Decode JSON values one by one from a stream of text chunks."""
+
+    def __init__(self, texts: Iterable[str]) -> None:
+        self._texts = iter(texts)
+        self._decoder = json.JSONDecoder()
+        self._buf = ""
+        self._pos = 0
+        self._eof = False
+        self._lineno = 1
+        """Line number at `_counted` in `_buf`."""
+        self._counted = 0
+
+    @property
+    def lineno(self) -> int:
+        # count incrementally, entries are small compared to the buffer
+        self._lineno += self._buf.count("\n", self._counted, self._pos)
+        self._counted = self._pos
+        return self._lineno
+
+    def _fill(self) -> bool:
+        if self._eof:
+            return False
+        for text in self._texts:
+            if text:
+                # drop the consumed prefix, so the buffer stays small
+                self._lineno += self._buf.count("\n", self._counted, self._pos)
+                self._buf = self._buf[self._pos :] + text
+                self._pos = self._counted = 0
+                return True
+        self._eof = True
+        return False
+
+    def peek(self) -> str:
+        """Next non whitespace character, empty at the end of the stream."""
+        while True:
+            self._pos = _WHITESPACE.match(self._buf, self._pos).end()  # pyright: ignore[reportOptionalMemberAccess]
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, char: str) -> None:
+        found = self.peek()
+        if found != char:
+            raise ValueError(
+                "Expected '%s' at line %d, found %r" % (char, self.lineno, found)
+            )
+        self._pos += 1
+
+    def value(self) -> Any:
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buf, self._pos)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+            # a number might continue in the next chunk
+            if end < len(self._buf) or not self._fill():
+                self._pos = end
+                return value
+
+
+def _sip008_entry(lineno: int, entry: Any) -> _ReadResult:
+    try:
+        return lineno, protocol_from_sip008(entry)
+    except _ENTRY_ERRORS as e:
+        reason = f"Missing field {e}" if isinstance(e, KeyError) else str(e)
+        return lineno, UriParseError(
+            lineno=lineno, uri=json.dumps(entry), reason=reason
+        )
+
+
+def iter_sip008(texts: Iterable[str]) -> Iterator[_ReadResult]:
+    """Incrementally read the servers of a SIP008 JSON document.
+
+    Only a single entry of the `servers` array is decoded at once, the rest of
+    the document is never held in memory. A bare array of servers is accepted
+    as well.
+
+    Args:
+      texts (Iterable[str]):
+        The document in chunks of any size.
+
+    Yields:
+      tuple[int, UniproxyProtocol | UriParseError]:
+        The line where each server starts, with its protocol or the reason it
+        could not be mapped.
+
+    Raises:
+      ValueError: If the document is not valid JSON.
+    """
+    stream = _JsonStream(texts)
+
+    def servers() -> Iterator[_ReadResult]:
+        stream.expect("[")
+        if stream.peek() == "]":
+            stream.expect("]")
+            return
+        while True:
+            stream.peek()  # skip to the start of the entry
+            lineno = stream.lineno
+            yield _sip008_entry(lineno, stream.value())
+            if stream.peek() != ",":
+                break
+            stream.expect(",")
+        stream.expect("]")
+
+    if stream.peek() == "[":
+        yield from servers()
+        return
+
+    stream.expect("{")
+    if stream.peek() == "}":
+        return
+    while True:
+        key = stream.value()
+        stream.expect(":")
+        if key == "servers" and stream.peek() == "[":
+            yield from servers()
+        else:
+            stream.value()
+        if stream.peek() != ",":
+            break
+        stream.expect(",")
+    stream.expect("}")
+
+
+_FLAT_PAIR = re.compile(r"([\w-]+):[ \t]+(.+)")
+_YAML_INT = re.compile(r"[-+]?[0-9]+")
+_YAML_TYPED = re.compile(
+    r"[-+]?[0-9_]*\.?[0-9_]*(?:[eE][-+]?[0-9]+)?|0[xob][0-9a-fA-F_]+"
+    r"|[-+]?\.(?:inf|Inf|INF|nan|NaN|NAN)|[0-9]{4}-[0-9]{1,2}-[0-9]{1,2}(?:[Tt ].*)?"
+)
+_YAML_BOOL = {
+    **dict.fromkeys(("true", "True", "TRUE"), True),
+    **dict.fromkeys(("false", "False", "FALSE"), False),
+}
+_YAML_NULL = frozenset(("~", "null", "Null", "NULL"))
+_PLAIN_INDICATORS = frozenset("-?:,[]{}#&*!|>'\"%@`")
+
+
+class _NotFlat(Exception):
+    pass
+
+
+def _flat_scalar(value: str) -> Any:
+    """Resolve a YAML 1.2 scalar, only for the simple forms used by providers."""
+    first, last = value[0], value[-1]
+    if first == "'" or first == '"':
+        if len(value) < 2 or last != first or first in value[1:-1] or "\\" in value:
+            raise _NotFlat
+        return value[1:-1]
+    if first in _PLAIN_INDICATORS or ": " in value or " #" in value or last == ":":
+        raise _NotFlat
+    if value in _YAML_BOOL:
+        return _YAML_BOOL[value]
+    if value in _YAML_NULL:
+        return None
+    if _YAML_INT.fullmatch(value):
+        return int(value)
+    if _YAML_TYPED.fullmatch(value):
+        raise _NotFlat  # floats, hex and octal numbers, timestamps
+    return value
+
+
+def _flat_item(lines: list[str]) -> dict[str, Any]:
+    """Parse an item which is a flat mapping of scalars, without ruamel.yaml.
+
+    Raises:
+      _NotFlat: For anything else, which is left to the YAML loader.
+    """
+    item: dict[str, Any] = {}
+    for i, line in enumerate(lines):
+        prefix, line = line[:2], line[2:]
+        if prefix != ("- " if i == 0 else "  "):
+            raise _NotFlat
+        m = _FLAT_PAIR.fullmatch(line)
+        if m is None or m[1] in item:
+            raise _NotFlat
+        item[m[1]] = _flat_scalar(m[2].rstrip())
+    return item
+
+
+def _clash_entry(yaml: YAML, lineno: int, lines: list[str]) -> _ReadResult:
+    text = "\n".join(lines)
+    try:
+        try:
+            proxy = _flat_item(lines)
+        except _NotFlat:
+            proxy = yaml.load(text)[0]
+        return lineno, protocol_from_clash(proxy)
+    except (*_ENTRY_ERRORS, IndexError, YAMLError) as e:
+        reason = f"Missing field {e}" if isinstance(e, KeyError) else str(e)
+        return lineno, UriParseError(lineno=lineno, uri=text, reason=reason)
+
+
+def iter_clash_proxies(lines: Iterable[str]) -> Iterator[_ReadResult]:
+    """Incrementally read the top level `proxies` list of a Clash YAML document.
+
+    The block sequence is split into its items by indentation, and every item
+    is loaded on its own as soon as it is complete. Items which are flat
+    mappings of plain or simply quoted scalars (most of them) are parsed
+    directly, the others with ruamel.yaml. Everything outside of
+    `proxies` is skipped without being parsed, so full Clash configurations
+    work as well as proxy provider files.
+
+    Args:
+      lines (Iterable[str]):
+        Lines of the document.
+
+    Yields:
+      tuple[int, UniproxyProtocol | UriParseError]:
+        The line where each item starts, with its protocol or the reason it
+        could not be mapped.
+    """
+    yaml = YAML(typ="safe")
+    in_proxies = False
+    indent: int | None = None
+    item: list[str] = []
+    item_lineno = 0
+
+    for lineno, line in enumerate(lines, 1):
+        line = line.rstrip()
+        if not in_proxies:
+            if line.startswith("proxies:"):
+                rest = line[len("proxies:") :].strip()
+                if rest and not rest.startswith("#"):
+                    yield (
+                        lineno,
+                        UriParseError(
+                            lineno=lineno,
+                            uri=line,
+                            reason="Flow style proxies are not supported",
+                        ),
+                    )
+                    continue
+                in_proxies = True
+            continue
+
+        stripped = line.lstrip(" ")
+        if not stripped or stripped.startswith("#"):
+            continue
+        level = len(line) - len(stripped)
+        is_item = stripped == "-" or stripped.startswith("- ")
+        if indent is None and is_item:
+            indent = level
+        if indent is not None and level > indent:
+            item.append(line[indent:])
+            continue
+        if item:
+            yield _clash_entry(yaml, item_lineno, item)
+            item = []
+        if indent is not None and level == indent and is_item:
+            item = [line[indent:]]
+            item_lineno = lineno
+        else:
+            # a key of the same or an outer level ends the list
+            in_proxies = False
+            indent = None
+
+    if item:
+        yield _clash_entry(yaml, item_lineno, item)
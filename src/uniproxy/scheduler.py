@@ -0,0 +1,258 @@
+from __future__ import annotations
+
+from typing import Awaitable, Callable, Generic, TypeVar
+
+import asyncio
+import heapq
+import random
+import time
+from itertools import count
+
+from attrs import define, field, frozen
+
+from uniproxy.fetch import provider_url
+from uniproxy.uniproxy.base import BaseProxyProvider, BaseRuleProvider
+
+T = TypeVar("T")
+
+type RefreshCallback[R] = Callable[[str, R | BaseException], object]
+
+
+@frozen
+class Subscription:
+    """Handle of a dependent registered with `RefreshScheduler.subscribe`."""
+
+    url: str
+    id: int
+
+
+@frozen
+class RefreshStats:
+    """Schedule and metrics of one upstream URL."""
+
+    url: str
+    interval: float
+    """Shortest interval of all dependents."""
+    dependents: int
+    next_run: float
+    last_run: float | None
+    lag: float
+    """Delay of the pending run, `0` until it is due."""
+    last_lag: float | None
+    """Delay between the scheduled and the actual start of the last run."""
+    max_lag: float
+    runs: int
+    failures: int
+    callback_errors: int
+
+
+@define
+class _Upstream(Generic[T]):
+    url: str
+    next_run: float
+    dependents: dict[int, tuple[float, RefreshCallback[T]]] = field(factory=dict)
+    running: bool = False
+    last_run: float | None = None
+    last_lag: float | None = None
+    max_lag: float = 0
+    runs: int = 0
+    failures: int = 0
+    callback_errors: int = 0
+
+    @property
+    def interval(self) -> float:
+        return min(interval for interval, _ in self.dependents.values())
+
+
+@define
+class RefreshScheduler(Generic[T]):
+    """Coalesce refreshes of upstream URLs shared by many providers.
+
+    Dependents subscribe to a URL with their own interval. Every URL is fetched
+    once per the shortest interval of its dependents, minus up to `jitter` of
+    it, so upstreams shared by many configs are not fetched in lockstep. The
+    result (or the exception) of each fetch is passed to every dependent.
+
+    Example:
+
+    ```python
+    async with Fetcher() as fetcher:
+        scheduler = RefreshScheduler(fetch=fetcher.fetch)
+        for user in users:
+            for provider in user.providers:
+                scheduler.subscribe_provider(provider, user.on_refresh)
+        await scheduler.run()
+    ```
+    """
+
+    fetch: Callable[[str], Awaitable[T]]
+    jitter: float = 0.1
+    """Fraction of the interval a run is randomly brought forward."""
+    default_interval: float = 21600
+    clock: Callable[[], float] = time.monotonic
+    rng: random.Random = field(factory=random.Random)
+
+    _upstreams: dict[str, _Upstream[T]] = field(factory=dict, init=False)
+    _heap: list[tuple[float, str]] = field(factory=list, init=False)
+    _ids: count = field(factory=count, init=False)
+    _wakeup: asyncio.Event = field(factory=asyncio.Event, init=False)
+    _tasks: set[asyncio.Task[None]] = field(factory=set, init=False)
+
+    def subscribe(
+        self, url: str, interval: float, callback: RefreshCallback[T]
+    ) -> Subscription:
+        """Register a dependent of a URL, refreshed at least every `interval`.
+
+        A new URL is due at once. A shorter interval of a new dependent brings
+        the pending run of a known URL forward.
+        """
+        sub = Subscription(url=url, id=next(self._ids))
+        upstream = self._upstreams.get(url)
+        if upstream is None:
+            upstream = _Upstream(url=url, next_run=self.clock())
+            self._upstreams[url] = upstream
+            self._push(upstream)
+        upstream.dependents[sub.id] = (interval, callback)
+        if upstream.last_run is not None and not upstream.running:
+            due = upstream.last_run + interval
+            if due < upstream.next_run:
+                upstream.next_run = due
+                self._push(upstream)
+        self._wakeup.set()
+        return sub
+
+    def subscribe_provider(
+        self,
+        provider: BaseProxyProvider | BaseRuleProvider,
+        callback: RefreshCallback[T],
+    ) -> Subscription:
+        """Register a provider with its own URL and interval."""
+        interval = getattr(provider, "interval", None)
+        if interval is None:
+            interval = getattr(provider, "update_interval", None)
+        return self.subscribe(
+            provider_url(provider), interval or self.default_interval, callback
+        )
+
+    def unsubscribe(self, sub: Subscription) -> None:
+        """Remove a dependent, URLs without dependents are no longer fetched."""
+        upstream = self._upstreams.get(sub.url)
+        if upstream is None:
+            return
+        removed = upstream.dependents.pop(sub.id, None)
+        if not upstream.dependents:
+            del self._upstreams[sub.url]
+            return
+        # without its shortest interval dependent, a URL is due later
+        if removed is not None and upstream.last_run is not None:
+            if not upstream.running and removed[0] < upstream.interval:
+                self._schedule(upstream, upstream.last_run)
+
+    def next_runs(self) -> dict[str, float]:
+        """Time of the next run of every URL, on the scale of `clock`."""
+        return {url: u.next_run for url, u in self._upstreams.items()}
+
+    def stats(self) -> dict[str, RefreshStats]:
+        """Schedule and lag metrics of every URL."""
+        now = self.clock()
+        return {
+            url: RefreshStats(
+                url=url,
+                interval=u.interval,
+                dependents=len(u.dependents),
+                next_run=u.next_run,
+                last_run=u.last_run,
+                lag=0 if u.running else max(0, now - u.next_run),
+                last_lag=u.last_lag,
+                max_lag=u.max_lag,
+                runs=u.runs,
+                failures=u.failures,
+                callback_errors=u.callback_errors,
+            )
+            for url, u in self._upstreams.items()
+        }
+
+    def _pop_due(self) -> list[_Upstream[T]]:
+        """Mark the URLs which are due and not in flight as running."""
+        now = self.clock()
+        due: list[_Upstream[T]] = []
+        while self._heap and self._heap[0][0] <= now:
+            at, url = heapq.heappop(self._heap)
+            upstream = self._upstreams.get(url)
+            # entries are not removed from the heap, skip outdated ones
+            if upstream is None or upstream.running or upstream.next_run != at:
+                continue
+            upstream.running = True
+            due.append(upstream)
+        return due
+
+    async def run_due(self) -> int:
+        """Refresh all URLs which are due, concurrently, and wait for them.
+
+        Returns:
+          int: Number of URLs refreshed.
+        """
+        due = self._pop_due()
+        await asyncio.gather(*(self._refresh(u) for u in due))
+        return len(due)
+
+    async def run(self) -> None:
+        """Refresh URLs as they become due, until cancelled.
+
+        Every refresh runs as a task of its own, so a slow upstream does not
+        hold back the URLs coming due while it is fetched.
+        """
+        try:
+            while True:
+                self._wakeup.clear()
+                for upstream in self._pop_due():
+                    task = asyncio.create_task(self._refresh(upstream))
+                    self._tasks.add(task)
+                    task.add_done_callback(self._tasks.discard)
+                delay = self._heap[0][0] - self.clock() if self._heap else None
+                if delay is not None and delay <= 0:
+                    continue
+                try:
+                    # new dependents and finished refreshes may move the next
+                    # run before the earliest known one
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except TimeoutError:
+                    pass
+        finally:
+            for task in self._tasks:
+                task.cancel()
+
+    def _push(self, upstream: _Upstream[T]) -> None:
+        heapq.heappush(self._heap, (upstream.next_run, upstream.url))
+
+    def _schedule(self, upstream: _Upstream[T], start: float) -> None:
+        """Schedule the next run one interval, less jitter, after `start`."""
+        interval = upstream.interval
+        upstream.next_run = start + interval * (1 - self.jitter * self.rng.random())
+        self._push(upstream)
+        self._wakeup.set()
+
+    async def _refresh(self, upstream: _Upstream[T]) -> None:
+        start = self.clock()
+        lag = max(0, start - upstream.next_run)
+        result: T | BaseException
+        try:
+            result = await self.fetch(upstream.url)
+        except Exception as e:
+            result = e
+            upstream.failures += 1
+
+        upstream.runs += 1
+        upstream.last_run = start
+        upstream.last_lag = lag
+        upstream.max_lag = max(upstream.max_lag, lag)
+        upstream.running = False
+        for _, callback in list(upstream.dependents.values()):
+            try:
+                callback(upstream.url, result)
+            except Exception:
+                upstream.callback_errors += 1
+
+        if self._upstreams.get(upstream.url) is not upstream:
+            return  # all dependents unsubscribed meanwhile
+        self._schedule(upstream, start)
@@ -0,0 +1,78 @@
+"""Stream sing-box configurations as JSON.
+
+A configuration is usually rendered by converting it into nested dicts with
+`xattrs.asdict(config, filter=exclude_if_none)` and dumping those with
+`json.dumps`. For large configurations the intermediate dicts take a multiple
+of the memory of the configuration itself. The functions here walk the attrs
+instances lazily instead, keeping only the path from the root to the current
+value in memory, and write the JSON in chunks. The output is the same, byte
+for byte, for the same `json` options.
+"""
+
+from __future__ import annotations
+
+from typing import Any, Iterator, Protocol
+
+import json
+
+from attrs import fields, has
+
+
+class SupportsWrite(Protocol):
+    def write(self, s: str, /) -> object: ...
+
+
+_FIELD_NAMES: dict[type, tuple[str, ...]] = {}
+
+
+def _shallow_dict(obj: Any) -> dict[str, Any]:
+    """Fields of an attrs instance which are not `None`, as in `asdict`."""
+    cls = type(obj)
+    if not has(cls):
+        raise TypeError(f"Object of type {cls.__name__} is not JSON serializable")
+    if hasattr(obj, "__attrs_asdict__"):
+        return obj.__attrs_asdict__()
+    names = _FIELD_NAMES.get(cls)
+    if names is None:
+        names = _FIELD_NAMES[cls] = tuple(a.name for a in fields(cls))
+    out: dict[str, Any] = {}
+    for name in names:
+        value = getattr(obj, name)
+        if value is not None:
+            out[name] = value
+    return out
+
+
+def iterencode(obj: Any, chunk_size: int = 65536, **kwargs: Any) -> Iterator[str]:
+    """Encode `obj`, e.g. a `SingBoxConfig`, as JSON in chunks.
+
+    Chunks are joined until they hold at least `chunk_size` characters, the
+    last one may be shorter. `kwargs` are options of `json.JSONEncoder`, such
+    as `indent` or `ensure_ascii`, except `default`.
+    """
+    encoder = json.JSONEncoder(default=_shallow_dict, **kwargs)
+    buffer: list[str] = []
+    size = 0
+    for piece in encoder.iterencode(obj):
+        buffer.append(piece)
+        size += len(piece)
+        if size >= chunk_size:
+            yield "".join(buffer)
+            buffer.clear()
+            size = 0
+    if buffer:
+        yield "".join(buffer)
+
+
+def dump(obj: Any, fp: SupportsWrite, chunk_size: int = 65536, **kwargs: Any) -> None:
+    """Write `obj` as JSON to a text file, see `iterencode`.
+
+    For sockets, write to `sock.makefile("w", encoding="utf-8")`.
+    """
+    for chunk in iterencode(obj, chunk_size=chunk_size, **kwargs):
+        fp.write(chunk)
+
+
+def dumps(obj: Any, **kwargs: Any) -> str:
+    """Encode `obj` as a JSON string, see `iterencode`."""
+    return "".join(iterencode(obj, **kwargs))
@@ -1,8 +1,8 @@
 from __future__ import annotations
 
-from typing import Literal, Sequence
+from typing import Any, Hashable, Literal, Mapping, Sequence
 
-from attrs import define, field
+from attrs import define, evolve, field, fields
 
 from uniproxy.uniproxy.base import BaseRule as UniproxyBaseRule
 from uniproxy.uniproxy.rules import (
@@ -184,3 +184,107 @@ class SniffRule(BaseNonFinalActionRule):
 
 
 type Rule = RouteRule | RejectRule | HijackDnsRule | SniffRule
+
+#
+# Coalescing
+#
+
+_COALESCE_GROUPS: Mapping[str, str] = {
+    "domain": "destination",
+    "domain_suffix": "destination",
+    "domain_keyword": "destination",
+    "domain_regex": "destination",
+    "ip_cidr": "destination",
+    "port": "port",
+    "port_range": "port",
+    "process_name": "process_name",
+}
+"""Group of each list field which sing-box ORs with the others of its group.
+
+Fields of different groups are ANDed, so only rules matching on a single
+group can be merged.
+"""
+
+_MATCH_FIELDS = tuple(a.name for a in fields(RouteOptionFieldsMixin))
+
+
+def _coalesce_key(rule: Rule) -> tuple[Hashable, ...] | None:
+    if isinstance(rule, RouteRule):
+        action: tuple[Hashable, ...] = (RouteRule, rule.outbound)
+    elif isinstance(rule, RejectRule):
+        action = (RejectRule, rule.method, rule.no_drop)
+    else:
+        return None
+    groups = {
+        _COALESCE_GROUPS.get(name, name)
+        for name in _MATCH_FIELDS
+        if getattr(rule, name) is not None
+    }
+    if len(groups) != 1:
+        return None
+    (group,) = groups
+    if group not in _COALESCE_GROUPS.values():
+        return None
+    return (*action, group)
+
+
+def _merge(run: list[Rule]) -> Rule:
+    if len(run) == 1:
+        return run[0]
+    merged: dict[str, dict[Any, None]] = {}
+    for rule in run:
+        for name in _COALESCE_GROUPS:
+            value = getattr(rule, name)
+            if value is None:
+                continue
+            values = merged.setdefault(name, {})
+            if isinstance(value, (str, int)):
+                values[value] = None
+            else:
+                values.update(dict.fromkeys(value))
+    return evolve(run[0], **{name: list(values) for name, values in merged.items()})  # type: ignore[reportArgumentType]
+
+
+def coalesce_route_rules(rules: Sequence[Rule]) -> list[Rule]:
+    """Merge runs of adjacent rules with the same action into one rule each.
+
+    sing-box ORs the fields of a rule within the groups `domain`,
+    `domain_suffix`, `domain_keyword`, `domain_regex` and `ip_cidr`, `port`
+    and `port_range`, and `process_name`, and ANDs the groups. So consecutive
+    `RouteRule`s with the same outbound (or `RejectRule`s with the same
+    method) which only match on fields of the same group are merged into one
+    rule with the union of their lists, duplicates removed. Any other rule
+    ends a run and is kept as is, as are runs of a single rule.
+
+    Example:
+
+    ```python
+    rules = coalesce_route_rules([
+        RouteRule(domain_suffix="a.com", outbound="proxy"),
+        RouteRule(domain=["b.com"], outbound="proxy"),
+        RouteRule(port=[443], outbound="proxy"),
+    ])
+    # [
+    #     RouteRule(domain_suffix=["a.com"], domain=["b.com"], outbound="proxy"),
+    #     RouteRule(port=[443], outbound="proxy"),
+    # ]
+    ```
+    """
+    out: list[Rule] = []
+    run: list[Rule] = []
+    key: tuple[Hashable, ...] | None = None
+    for rule in rules:
+        rule_key = _coalesce_key(rule)
+        if rule_key is not None and rule_key == key:
+            run.append(rule)
+            continue
+        if run:
+            out.append(_merge(run))
+        if rule_key is None:
+            run, key = [], None
+            out.append(rule)
+        else:
+            run, key = [rule], rule_key
+    if run:
+        out.append(_merge(run))
+    return out
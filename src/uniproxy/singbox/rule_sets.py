@@ -0,0 +1,398 @@
+"""Write and read sing-box rule-set files.
+
+Rule-sets hold "headless" rules, route rules without an action, in either the
+source JSON format or the compiled binary `.srs` format. The binary format is
+written natively, matching `sing-box rule-set compile`:
+
+```
+"SRS" | version: u8 | zlib(
+    uvarint(len(rules)) | rule...
+)
+rule = 0x00 | (item_type: u8 | item)... | 0xFF | invert: u8
+```
+
+Strings and lists are prefixed with their uvarint length, integers are big
+endian. `domain` and `domain_suffix` are stored together as a succinct trie
+of reversed domains, `ip_cidr` as a sorted list of merged address ranges.
+"""
+
+from __future__ import annotations
+
+from typing import Any, Literal, Sequence
+
+import json
+import zlib
+from ipaddress import (
+    IPv4Address,
+    IPv6Address,
+    collapse_addresses,
+    ip_address,
+    ip_network,
+    summarize_address_range,
+)
+from os import PathLike
+from pathlib import Path
+
+from attrs import evolve, fields
+
+from uniproxy import succinct
+from uniproxy.uniproxy.rules import UniproxyRule
+
+from .route import LocalRuleSet
+from .route_rules import RejectRule, RouteOptionFieldsMixin, RouteRule, Rule
+
+type HeadlessRule = dict[str, Any]
+"""Fields of a headless rule, lists but for `invert`."""
+
+RULE_SET_VERSION = 1
+"""Version of written rule-sets, readable by sing-box 1.8.0 and later."""
+
+MAGIC = b"SRS"
+
+_ITEM_FINAL = 0xFF
+
+_ITEMS: Sequence[tuple[str, Literal["string", "domain", "cidr", "port"], int]] = (
+    ("network", "string", 1),
+    ("domain", "domain", 2),
+    ("domain_keyword", "string", 3),
+    ("domain_regex", "string", 4),
+    ("source_ip_cidr", "cidr", 5),
+    ("ip_cidr", "cidr", 6),
+    ("source_port", "port", 7),
+    ("source_port_range", "string", 8),
+    ("port", "port", 9),
+    ("port_range", "string", 10),
+    ("process_name", "string", 11),
+)
+"""Field, encoding and type of each item, in the order sing-box writes them.
+
+`domain_suffix` is encoded in the `domain` item.
+"""
+
+HEADLESS_FIELDS = ("domain_suffix", *(name for name, _, _ in _ITEMS))
+"""Fields of route rules which rule-sets can hold."""
+
+_SUFFIX_LABEL = "\b"
+"""Marks a domain suffix matching subdomains only, reversed at the end."""
+
+#
+# Encoding
+#
+
+
+def _uvarint(value: int) -> bytes:
+    out = bytearray()
+    while value >= 0x80:
+        out.append(value & 0x7F | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _write_bytes(out: bytearray, value: bytes) -> None:
+    out += _uvarint(len(value))
+    out += value
+
+
+def _write_uint64s(out: bytearray, values: list[int]) -> None:
+    out += _uvarint(len(values))
+    for value in values:
+        out += value.to_bytes(8, "big")
+
+
+def _domain_keys(domains: Sequence[str], suffixes: Sequence[str]) -> list[bytes]:
+    keys: set[str] = set()
+    for suffix in suffixes:
+        if suffix.startswith("."):
+            keys.add(_SUFFIX_LABEL + suffix)
+        else:
+            keys.add(suffix)
+            keys.add(f"{_SUFFIX_LABEL}.{suffix}")
+    keys.update(domains)
+    # the trie is built over reversed domains, in byte order
+    return sorted(key[::-1].encode() for key in keys)
+
+
+def _address_ranges(cidrs: Sequence[str]) -> list[tuple[bytes, bytes]]:
+    networks = [ip_network(each.strip(), strict=False) for each in cidrs]
+    ranges: list[tuple[bytes, bytes]] = []
+    for version in (4, 6):
+        collapsed = collapse_addresses(n for n in networks if n.version == version)  # type: ignore[reportArgumentType]
+        for network in collapsed:
+            first, last = network.network_address, network.broadcast_address
+            # adjacent networks form a single range
+            if ranges and len(ranges[-1][1]) == len(first.packed):
+                previous = int.from_bytes(ranges[-1][1])
+                if previous + 1 == int(first):
+                    ranges[-1] = (ranges[-1][0], last.packed)
+                    continue
+            ranges.append((first.packed, last.packed))
+    return ranges
+
+
+def _write_rule(out: bytearray, rule: HeadlessRule) -> None:
+    for name in rule:
+        if name not in HEADLESS_FIELDS and name != "invert":
+            raise ValueError(f"Field '{name}' is not supported in rule-sets")
+    out.append(0)  # a default rule, not a logical one
+    for name, kind, item in _ITEMS:
+        values = rule.get(name)
+        if kind == "domain":
+            if not values and not rule.get("domain_suffix"):
+                continue
+            keys = _domain_keys(values or [], rule.get("domain_suffix", []))
+            leaves, bitmap, labels = succinct.build(keys)
+            out.append(item)
+            out.append(1)  # version of the domain matcher
+            _write_uint64s(out, leaves)
+            _write_uint64s(out, bitmap)
+            _write_bytes(out, labels)
+        elif not values:
+            continue
+        elif kind == "string":
+            out.append(item)
+            out += _uvarint(len(values))
+            for each in values:
+                _write_bytes(out, str(each).encode())
+        elif kind == "cidr":
+            ranges = _address_ranges(values)
+            out.append(item)
+            out.append(1)  # version of the IP set
+            out += len(ranges).to_bytes(8, "big")
+            for first, last in ranges:
+                _write_bytes(out, first)
+                _write_bytes(out, last)
+        else:
+            out.append(item)
+            out += _uvarint(len(values))
+            for port in values:
+                out += int(port).to_bytes(2, "big")
+    out.append(_ITEM_FINAL)
+    out.append(1 if rule.get("invert") else 0)
+
+
+def dumps_binary_rule_set(rules: Sequence[HeadlessRule]) -> bytes:
+    """Encode headless rules in the binary `.srs` format."""
+    body = bytearray(_uvarint(len(rules)))
+    for rule in rules:
+        _write_rule(body, rule)
+    return MAGIC + bytes([RULE_SET_VERSION]) + zlib.compress(bytes(body), 9)
+
+
+def dumps_source_rule_set(rules: Sequence[HeadlessRule]) -> str:
+    """Encode headless rules in the source JSON format."""
+    return json.dumps(
+        {"version": RULE_SET_VERSION, "rules": list(rules)}, ensure_ascii=False
+    )
+
+
+#
+# Decoding
+#
+
+
+class _Reader:
+    def __init__(self, data: bytes) -> None:
+        self.data = data
+        self.offset = 0
+
+    def byte(self) -> int:
+        value = self.data[self.offset]
+        self.offset += 1
+        return value
+
+    def uvarint(self) -> int:
+        value = shift = 0
+        while True:
+            byte = self.byte()
+            value |= (byte & 0x7F) << shift
+            if byte < 0x80:
+                return value
+            shift += 7
+
+    def take(self, n: int) -> bytes:
+        value = self.data[self.offset : self.offset + n]
+        if len(value) < n:
+            raise ValueError("Truncated rule-set")
+        self.offset += n
+        return value
+
+    def bytes(self) -> bytes:
+        return self.take(self.uvarint())
+
+    def uint64s(self) -> list[int]:
+        return [int.from_bytes(self.take(8)) for _ in range(self.uvarint())]
+
+
+def _read_domains(keys: list[bytes]) -> tuple[list[str], list[str]]:
+    names = {key[::-1].decode() for key in keys}
+    domains: list[str] = []
+    suffixes: list[str] = []
+    for key in sorted(names):
+        if key.startswith(_SUFFIX_LABEL):
+            name = key[1:]
+            if name.lstrip(".") in names:
+                suffixes.append(name.lstrip("."))
+            else:
+                suffixes.append(name)
+        elif f"{_SUFFIX_LABEL}.{key}" not in names:
+            domains.append(key)
+    return domains, suffixes
+
+
+def _read_ranges(reader: _Reader) -> list[str]:
+    if reader.byte() != 1:
+        raise ValueError("Unknown version of IP set")
+    cidrs: list[str] = []
+    for _ in range(int.from_bytes(reader.take(8))):
+        first, last = ip_address(reader.bytes()), ip_address(reader.bytes())
+        assert isinstance(first, IPv4Address | IPv6Address)
+        cidrs.extend(str(n) for n in summarize_address_range(first, last))  # type: ignore[reportArgumentType]
+    return cidrs
+
+
+def loads_binary_rule_set(data: bytes) -> list[HeadlessRule]:
+    """Decode headless rules from the binary `.srs` format.
+
+    Raises:
+      ValueError: If `data` is not a rule-set, or uses rule types or items
+        this module does not write (e.g. logical rules).
+    """
+    if data[:3] != MAGIC:
+        raise ValueError("Not a binary rule-set")
+    reader = _Reader(zlib.decompress(data[4:]))
+    items = {item: (name, kind) for name, kind, item in _ITEMS}
+
+    rules: list[HeadlessRule] = []
+    for _ in range(reader.uvarint()):
+        if reader.byte() != 0:
+            raise ValueError("Logical rules are not supported")
+        rule: HeadlessRule = {}
+        while (item := reader.byte()) != _ITEM_FINAL:
+            if item not in items:
+                raise ValueError(f"Unsupported rule-set item {item}")
+            name, kind = items[item]
+            if kind == "domain":
+                if reader.byte() != 1:
+                    raise ValueError("Unknown version of domain matcher")
+                leaves, bitmap = reader.uint64s(), reader.uint64s()
+                keys = succinct.keys(leaves, bitmap, reader.bytes())
+                domains, suffixes = _read_domains(keys)
+                if domains:
+                    rule["domain"] = domains
+                if suffixes:
+                    rule["domain_suffix"] = suffixes
+            elif kind == "string":
+                n = reader.uvarint()
+                rule[name] = [reader.bytes().decode() for _ in range(n)]
+            elif kind == "cidr":
+                rule[name] = _read_ranges(reader)
+            else:
+                n = reader.uvarint()
+                rule[name] = [int.from_bytes(reader.take(2)) for _ in range(n)]
+        if reader.byte():
+            rule["invert"] = True
+        rules.append(rule)
+    return rules
+
+
+def load_rule_set(path: str | PathLike[str]) -> list[HeadlessRule]:
+    """Read headless rules of a source or binary rule-set file."""
+    data = Path(path).read_bytes()
+    if data[:3] == MAGIC:
+        return loads_binary_rule_set(data)
+    rules = json.loads(data)["rules"]
+    return [
+        {k: v if isinstance(v, list) or k == "invert" else [v] for k, v in rule.items()}
+        for rule in rules
+    ]
+
+
+#
+# Compiling
+#
+
+_MATCH_FIELDS = tuple(a.name for a in fields(RouteOptionFieldsMixin))
+
+
+def headless_rule(rule: RouteRule | RejectRule) -> HeadlessRule | None:
+    """Matching fields of a route rule, `None` if a rule-set cannot hold them."""
+    out: HeadlessRule = {}
+    for name in _MATCH_FIELDS:
+        value = getattr(rule, name)
+        if value is None:
+            continue
+        if name not in HEADLESS_FIELDS:
+            return None
+        out[name] = [value] if isinstance(value, (str, int)) else list(value)
+    return out or None
+
+
+def _size(rule: HeadlessRule) -> int:
+    return sum(len(values) for name, values in rule.items() if name != "invert")
+
+
+def compile_rule_sets(
+    rules: Sequence[Rule],
+    directory: str | PathLike[str],
+    threshold: int = 1000,
+    format: Literal["binary", "source"] = "binary",
+    prefix: str = "rs-inline",
+) -> tuple[list[Rule], list[LocalRuleSet]]:
+    """Move large route rules into local rule-set files.
+
+    Every `RouteRule` or `RejectRule` with at least `threshold` matchers in
+    total, and only fields a rule-set can hold, is written to
+    `directory/<prefix>-<n>.srs` (or `.json` for the source format) and
+    replaced by the same rule matching on `rule_set` only. Run
+    `coalesce_route_rules` first to merge small adjacent rules into large
+    ones.
+
+    Returns:
+      tuple[list[Rule], list[LocalRuleSet]]:
+        The rules in order, and the rule-sets to register in `Route.rule_set`.
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    out: list[Rule] = []
+    rule_sets: list[LocalRuleSet] = []
+    for rule in rules:
+        headless = (
+            headless_rule(rule) if isinstance(rule, (RouteRule, RejectRule)) else None
+        )
+        if headless is None or _size(headless) < threshold:
+            out.append(rule)
+            continue
+
+        tag = f"{prefix}-{len(rule_sets)}"
+        if format == "binary":
+            path = directory / f"{tag}.srs"
+            path.write_bytes(dumps_binary_rule_set([headless]))
+        else:
+            path = directory / f"{tag}.json"
+            path.write_text(dumps_source_rule_set([headless]), encoding="utf-8")
+        rule_set = LocalRuleSet(tag=tag, format=format, path=str(path))
+        rule_sets.append(rule_set)
+        cleared = dict.fromkeys(headless, None)
+        out.append(evolve(rule, **cleared, rule_set=[tag]))  # type: ignore[reportArgumentType]
+    return out, rule_sets
+
+
+def compile_uniproxy_rule_sets(
+    rules: Sequence[UniproxyRule],
+    directory: str | PathLike[str],
+    threshold: int = 1000,
+    format: Literal["binary", "source"] = "binary",
+    prefix: str = "rs-inline",
+) -> tuple[list[Rule], list[LocalRuleSet]]:
+    """Convert uniproxy rules, merge adjacent ones, and move large ones to files.
+
+    See `route_rules_from_uniproxy_many`, `coalesce_route_rules` and
+    `compile_rule_sets`.
+    """
+    from uniproxy.to.singbox.uniproxy.rules import route_rules_from_uniproxy_many
+
+    from .route_rules import coalesce_route_rules
+
+    converted = coalesce_route_rules(route_rules_from_uniproxy_many(rules))
+    return compile_rule_sets(converted, directory, threshold, format, prefix)
@@ -0,0 +1,66 @@
+"""Succinct tries of sorted byte strings, as used by sing-box and mihomo.
+
+Both store domain sets in binary rule files as a level-order trie: every node
+is one `0` bit per child followed by a `1` bit in `bitmap`, the label of each
+child in `labels`, and a bit in `leaves` for every node at which a key ends.
+Bitmaps are lists of 64-bit words, least significant bit first.
+"""
+
+from __future__ import annotations
+
+
+def _set_bit(bits: list[int], i: int, v: int) -> None:
+    while i >> 6 >= len(bits):
+        bits.append(0)
+    bits[i >> 6] |= v << (i & 63)
+
+
+def _bit(bits: list[int], i: int) -> int:
+    return bits[i >> 6] >> (i & 63) & 1 if i >> 6 < len(bits) else 0
+
+
+def build(keys: list[bytes]) -> tuple[list[int], list[int], bytes]:
+    """Leaves, label bitmap and labels of the trie of sorted, unique `keys`."""
+    leaves: list[int] = []
+    bitmap: list[int] = []
+    labels = bytearray()
+    bit = 0
+    queue = [(0, len(keys), 0)] if keys else []
+    i = 0
+    while i < len(queue):
+        start, end, col = queue[i]
+        if col == len(keys[start]):
+            start += 1
+            _set_bit(leaves, i, 1)
+        j = start
+        while j < end:
+            first = j
+            label = keys[first][col]
+            while j < end and keys[j][col] == label:
+                j += 1
+            queue.append((first, j, col + 1))
+            labels.append(label)
+            _set_bit(bitmap, bit, 0)
+            bit += 1
+        _set_bit(bitmap, bit, 1)
+        bit += 1
+        i += 1
+    return leaves, bitmap, bytes(labels)
+
+
+def keys(leaves: list[int], bitmap: list[int], labels: bytes) -> list[bytes]:
+    """Keys of a trie written by `build`, in level order."""
+    prefixes = [b""]
+    out: list[bytes] = []
+    node = label = 0
+    for i in range(len(bitmap) * 64):
+        if node >= len(prefixes):
+            break
+        if _bit(bitmap, i):
+            if _bit(leaves, node):
+                out.append(prefixes[node])
+            node += 1
+        else:
+            prefixes.append(prefixes[node] + labels[label : label + 1])
+            label += 1
+    return out
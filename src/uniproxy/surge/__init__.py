@@ -3,4 +3,9 @@ from __future__ import annotations
 
 from .protocols import *
 from .proxy_groups import *
-from .rules import SurgeRule, make_rules_from_uniproxy
+from .rules import (
+    SurgeRule,
+    make_rules_from_uniproxy,
+    make_rules_from_uniproxy_external,
+    make_rules_from_uniproxy_many,
+)
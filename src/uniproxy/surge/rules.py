@@ -3,6 +3,8 @@ from __future__ import annotations
 from typing import Literal, Mapping, Sequence, override
 
 from functools import cached_property
+from os import PathLike
+from pathlib import Path
 
 from attrs import define, field
 
@@ -342,15 +344,12 @@ class ScriptRule(BaseBasicRule):
 #
 
 
-@define(slots=False)
-class _RuleSetRuleMixin:
-    matcher: Literal["SYSTEM", "LAN"] | str
-
-
 @define
 class RuleSetRule(
-    _PreMatchingMixin, _ExtendedMatchingMixin, _RuleSetRuleMixin, BaseRule
+    _PreMatchingMixin, _ExtendedMatchingMixin, _NoResoleMixin, BaseBasicRule
 ):
+    """`matcher` is the path or URL of a rule set, or `SYSTEM` or `LAN`."""
+
     type: Literal["rule-set"] = "rule-set"
 
 
@@ -473,3 +472,145 @@ def make_rules_from_uniproxy(rule: UniproxyRule) -> Sequence[SurgeRule]:
         raise ValueError(
             f"Unknown rule type '{rule.type}' while transforming uniproxy rule to surge rule"
         )
+
+
+# kinds from `_GROUP` on expand to one rule per matcher
+_BASIC, _NO_RESOLVE, _FINAL, _GROUP, _GROUP_NO_RESOLVE = range(5)
+
+_SURGE_DISPATCH: Mapping[str, tuple[int, type[SurgeRule]]] = {
+    **{typ: (_BASIC, cls) for typ, cls in _SURGE_MAPPER.items()},
+    **{typ: (_NO_RESOLVE, cls) for typ, cls in _SURGE_NO_RESOLVE_MAPPER.items()},
+    "domain-group": (_GROUP, DomainRule),
+    "domain-suffix-group": (_GROUP, DomainSuffixRule),
+    "domain-keyword-group": (_GROUP, DomainKeywordRule),
+    "ip-cidr-group": (_GROUP_NO_RESOLVE, IPCidrRule),
+    "ip-cidr6-group": (_GROUP_NO_RESOLVE, IPCidr6Rule),
+    "final": (_FINAL, FinalRule),
+}
+
+
+def make_rules_from_uniproxy_many(rules: Sequence[UniproxyRule]) -> list[SurgeRule]:
+    """Convert many uniproxy rules at once, see `make_rules_from_uniproxy`.
+
+    Rules are dispatched by their `type` through a single lookup table, the
+    name of each distinct policy is resolved once, and the results are written
+    into one list sized up front. `FinalRule` is converted as well.
+    """
+    plan: list[tuple[int, type[SurgeRule]]] = []
+    size = 0
+    for rule in rules:
+        entry = _SURGE_DISPATCH.get(rule.type)
+        if entry is None:
+            raise ValueError(
+                f"Unknown rule type '{rule.type}' while transforming uniproxy rule to surge rule"
+            )
+        plan.append(entry)
+        size += len(rule.matcher) if entry[0] >= _GROUP else 1  # type: ignore[reportAttributeAccessIssue]
+
+    names: dict[int, str] = {}
+    out: list[SurgeRule] = [None] * size  # type: ignore[reportAssignmentType]
+    i = 0
+    for rule, (kind, cls) in zip(rules, plan):
+        policy = names.get(id(rule.policy))
+        if policy is None:
+            policy = names[id(rule.policy)] = to_name(rule.policy)
+        if kind == _BASIC:
+            out[i] = cls(matcher=to_name(rule.matcher), policy=policy)  # type: ignore
+            i += 1
+        elif kind == _NO_RESOLVE:
+            out[i] = cls(  # type: ignore
+                matcher=to_name(rule.matcher),  # type: ignore
+                policy=policy,
+                no_resolve=rule.no_resolve,  # type: ignore
+            )
+            i += 1
+        elif kind == _GROUP:
+            for each in rule.matcher:  # type: ignore
+                out[i] = cls(matcher=each, policy=policy)  # type: ignore
+                i += 1
+        elif kind == _GROUP_NO_RESOLVE:
+            no_resolve = rule.no_resolve  # type: ignore
+            for each in rule.matcher:  # type: ignore
+                out[i] = cls(matcher=each, policy=policy, no_resolve=no_resolve)  # type: ignore
+                i += 1
+        else:
+            out[i] = FinalRule(policy=policy)
+            i += 1
+    return out
+
+
+_SURGE_RULE_SET_TYPES: Mapping[str, str] = {
+    "domain-suffix-group": "DOMAIN-SUFFIX",
+    "domain-keyword-group": "DOMAIN-KEYWORD",
+    "ip-cidr-group": "IP-CIDR",
+    "ip-cidr6-group": "IP-CIDR6",
+}
+"""Rule type of the lines of rule-set files, by uniproxy group type."""
+
+
+def _external_lines(rule: UniproxyRule) -> tuple[Literal["domain", "rule"], list[str]]:
+    matchers = set(rule.matcher)  # type: ignore[reportAttributeAccessIssue]
+    match rule.type:
+        case "domain-group":
+            return "domain", sorted(matchers)
+        case "domain-suffix-group" if not any(m.startswith(".") for m in matchers):
+            # a leading dot in domain-sets matches the domain itself as well
+            return "domain", sorted(f".{m}" for m in matchers)
+        case _:
+            typ = _SURGE_RULE_SET_TYPES[rule.type]
+            return "rule", sorted(f"{typ},{m}" for m in matchers)
+
+
+def make_rules_from_uniproxy_external(
+    rules: Sequence[UniproxyRule],
+    directory: str | PathLike[str],
+    threshold: int = 1000,
+    prefix: str = "inline",
+) -> list[SurgeRule]:
+    """Convert uniproxy rules, writing large groups to external files.
+
+    Group rules with at least `threshold` matchers are written to
+    `directory/<prefix>-<n>.txt`, deduplicated and sorted, and replaced by a
+    single rule of the same policy: `DOMAIN-SET` for domain and (non-dotted)
+    domain suffix groups, `RULE-SET` for keyword and CIDR groups, carrying
+    their `no-resolve` flag. All other rules are converted with
+    `make_rules_from_uniproxy_many`.
+
+    Example:
+
+    ```python
+    rules = make_rules_from_uniproxy_external(rules, "rules", threshold=500)
+    # DOMAIN-SET,rules/inline-0.txt,Proxy
+    ```
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    out: list[SurgeRule] = []
+    pending: list[UniproxyRule] = []
+    n = 0
+    for rule in rules:
+        if (
+            rule.type not in _SURGE_RULE_SET_TYPES and rule.type != "domain-group"
+        ) or len(rule.matcher) < threshold:  # type: ignore[reportAttributeAccessIssue]
+            pending.append(rule)
+            continue
+
+        out.extend(make_rules_from_uniproxy_many(pending))
+        pending = []
+        kind, lines = _external_lines(rule)
+        path = directory / f"{prefix}-{n}.txt"
+        path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+        n += 1
+        policy = to_name(rule.policy)
+        if kind == "domain":
+            out.append(DomainSetRule(matcher=str(path), policy=policy))
+        else:
+            out.append(
+                RuleSetRule(
+                    matcher=str(path),
+                    policy=policy,
+                    no_resolve=getattr(rule, "no_resolve", None),
+                )
+            )
+    out.extend(make_rules_from_uniproxy_many(pending))
+    return out
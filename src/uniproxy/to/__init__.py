@@ -1,10 +1,16 @@
 from __future__ import annotations
 
-from typing import Sequence
+from typing import Any, Mapping, Sequence
 
-import re
+from functools import lru_cache
+from os import PathLike
+from socket import AF_INET, AF_INET6, inet_pton
 
-from uniproxy.singbox.route_rules import RouteRule
+from attrs import fields
+
+from uniproxy.singbox.route import LocalRuleSet
+from uniproxy.singbox.route_rules import RouteOptionFieldsMixin, RouteRule
+from uniproxy.singbox.rule_sets import load_rule_set
 from uniproxy.surge.rules import (
     DestPortRule,
     DomainKeywordRule,
@@ -18,95 +24,156 @@ from uniproxy.surge.rules import (
     SurgeRule,
 )
 
-ipv4_pattern = r"^(?:(?:25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?).){3}(?:25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)"
-ipv6_pattern = r"^(?:[0-9a-fA-F]{1,4}:){7}[0-9a-fA-F]{1,4}$|^::1$|^::"
+type RuleSetSource = str | PathLike[str] | LocalRuleSet
+"""Path of a local rule-set file, or the rule-set itself."""
+
+
+@lru_cache(maxsize=65536)
+def ip_version(cidr: str) -> int:
+    """IP version of an address or network, `4` or `6`.
+
+    Addresses are parsed with `inet_pton`, which is much faster than
+    `ipaddress.ip_network` and accepts every IPv6 notation.
+
+    Raises:
+      ValueError: If `cidr` is not a valid address or network.
+    """
+    address, slash, prefix = cidr.partition("/")
+    # only IPv6 addresses contain colons, so one parse decides
+    family, version, bits = (AF_INET6, 6, 128) if ":" in address else (AF_INET, 4, 32)
+    try:
+        inet_pton(family, address)
+    except OSError:
+        pass
+    else:
+        if not slash or (prefix.isdigit() and int(prefix) <= bits):
+            return version
+    raise ValueError(f"Invalid IP w/o CIDR: {cidr}")
+
+
+def _values(value: Any) -> Sequence[Any]:
+    match value:
+        case None:
+            return ()
+        case str() | int():
+            return (value,)
+        case _:
+            return value
+
+
+def _load(source: RuleSetSource) -> list[dict[str, Any]]:
+    path = source.path if isinstance(source, LocalRuleSet) else source
+    return load_rule_set(path)
+
+
+_MATCH_FIELDS = tuple(a.name for a in fields(RouteOptionFieldsMixin))
+
+_GROUPS: Mapping[str, str] = {
+    "domain": "destination",
+    "domain_suffix": "destination",
+    "domain_keyword": "destination",
+    "ip_cidr": "destination",
+    "port": "port",
+    "source_ip_cidr": "source_ip_cidr",
+    "source_port": "source_port",
+    "process_name": "process_name",
+}
+"""Group of each field converted to Surge rules.
+
+sing-box ORs the fields of a group and ANDs the groups, while Surge rules are
+ORed, so a rule can only be flattened when it matches on a single group.
+"""
+
+
+def _groups(values: Mapping[str, Any], where: str) -> set[str]:
+    """Groups of the fields of a rule, which must all be convertible."""
+    groups: set[str] = set()
+    for name, value in values.items():
+        if value is None or (name == "invert" and not value):
+            continue
+        if name not in _GROUPS:
+            raise ValueError(
+                f"{name} of {where} is not supported yet. Cannot convert to surge rules."
+            )
+        groups.add(_GROUPS[name])
+    return groups
+
+
+def _convert(values: Mapping[str, Any], policy: str) -> list[SurgeRule]:
+    rules: list[SurgeRule] = []
 
-regex_ipv4 = re.compile(ipv4_pattern)
-regex_ipv6 = re.compile(ipv6_pattern)
+    for each in _values(values.get("domain")):
+        rules.append(DomainRule(matcher=each, policy=policy))
+    for each in _values(values.get("domain_suffix")):
+        rules.append(DomainSuffixRule(matcher=each, policy=policy))
+    for each in _values(values.get("domain_keyword")):
+        rules.append(DomainKeywordRule(matcher=each, policy=policy))
 
+    for ip in _values(values.get("ip_cidr")):
+        if ip_version(ip) == 4:
+            rules.append(IPCidrRule(matcher=ip, policy=policy))
+        else:
+            rules.append(IPCidr6Rule(matcher=ip, policy=policy))
 
-def make_rules_from_singbox(rule: RouteRule) -> list[SurgeRule]:
-    policy = rule.outbound
+    for p in _values(values.get("port")):
+        rules.append(DestPortRule(matcher=str(p), policy=policy))
 
-    rules: list[SurgeRule] = []
+    for ip in _values(values.get("source_ip_cidr")):
+        ip_version(ip)
+        rules.append(SrcIPRule(matcher=ip, policy=policy))
 
-    match rule.domain:
-        case str(ip):
-            rules.append(DomainRule(matcher=ip, policy=policy))
-        case Sequence():
-            for ip in rule.domain:
-                rules.append(DomainRule(matcher=ip, policy=policy))
-    match rule.domain_suffix:
-        case str(ip):
-            rules.append(DomainSuffixRule(matcher=ip, policy=policy))
-        case Sequence():
-            for ip in rule.domain_suffix:
-                rules.append(DomainSuffixRule(matcher=ip, policy=policy))
-    match rule.domain_keyword:
-        case str(ip):
-            rules.append(DomainKeywordRule(matcher=ip, policy=policy))
-        case Sequence():
-            for ip in rule.domain_keyword:
-                rules.append(DomainKeywordRule(matcher=ip, policy=policy))
-
-    match rule.ip_cidr:
-        case str(ip):
-            if regex_ipv4.match(ip):
-                rules.append(IPCidrRule(matcher=ip, policy=policy))
-            elif regex_ipv6.match(ip):
-                rules.append(IPCidr6Rule(matcher=ip, policy=policy))
-            else:
-                raise ValueError(f"Invalid IP w/o CIDR: {ip}")
-        case Sequence():
-            for ip in rule.ip_cidr:
-                if regex_ipv4.match(ip):
-                    rules.append(IPCidrRule(matcher=ip, policy=policy))
-                elif regex_ipv6.match(ip):
-                    rules.append(IPCidr6Rule(matcher=ip, policy=policy))
-                else:
-                    raise ValueError(f"Invalid IP w/o CIDR: {ip}")
-
-    match rule.port:
-        case int(p):
-            rules.append(DestPortRule(matcher=str(p), policy=policy))
-        case Sequence():
-            for p in rule.port:
-                rules.append(DestPortRule(matcher=str(p), policy=policy))
-
-    match rule.source_ip_cidr:
-        case str(ip):
-            if regex_ipv4.match(ip):
-                rules.append(SrcIPRule(matcher=ip, policy=policy))
-            elif regex_ipv6.match(ip):
-                rules.append(SrcIPRule(matcher=ip, policy=policy))
-            else:
-                raise ValueError(f"Invalid IP w/o CIDR: {ip}")
-        case Sequence():
-            for ip in rule.source_ip_cidr:
-                if regex_ipv4.match(ip):
-                    rules.append(SrcIPRule(matcher=ip, policy=policy))
-                elif regex_ipv6.match(ip):
-                    rules.append(SrcIPRule(matcher=ip, policy=policy))
-                else:
-                    raise ValueError(f"Invalid IP w/o CIDR: {ip}")
-
-    match rule.source_port:
-        case int(p):
-            rules.append(SrcPortRule(matcher=str(p), policy=policy))
-        case Sequence():
-            for p in rule.source_port:
-                rules.append(SrcPortRule(matcher=str(p), policy=policy))
-
-    match rule.process_name:
-        case str(pn):
-            rules.append(ProcessNameRule(matcher=pn, policy=policy))
-        case Sequence():
-            for pn in rule.process_name:
-                rules.append(ProcessNameRule(matcher=pn, policy=policy))
-
-    if rule.rule_set or rule.protocol:
+    for p in _values(values.get("source_port")):
+        rules.append(SrcPortRule(matcher=str(p), policy=policy))
+
+    for pn in _values(values.get("process_name")):
+        rules.append(ProcessNameRule(matcher=pn, policy=policy))
+
+    return rules
+
+
+def make_rules_from_singbox(
+    rule: RouteRule, rule_sets: Mapping[str, RuleSetSource] | None = None
+) -> list[SurgeRule]:
+    """Convert a sing-box route rule to one Surge rule per matcher.
+
+    Entries of `ip_cidr` become `IP-CIDR` or `IP-CIDR6` rules by their IP
+    version. Tags in `rule_set` are looked up in `rule_sets` and the headless
+    rules of those local rule-sets are converted alike.
+
+    Surge rules are ORed, so the rule and its rule-sets may only match on
+    fields sing-box ORs as well, e.g. `domain_suffix` and `ip_cidr`, but not
+    `domain` and `port`, which would broaden the match.
+
+    Raises:
+      ValueError: If an IP entry is invalid, a field has no Surge equivalent,
+        fields are ANDed, or a rule-set is unknown or holds inverted rules.
+    """
+    policy = rule.outbound
+    values = {name: getattr(rule, name) for name in _MATCH_FIELDS}
+    tags = _values(values.pop("rule_set"))
+    groups = _groups(values, "rule")
+
+    headless_rules: list[dict[str, Any]] = []
+    for tag in tags:
+        if rule_sets is None or tag not in rule_sets:
+            raise ValueError(
+                f"Unknown rule_set {tag!r}. Cannot convert to surge rules."
+            )
+        for headless in _load(rule_sets[tag]):
+            if headless.get("invert"):
+                raise ValueError(
+                    f"Inverted rules of rule_set {tag!r} cannot convert to surge rules."
+                )
+            groups |= _groups(headless, f"rule_set {tag!r}")
+            headless_rules.append(headless)
+
+    if len(groups) > 1:
         raise ValueError(
-            "rule_set is not supported yet. Cannot convert to surge rules."
+            f"Fields of {sorted(groups)} are ANDed by sing-box. "
+            "Cannot convert to surge rules."
         )
 
+    rules = _convert(values, policy)
+    for headless in headless_rules:
+        rules.extend(_convert(headless, policy))
     return rules
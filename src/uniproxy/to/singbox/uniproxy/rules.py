@@ -1,6 +1,6 @@
 from __future__ import annotations
 
-from typing import Literal, Sequence
+from typing import Literal, Mapping, Sequence
 
 from attrs import define, field
 
@@ -101,3 +101,70 @@ def route_rule_from_uniproxy(rule: UniproxyRule) -> Rule:
         case _:
             print(rule)
             raise ValueError(f"Unsupported rule type yet: {type(rule)}")
+
+
+_ROUTE_FIELDS: Mapping[str, str] = {
+    "domain": "domain",
+    "domain-group": "domain",
+    "domain-suffix": "domain_suffix",
+    "domain-suffix-group": "domain_suffix",
+    "domain-keyword": "domain_keyword",
+    "domain-keyword-group": "domain_keyword",
+    "ip-cidr": "ip_cidr",
+    "ip-cidr-group": "ip_cidr",
+    "ip-cidr6": "ip_cidr",
+    "ip-cidr6-group": "ip_cidr",
+    "geoip": "rule_set",
+    "process-name": "process_name",
+    "user-agent": "rule_set",
+}
+"""Field of `RouteRule` taking the matcher of each uniproxy rule type."""
+
+
+def route_rules_from_uniproxy_many(rules: Sequence[UniproxyRule]) -> list[Rule]:
+    """Convert many uniproxy rules at once, see `route_rule_from_uniproxy`.
+
+    Rules are dispatched by their `type` through a single lookup table, the
+    outbound of each distinct policy is resolved once, and the results are
+    written into one list sized up front. Like `unify_mixed_route_rules`,
+    `FinalRule` is skipped.
+    """
+    plan: list[str | None] = []
+    for rule in rules:
+        if rule.type == "final":
+            plan.append(None)
+            continue
+        field_name = _ROUTE_FIELDS.get(rule.type)
+        if field_name is None:
+            raise ValueError(f"Unsupported rule type yet: {type(rule)}")
+        plan.append(field_name)
+
+    # outbound and upper cased policy of each distinct policy
+    outbounds: dict[int, tuple[str, str]] = {}
+    out: list[Rule] = [None] * (len(plan) - plan.count(None))  # type: ignore[reportAssignmentType]
+    i = 0
+    for rule, field_name in zip(rules, plan):
+        if field_name is None:
+            continue
+        entry = outbounds.get(id(rule.policy))
+        if entry is None:
+            outbound = str(rule.policy)
+            entry = outbounds[id(rule.policy)] = (outbound, outbound.upper())
+        outbound, action = entry
+        matcher = rule.matcher  # type: ignore[reportAttributeAccessIssue]
+        if action == "REJECT":
+            out[i] = RejectRule(domain_suffix=maybe_flatmap_to_str(matcher))
+        elif action == "REJECT-DROP":
+            out[i] = RejectRule(
+                domain_suffix=maybe_flatmap_to_str(matcher), method="drop"
+            )
+        elif rule.type == "geoip":
+            out[i] = RouteRule(
+                outbound=outbound, rule_set=f"rs-geoip-{matcher}".lower()
+            )
+        elif rule.type == "user-agent":
+            out[i] = RouteRule(outbound=outbound, rule_set=f"rs-useragent-{matcher}")
+        else:
+            out[i] = RouteRule(outbound=outbound, **{field_name: matcher})
+        i += 1
+    return out
@@ -1,14 +1,132 @@
 from __future__ import annotations
 
-from typing import NotRequired, TypedDict, cast
+from typing import (
+    IO,
+    TYPE_CHECKING,
+    Callable,
+    Iterable,
+    Iterator,
+    Literal,
+    Mapping,
+    NotRequired,
+    TypedDict,
+    cast,
+)
 from uniproxy.typing import ShadowsocksCipher
 
-from urllib.parse import parse_qs, unquote_plus, urlparse
-
+import codecs
+import re
+from binascii import a2b_base64
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from functools import cache
+from hashlib import blake2b
+from heapq import merge
+from ipaddress import IPv6Address
+from itertools import chain
+from operator import itemgetter
+from threading import Lock
+from urllib.parse import unquote_plus
+
+from attrs import define, field, frozen
 from attrs.converters import to_bool
 
 from uniproxy.utils import padded_b64decode
 
+if TYPE_CHECKING:
+    from uniproxy.uniproxy.protocols import UniproxyProtocol
+
+_URI_PATTERN = re.compile(
+    r"(?P<scheme>[^:/?#]*):(?://(?P<netloc>[^/?#]*))?[^?#]*"
+    r"(?:\?(?P<query>[^#]*))?(?:#(?P<fragment>.*))?",
+    re.DOTALL,
+)
+# same as `urllib.parse`, which strips them before parsing
+_C0_CONTROL_OR_SPACE = "".join(chr(c) for c in range(0x21))
+_UNSAFE_BYTES = str.maketrans("", "", "\t\r\n")
+
+
+def _split_uri(
+    uri: str, scheme: str
+) -> tuple[str | None, str | None, str | None, int | None, str, str, str]:
+    """Split `scheme://userinfo@host:port/path?query#fragment` in a single match.
+
+    A fast path for `urlparse`, it reports the same `username`, `password`,
+    `hostname` and `port` values (and raises `ValueError` in the same cases)
+    for the URIs handled by this module.
+
+    Returns:
+      tuple: `(username, password, hostname, port, query, fragment, netloc)`
+    """
+    uri = uri.lstrip(_C0_CONTROL_OR_SPACE)
+    if "\t" in uri or "\r" in uri or "\n" in uri:
+        uri = uri.translate(_UNSAFE_BYTES)
+
+    m = _URI_PATTERN.match(uri)
+    if m is None or m["scheme"].lower() != scheme:
+        actual = "" if m is None else m["scheme"].lower()
+        raise ValueError("Invalid URI scheme value '%s'" % actual)
+    netloc, query, fragment = m.group("netloc", "query", "fragment")
+    if netloc is None:
+        netloc = ""
+
+    if "@" in netloc:
+        userinfo, _, hostinfo = netloc.rpartition("@")
+        username, has_password, password = userinfo.partition(":")
+        if not has_password:
+            password = None
+    else:
+        username = password = None
+        hostinfo = netloc
+
+    if "[" in netloc or "]" in netloc:
+        if "[" not in netloc or "]" not in netloc:
+            raise ValueError("Invalid IPv6 URL")
+        bracketed = netloc.partition("[")[2].partition("]")[0]
+        if not bracketed.startswith("v"):
+            # raises for anything but an IPv6 address, like `urlparse`
+            IPv6Address(bracketed)
+
+    if "[" in hostinfo:
+        hostname, _, port_str = hostinfo.partition("[")[2].partition("]")
+        port_str = port_str.partition(":")[2]
+    else:
+        hostname, _, port_str = hostinfo.partition(":")
+
+    if hostname:
+        hostname, percent, zone = hostname.partition("%")
+        hostname = hostname.lower() + percent + zone
+    else:
+        hostname = None
+
+    if port_str:
+        if not (port_str.isdigit() and port_str.isascii()):
+            raise ValueError(f"Port could not be cast to integer value as {port_str!r}")
+        port = int(port_str)
+        if not (0 <= port <= 65535):
+            raise ValueError("Port out of range 0-65535")
+    else:
+        port = None
+
+    return (username, password, hostname, port, query or "", fragment or "", netloc)
+
+
+def _parse_query(query: str) -> dict[str, str]:
+    """Parse a query string like `parse_qs`, allowing one value per parameter.
+
+    Parameters without a value are dropped, as `parse_qs` does by default.
+    """
+    params: dict[str, str] = {}
+    for pair in query.split("&"):
+        key, _, value = pair.partition("=")
+        if not value:
+            continue
+        key = unquote_plus(key)
+        if key in params:
+            raise ValueError("Invalid query parameter value '%s'" % query)
+        params[key] = unquote_plus(value)
+    return params
+
 
 class ShadowsocksConfig(TypedDict):
     name: str
@@ -38,24 +156,20 @@ def parse_ss_uri(uri: str) -> ShadowsocksConfig:
 
     - [SIP002 URI scheme](https://shadowsocks.org/doc/sip002.html)
     """
-    result = urlparse(uri, allow_fragments=True)
-    if result.scheme != "ss":
-        raise ValueError("Invalid URI scheme value '%s'" % result.scheme)
-    if result.hostname is None:
-        raise ValueError("Invalid hostname value '%s'" % result.hostname)
-    if result.port is None:
-        raise ValueError("Invalid port value '%s'" % result.port)
-    if result.fragment is None:
-        raise ValueError("Invalid fragment value '%s'" % result.fragment)
-
-    if result.password is None and result.username is not None:
-        padding = "=" * ((4 - len(result.username) % 4) % 4)
-        encoded = result.username + padding
+    username, password, hostname, port, _, fragment, netloc = _split_uri(uri, "ss")
+    if hostname is None:
+        raise ValueError("Invalid hostname value '%s'" % hostname)
+    if port is None:
+        raise ValueError("Invalid port value '%s'" % port)
+
+    if password is None and username is not None:
+        padding = "=" * ((4 - len(username) % 4) % 4)
+        encoded = username + padding
         method, password = padded_b64decode(encoded).decode().split(":", 1)
-    elif result.password is not None and result.username is not None:
-        method, password = result.username, result.password
+    elif password is not None and username is not None:
+        method = username
     else:
-        raise ValueError("Invalid userinfo value '%s'" % result.netloc)
+        raise ValueError("Invalid userinfo value '%s'" % netloc)
 
     if method not in {
         "aes-128-gcm",
@@ -69,9 +183,9 @@ def parse_ss_uri(uri: str) -> ShadowsocksConfig:
         raise ValueError("Invalid method value '%s'" % method)
 
     return dict(
-        name=unquote_plus(result.fragment),
-        server=result.hostname,
-        port=result.port,
+        name=unquote_plus(fragment),
+        server=hostname,
+        port=port,
         method=cast(ShadowsocksCipher, method),
         password=password,
     )
@@ -105,38 +219,26 @@ def parse_trojan_uri(uri: str) -> TrojanConfig:
 
     1. [trojan-gfw/trojan-url](https://github.com/trojan-gfw/trojan-url)
     """
-    result = urlparse(uri, allow_fragments=True)
-    if result.scheme != "trojan":
-        raise ValueError("Invalid URI scheme value '%s'" % result.scheme)
-    if result.hostname is None:
-        raise ValueError("Invalid hostname value '%s'" % result.hostname)
-
-    if result.fragment is None:
-        raise ValueError("Invalid fragment value '%s'" % result.fragment)
+    username, password, hostname, port, query, fragment, netloc = _split_uri(
+        uri, "trojan"
+    )
+    if hostname is None:
+        raise ValueError("Invalid hostname value '%s'" % hostname)
 
-    if result.port is None:
+    if port is None:
         port = 443
-    else:
-        port = int(result.port)
 
-    if result.password is None and result.username is not None:
-        password = result.username
+    if password is None and username is not None:
+        password = username
     else:
-        raise ValueError("Invalid userinfo value '%s'" % result.netloc)
-
-    if result.query:
-        parsed = parse_qs(result.query)
-        # Only support single value for each query parameter, and ignore unsupported parameters.
-        count_perfield = [len(v) for v in parsed.values()]
-        if any(count > 1 for count in count_perfield):
-            raise ValueError("Invalid query parameter value '%s'" % result.query)
-        query_params = {k: v[0] for k, v in parsed.items()}
-    else:
-        query_params = {}
+        raise ValueError("Invalid userinfo value '%s'" % netloc)
+
+    # Only support single value for each query parameter, and ignore unsupported parameters.
+    query_params = _parse_query(query) if query else {}
 
     return dict(
-        name=unquote_plus(result.fragment),
-        server=result.hostname,
+        name=unquote_plus(fragment),
+        server=hostname,
         port=port,
         password=password,
         # just flatten the query parameters into the result dict,
@@ -171,34 +273,22 @@ def parse_anytls_uri(uri: str) -> AnyTLSConfig:
     anytls://0fdf77d7-d4ba-455e-9ed9-a98dd6d5489a@[2409:8a71:6a00:1953::615]:8964/?insecure=1
     ```
     """
-    result = urlparse(uri, allow_fragments=True)
-    if result.scheme != "anytls":
-        raise ValueError("Invalid URI scheme value '%s'" % result.scheme)
-    if result.hostname is None:
-        raise ValueError("Invalid hostname value '%s'" % result.hostname)
-
-    if result.fragment is None:
-        raise ValueError("Invalid fragment value '%s'" % result.fragment)
+    username, password, hostname, port, query, fragment, netloc = _split_uri(
+        uri, "anytls"
+    )
+    if hostname is None:
+        raise ValueError("Invalid hostname value '%s'" % hostname)
 
-    if result.port is None:
+    if port is None:
         port = 443
-    else:
-        port = int(result.port)
 
-    if result.password is None and result.username is not None:
-        password = result.username
-    else:
-        raise ValueError("Invalid userinfo value '%s'" % result.netloc)
-
-    if result.query:
-        parsed = parse_qs(result.query)
-        # Only support single value for each query parameter, and ignore unsupported parameters.
-        count_perfield = [len(v) for v in parsed.values()]
-        if any(count > 1 for count in count_perfield):
-            raise ValueError("Invalid query parameter value '%s'" % result.query)
-        query_params = {k: v[0] for k, v in parsed.items()}
+    if password is None and username is not None:
+        password = username
     else:
-        query_params = {}
+        raise ValueError("Invalid userinfo value '%s'" % netloc)
+
+    # Only support single value for each query parameter, and ignore unsupported parameters.
+    query_params = _parse_query(query) if query else {}
 
     sni = query_params.pop("sni", None)
     insecure = query_params.pop("insecure", None)
@@ -209,8 +299,8 @@ def parse_anytls_uri(uri: str) -> AnyTLSConfig:
     insecure_kw = {} if insecure is None else {"insecure": insecure}
 
     return dict(  # pyright: ignore[reportReturnType]
-        name=unquote_plus(result.fragment),
-        server=result.hostname,
+        name=unquote_plus(fragment),
+        server=hostname,
         port=port,
         password=password,
         **sni_kw,
@@ -219,3 +309,396 @@ def parse_anytls_uri(uri: str) -> AnyTLSConfig:
         # and let the caller decide which parameters to use.
         **query_params,
     )
+
+
+@frozen
+class UriParseError:
+    """A subscription line which could not be parsed into a protocol."""
+
+    lineno: int
+    """1-based line number in the decoded subscription body."""
+    uri: str
+    reason: str
+
+
+@cache
+def _scheme_parsers() -> Mapping[str, Callable[[str], UniproxyProtocol]]:
+    # `uniproxy.uniproxy.protocols` imports this module, so defer the import
+    # until the first subscription is parsed.
+    from uniproxy.uniproxy.protocols import (
+        AnyTLSProtocol,
+        ShadowsocksProtocol,
+        TrojanProtocol,
+    )
+
+    return {
+        "ss": ShadowsocksProtocol.from_uri,
+        "trojan": TrojanProtocol.from_uri,
+        "anytls": AnyTLSProtocol.from_uri,
+    }
+
+
+def decode_subscription(blob: str | bytes) -> str:
+    """Decode a subscription body into newline separated URIs.
+
+    Base64 encoded bodies (the common case) are decoded with `padded_b64decode`,
+    bodies which already contain plain URIs are returned as is.
+    """
+    if isinstance(blob, bytes):
+        blob = blob.decode()
+    text = blob.strip()
+    if "://" in text:
+        return text
+    # line breaks inside the base64 body would break the padding calculation
+    return padded_b64decode("".join(text.split())).decode()
+
+
+@define
+class UriParseCache:
+    """Bounded LRU cache of parsed subscription lines.
+
+    Entries are keyed by a hash of the raw line, so unchanged lines between two
+    refreshes of a provider are not parsed again. The cache is thread safe and
+    can be shared by many providers.
+
+    Cached protocols are shared between all callers, they must not be mutated.
+
+    Example:
+
+    ```python
+    cache = UriParseCache(maxsize=100_000)
+    for provider in providers:
+        protocols, errors = parse_subscription(fetch(provider), cache=cache)
+    print(cache.hits, cache.misses)
+    ```
+    """
+
+    maxsize: int = 65536
+    hits: int = field(default=0, init=False)
+    misses: int = field(default=0, init=False)
+
+    _entries: OrderedDict[bytes, UniproxyProtocol] = field(
+        factory=OrderedDict, init=False, repr=False
+    )
+    _lock: Lock = field(factory=Lock, init=False, repr=False)
+
+    @staticmethod
+    def _key(line: str) -> bytes:
+        return blake2b(line.encode(), digest_size=16).digest()
+
+    def get(self, line: str) -> UniproxyProtocol | None:
+        key = self._key(line)
+        with self._lock:
+            protocol = self._entries.get(key)
+            if protocol is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._entries.move_to_end(key)
+            return protocol
+
+    def put(self, line: str, protocol: UniproxyProtocol) -> None:
+        key = self._key(line)
+        with self._lock:
+            self._entries[key] = protocol
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+type _ParseResult = tuple[int, UniproxyProtocol | UriParseError]
+
+
+def _iter_parsed(
+    lines: Iterable[tuple[int, str]], cache: UriParseCache | None = None
+) -> Iterator[_ParseResult]:
+    parsers = _scheme_parsers()
+    for lineno, line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        if cache is not None and (cached := cache.get(line)) is not None:
+            yield lineno, cached
+            continue
+        scheme, sep, _ = line.partition("://")
+        parser = parsers.get(scheme.lower()) if sep else None
+        if parser is None:
+            yield (
+                lineno,
+                UriParseError(
+                    lineno=lineno,
+                    uri=line,
+                    reason="Unsupported URI scheme '%s'" % scheme,
+                ),
+            )
+            continue
+        try:
+            protocol = parser(line)
+        except ValueError as e:
+            yield lineno, UriParseError(lineno=lineno, uri=line, reason=str(e))
+            continue
+        if cache is not None:
+            cache.put(line, protocol)
+        yield lineno, protocol
+
+
+def _split_results(
+    results: Iterable[_ParseResult],
+) -> tuple[list[UniproxyProtocol], list[UriParseError]]:
+    protocols: list[UniproxyProtocol] = []
+    errors: list[UriParseError] = []
+    for _, each in results:
+        if isinstance(each, UriParseError):
+            errors.append(each)
+        else:
+            protocols.append(each)
+    return protocols, errors
+
+
+def _parse_chunk(start: int, lines: list[str]) -> list[_ParseResult]:
+    return list(_iter_parsed(enumerate(lines, start)))
+
+
+def parse_subscription(
+    blob: str | bytes,
+    *,
+    cache: UriParseCache | None = None,
+    max_workers: int | None = 1,
+    chunk_size: int = 2000,
+    parallel_threshold: int = 10_000,
+) -> tuple[list[UniproxyProtocol], list[UriParseError]]:
+    """Parse a whole subscription body into protocols.
+
+    The body is decoded once, then every line is dispatched to the parser of
+    its scheme (`ss`, `trojan`, `anytls`). Invalid lines do not stop the parsing,
+    they are collected and returned along with the parsed protocols.
+
+    SIP008 JSON documents and Clash YAML documents with a `proxies` list are
+    recognized by their first line and read with `uniproxy.readers` instead,
+    their errors carry the line where the invalid entry starts. `cache` and the
+    parallel options only apply to URI lists.
+
+    Parsing is CPU bound, large bodies can be split into chunks of `chunk_size`
+    lines and parsed in a `ProcessPoolExecutor` by passing `max_workers` other
+    than `1`. Bodies with less than `parallel_threshold` lines are always
+    parsed serially, where the cost of the pool would outweigh the gain.
+
+    Example:
+
+    ```python
+    protocols, errors = parse_subscription(resp.content)
+    for err in errors:
+        print(f"line {err.lineno}: {err.reason}")
+
+    # use all cores for large bodies
+    protocols, errors = parse_subscription(resp.content, max_workers=None)
+    ```
+
+    Args:
+      blob (str | bytes):
+        The subscription body, base64 encoded or plain URIs, SIP008 JSON or
+        Clash YAML.
+      cache (UriParseCache | None):
+        Reuse protocols of lines parsed before. Lookups happen in the calling
+        process, only lines missing from the cache are sent to the workers.
+      max_workers (int | None):
+        Number of worker processes, `None` for the number of CPUs. `1` (the
+        default) disables parallel parsing.
+      chunk_size (int):
+        Number of lines sent to a worker at once.
+      parallel_threshold (int):
+        Minimum number of lines to parse the body in parallel.
+
+    Returns:
+      tuple[list[UniproxyProtocol], list[UriParseError]]:
+        Parsed protocols and the errors of invalid lines, both in input order.
+    """
+    if isinstance(blob, bytes):
+        blob = blob.decode()
+    match _sniff_format(blob):
+        case "sip008":
+            from uniproxy.readers import iter_sip008
+
+            return _split_results(iter_sip008((blob,)))
+        case "clash":
+            from uniproxy.readers import iter_clash_proxies
+
+            return _split_results(iter_clash_proxies(blob.splitlines()))
+        case _:
+            pass
+
+    lines = decode_subscription(blob).splitlines()
+    if max_workers == 1 or len(lines) < parallel_threshold:
+        return _split_results(_iter_parsed(enumerate(lines, 1), cache))
+
+    hits: list[_ParseResult] = []
+    if cache is not None:
+        for i, line in enumerate(lines):
+            line = line.strip()
+            if line and (cached := cache.get(line)) is not None:
+                hits.append((i + 1, cached))
+                lines[i] = ""  # blank lines are skipped by the workers
+
+    starts = range(0, len(lines), chunk_size)
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        # `map` yields the results in the order of the chunks
+        chunks = executor.map(
+            _parse_chunk,
+            (start + 1 for start in starts),
+            (lines[start : start + chunk_size] for start in starts),
+        )
+        results = list(merge(hits, chain.from_iterable(chunks), key=itemgetter(0)))
+
+    if cache is not None:
+        for lineno, each in results:
+            # lines of cache hits were blanked above
+            if lines[lineno - 1] and not isinstance(each, UriParseError):
+                cache.put(lines[lineno - 1].strip(), each)
+    return _split_results(results)
+
+
+_STREAM_CHUNK_SIZE = 64 * 1024
+_SNIFF_SIZE = 256
+
+type _Format = Literal["uri", "base64", "sip008", "clash"]
+
+_URI_START = re.compile(r"[A-Za-z][A-Za-z0-9+.-]*://")
+_YAML_KEY = re.compile(r"[\w-]+[ \t]*:(?:[ \t]|$)")
+
+
+def _sniff_format(head: str, final: bool = True) -> _Format | None:
+    """Guess the format of a subscription body from its first line.
+
+    Returns `None` if `head` is not enough to tell, unless it is `final`.
+    """
+    lines = head.split("\n")
+    for i, line in enumerate(lines):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        if not final and i == len(lines) - 1 and len(line) < _SNIFF_SIZE:
+            return None  # the line may continue in the next chunk
+        if _URI_START.match(line):
+            return "uri"
+        if line[0] in "{[":
+            return "sip008"
+        if _YAML_KEY.match(line):
+            return "clash"
+        # `:` is not part of the base64 alphabet
+        return "base64"
+    return "uri" if final else None
+
+
+def _iter_text_chunks(stream: IO[str] | IO[bytes], chunk_size: int) -> Iterator[str]:
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    while chunk := stream.read(chunk_size):
+        if isinstance(chunk, bytes):
+            chunk = decoder.decode(chunk)
+        yield chunk
+    if tail := decoder.decode(b"", final=True):
+        yield tail
+
+
+def _iter_b64_decoded(chunks: Iterable[str]) -> Iterator[str]:
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    pending = ""
+    for chunk in chunks:
+        pending += "".join(chunk.split())
+        # only decode complete quanta, the rest waits for the next chunk
+        cut = len(pending) - len(pending) % 4
+        if cut:
+            yield decoder.decode(a2b_base64(pending[:cut]))
+            pending = pending[cut:]
+    tail = padded_b64decode(pending) if pending else b""
+    yield decoder.decode(tail, final=True)
+
+
+def _iter_lines(texts: Iterable[str]) -> Iterator[str]:
+    pending = ""
+    for text in texts:
+        lines = (pending + text).split("\n")
+        pending = lines.pop()
+        yield from lines
+    if pending:
+        yield pending
+
+
+def _iter_stream(
+    stream: IO[str] | IO[bytes], chunk_size: int, cache: UriParseCache | None
+) -> Iterator[_ParseResult]:
+    from uniproxy.readers import iter_clash_proxies, iter_sip008
+
+    chunks = _iter_text_chunks(stream, chunk_size)
+    head = ""
+    for chunk in chunks:
+        head += chunk
+        if (fmt := _sniff_format(head, final=False)) is not None:
+            break
+    else:
+        fmt = _sniff_format(head)
+
+    texts: Iterable[str] = chain((head,), chunks)
+    match fmt:
+        case "sip008":
+            return iter_sip008(texts)
+        case "clash":
+            return iter_clash_proxies(_iter_lines(texts))
+        case "base64":
+            texts = _iter_b64_decoded(texts)
+        case _:
+            pass
+    return _iter_parsed(enumerate(_iter_lines(texts), 1), cache)
+
+
+def iter_protocols(
+    stream: IO[str] | IO[bytes],
+    *,
+    on_error: Callable[[UriParseError], object] | None = None,
+    cache: UriParseCache | None = None,
+    chunk_size: int = _STREAM_CHUNK_SIZE,
+) -> Iterator[UniproxyProtocol]:
+    """Lazily parse protocols from a binary or text stream.
+
+    The stream is read `chunk_size` at a time. The format is sniffed from the
+    first line: plain URIs, a base64 encoded body, a SIP008 JSON document or a
+    Clash YAML document with a `proxies` list. Protocols are yielded one by one
+    as their lines (or entries) complete, so memory usage does not grow with
+    the size of the input.
+
+    Example:
+
+    ```python
+    with open("dump.txt", "rb") as f:
+        for protocol in iter_protocols(f, on_error=errors.append):
+            ...
+
+    # sockets work through their file interface
+    for protocol in iter_protocols(sock.makefile("rb")):
+        ...
+    ```
+
+    Args:
+      stream (IO[str] | IO[bytes]):
+        Any file-like object with a `read(size)` method.
+      on_error (Callable[[UriParseError], object] | None):
+        Called with every line which could not be parsed. Invalid lines are
+        skipped silently if not given.
+      cache (UriParseCache | None):
+        Reuse protocols of lines parsed before.
+      chunk_size (int):
+        Number of bytes (or characters) read from the stream at once.
+    """
+    for _, each in _iter_stream(stream, chunk_size, cache):
+        if isinstance(each, UriParseError):
+            if on_error is not None:
+                on_error(each)
+        else:
+            yield each
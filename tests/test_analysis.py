@@ -0,0 +1,89 @@
+from __future__ import annotations
+
+import json
+
+from uniproxy.analysis import MAX_SHADOWED_BY, find_shadowed_rules, prune_shadowed_rules
+from uniproxy.singbox.route_rules import RouteRule
+from uniproxy.uniproxy.rules import (
+    DestPortRule,
+    DomainKeywordRule,
+    DomainRule,
+    DomainSuffixGroupRule,
+    DomainSuffixRule,
+    FinalRule,
+    IPCidrRule,
+    ProcessNameRule,
+)
+
+
+def test_find_shadowed_rules():
+    rules = [
+        DomainSuffixRule(matcher="example.com", policy="Proxy"),
+        DomainKeywordRule(matcher="google", policy="Direct"),
+        IPCidrRule(matcher="10.0.0.0/24", policy="Direct", no_resolve=True),
+        IPCidrRule(matcher="10.0.1.0/24", policy="Direct"),
+        DestPortRule(matcher="1000-2000", policy="Direct"),
+        ProcessNameRule(matcher="curl", policy="Direct"),
+        # 5
+        DomainRule(matcher="a.example.com", policy="Direct"),
+        DomainSuffixGroupRule(matcher=["google.cn", "example.org"], policy="Proxy"),
+        # only covered by both prefixes together
+        IPCidrRule(matcher="10.0.0.0/23", policy="Proxy", no_resolve=True),
+        # resolving rules are not covered by `no_resolve` ones
+        IPCidrRule(matcher="10.0.0.0/25", policy="Proxy"),
+        DestPortRule(matcher="1500", policy="Proxy"),
+        # 10
+        ProcessNameRule(matcher="curl", policy="Proxy"),
+        FinalRule(policy="Proxy"),
+        DomainRule(matcher="unreachable.net", policy="Direct"),
+    ]
+    report = find_shadowed_rules(rules)
+    assert report.total == len(rules)
+    assert report.dead == (6, 8, 10, 11, 13)
+    shadowed = {(e.index, e.matcher): e.shadowed_by for e in report.entries}
+    assert shadowed == {
+        (6, "a.example.com"): (0,),
+        (7, "google.cn"): (1,),
+        (8, "10.0.0.0/23"): (2, 3),
+        (10, "1500"): (4,),
+        (11, "curl"): (5,),
+    }
+    assert json.loads(json.dumps(report.to_dict()))["dead"] == [6, 8, 10, 11, 13]
+
+
+def test_find_shadowed_singbox_rules():
+    rules = [
+        RouteRule(domain_suffix=["example.com"], outbound="proxy"),
+        RouteRule(ip_cidr=["10.0.0.0/8"], port_range=["1000:2000"], outbound="direct"),
+        RouteRule(port=[443], outbound="proxy"),
+        RouteRule(domain=["a.example.com", "b.example.com"], outbound="direct"),
+        RouteRule(domain=["a.example.com", "c.example.net"], outbound="direct"),
+        RouteRule(port=[443, 80], network="udp", outbound="direct"),
+        # 6: the CIDR of rule 1 is restricted to its ports
+        RouteRule(ip_cidr=["10.1.0.0/16"], outbound="direct"),
+        RouteRule(rule_set=["geosite-cn"], outbound="direct"),
+    ]
+    report = find_shadowed_rules(rules)
+    assert report.dead == (3,)
+
+    pruned, _ = prune_shadowed_rules(rules)
+    assert len(pruned) == len(rules) - 1
+    assert pruned[3].domain == ["c.example.net"]
+    assert pruned[4].port == [80]
+    assert pruned[5] is rules[6]
+
+
+def test_find_shadowed_rules_adjacent_prefixes():
+    n = 2_000
+    rules = [
+        IPCidrRule(matcher=f"10.{i >> 8}.{i & 255}.0/24", policy="Proxy")
+        for i in range(n)
+    ]
+    rules.append(IPCidrRule(matcher="10.0.0.0/19", policy="DIRECT"))
+    rules.append(IPCidrRule(matcher="10.0.0.0/12", policy="DIRECT"))
+    report = find_shadowed_rules(rules)
+    assert report.dead == (n,)
+    (entry,) = report.entries
+    assert entry.index == n
+    # owners are capped, not every one of the adjacent prefixes
+    assert entry.shadowed_by == tuple(range(MAX_SHADOWED_BY))
@@ -0,0 +1,74 @@
+from __future__ import annotations
+
+import pytest
+
+from uniproxy.clash.mrs import (
+    _zstd_compress,
+    _zstd_decompress,
+    compile_mrs_providers,
+    dumps_mrs,
+    loads_mrs,
+)
+from uniproxy.clash.providers import DomainRuleProvider, IPCidrRuleProvider
+from uniproxy.clash.rules import DomainRule, RuleSetRule
+from uniproxy.uniproxy.rules import (
+    DomainGroupRule,
+    DomainSuffixGroupRule,
+    IPCidrGroupRule,
+)
+
+
+def test_zstd_frames():
+    for data in [b"", b"mrs", bytes(range(256)) * 1200]:
+        frame = _zstd_compress(data)
+        assert frame[:4] == b"\x28\xb5\x2f\xfd"
+        assert _zstd_decompress(frame) == data
+
+
+def test_mrs_round_trip():
+    payload = ["+.example.com", ".cdn.example.net", "exact.example.org", "*.wild.com"]
+    assert loads_mrs(dumps_mrs("domain", payload)) == ("domain", sorted(payload))
+
+    cidrs = ["10.0.0.0/24", "10.0.1.0/24", "192.168.0.0/16", "2001:db8::/32"]
+    assert loads_mrs(dumps_mrs("ipcidr", cidrs)) == (
+        "ipcidr",
+        ["10.0.0.0/23", "192.168.0.0/16", "2001:db8::/32"],
+    )
+
+    with pytest.raises(ValueError):
+        dumps_mrs("classical", ["DOMAIN,example.com"])  # type: ignore[arg-type]
+    with pytest.raises(ValueError):
+        loads_mrs(_zstd_compress(b"SRS\x01"))
+
+
+def test_compile_mrs_providers(tmp_path):
+    rules = [
+        DomainGroupRule(matcher=["a.com"], policy="Proxy"),
+        DomainSuffixGroupRule(matcher=["b.com", ".c.com"], policy="Proxy"),
+        IPCidrGroupRule(
+            matcher=["10.0.0.0/8", "172.16.0.0/12"], policy="DIRECT", no_resolve=True
+        ),
+    ]
+    out, providers = compile_mrs_providers(rules, tmp_path, threshold=2)
+    assert out == [
+        DomainRule(matcher="a.com", policy="Proxy"),
+        RuleSetRule(matcher="inline-0", policy="Proxy"),
+        RuleSetRule(matcher="inline-1", policy="DIRECT", no_resolve=True),
+    ]
+    assert str(out[2]) == "RULE-SET,inline-1,DIRECT,no-resolve"
+    assert providers == [
+        DomainRuleProvider(
+            name="inline-0",
+            type="file",
+            format="mrs",
+            path=str(tmp_path / "inline-0.mrs"),
+        ),
+        IPCidrRuleProvider(
+            name="inline-1",
+            type="file",
+            format="mrs",
+            path=str(tmp_path / "inline-1.mrs"),
+        ),
+    ]
+    data = (tmp_path / "inline-0.mrs").read_bytes()
+    assert loads_mrs(data) == ("domain", ["+.b.com", ".c.com"])
@@ -14,3 +14,25 @@ def test_ip_rules_with_no_resolve():
 
         assert isinstance(rule, IPCidrRule)
         assert rule.no_resolve == uniproxy_rule.no_resolve
+
+
+def test_make_rules_from_uniproxy_many():
+    from uniproxy.clash.rules import make_rules_from_uniproxy_many
+    from uniproxy.uniproxy.protocols import HttpProtocol
+    from uniproxy.uniproxy.rules import (
+        DomainKeywordGroupRule,
+        DomainRule,
+        FinalRule,
+        IPCidrGroupRule,
+    )
+
+    proxy = HttpProtocol(name="Proxy", server="example.com", port=8080)
+    rules = [
+        DomainRule(matcher="example.com", policy=proxy),
+        DomainKeywordGroupRule(matcher=["google", "youtube"], policy=proxy),
+        IPCidrGroupRule(matcher=["1.0.0.0/24", "1.0.1.0/24"], policy="DIRECT"),
+        UniproxyIPCidrRule(matcher="10.0.0.0/8", policy="DIRECT", no_resolve=True),
+        FinalRule(policy=proxy),
+    ]
+    expected = [each for rule in rules for each in make_rules_from_uniproxy(rule)]
+    assert make_rules_from_uniproxy_many(rules) == expected
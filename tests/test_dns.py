@@ -0,0 +1,199 @@
+from __future__ import annotations
+
+import asyncio
+import struct
+from ipaddress import IPv4Address, IPv6Address
+
+import pytest
+
+from uniproxy.dns import DnsError, Resolver, resolve_protocols
+from uniproxy.uniproxy.protocols import (
+    ShadowsocksObfsPlugin,
+    ShadowsocksProtocol,
+    TrojanProtocol,
+    VmessProtocol,
+    VmessWsTransport,
+)
+from uniproxy.uniproxy.shared import TLS
+
+ZONE = {
+    ("hk.example.com", 1): [("203.0.113.1", 300)],
+    ("hk.example.com", 28): [("2001:db8::1", 60)],
+    ("jp.example.com", 1): [("203.0.113.2", 10)],
+}
+
+
+class _StubServer(asyncio.DatagramProtocol):
+    """Answer queries from `ZONE`, `NXDOMAIN` for unknown names."""
+
+    def __init__(self) -> None:
+        self.queries: list[tuple[str, int]] = []
+
+    def connection_made(self, transport: asyncio.BaseTransport) -> None:
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, addr: tuple[str, int]) -> None:
+        qid = data[:2]
+        offset, labels = 12, []
+        while length := data[offset]:
+            labels.append(data[offset + 1 : offset + 1 + length].decode())
+            offset += length + 1
+        question = data[12 : offset + 5]
+        name, qtype = ".".join(labels), struct.unpack_from("!H", data, offset + 1)[0]
+        self.queries.append((name, qtype))
+
+        known = any(n == name for n, _ in ZONE)
+        records = ZONE.get((name, qtype), [])
+        answers = b"".join(
+            struct.pack("!HHHIH", 0xC00C, qtype, 1, ttl, 4 if qtype == 1 else 16)
+            + (IPv4Address(ip) if qtype == 1 else IPv6Address(ip)).packed
+            for ip, ttl in records
+        )
+        flags = 0x8180 if known else 0x8183
+        header = qid + struct.pack("!HHHHH", flags, 1, len(records), 0, 0)
+        self.transport.sendto(header + question + answers, addr)  # pyright: ignore[reportAttributeAccessIssue]
+
+
+class _Clock:
+    now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+async def _start_stub() -> tuple[asyncio.DatagramTransport, _StubServer, int]:
+    loop = asyncio.get_running_loop()
+    transport, stub = await loop.create_datagram_endpoint(
+        _StubServer, local_addr=("127.0.0.1", 0)
+    )
+    return transport, stub, transport.get_extra_info("sockname")[1]
+
+
+def test_resolve_cache():
+    async def main() -> None:
+        transport, stub, port = await _start_stub()
+        clock = _Clock()
+        try:
+            async with Resolver(nameserver="127.0.0.1", port=port, clock=clock) as r:
+                hk = await asyncio.gather(
+                    *(r.resolve("hk.example.com") for _ in range(5))
+                )
+                assert hk[0] == (IPv4Address("203.0.113.1"), IPv6Address("2001:db8::1"))
+                assert all(each == hk[0] for each in hk)
+                assert len(stub.queries) == 2  # one A and one AAAA query
+
+                with pytest.raises(DnsError):
+                    await r.resolve("missing.example.com")
+                with pytest.raises(DnsError):
+                    await r.resolve("missing.example.com")
+                assert len(stub.queries) == 4  # NXDOMAIN is cached
+
+                # the lowest TTL of the answer counts
+                clock.now = 59
+                await r.resolve("HK.example.com.")
+                assert len(stub.queries) == 4
+                clock.now = 60
+                assert r.cached("hk.example.com") is None
+                await r.resolve("hk.example.com")
+                assert len(stub.queries) == 6
+        finally:
+            transport.close()
+
+    asyncio.run(main())
+
+
+def test_resolve_protocols():
+    protocols = [
+        TrojanProtocol(name="HK", server="hk.example.com", port=443, password="p"),
+        TrojanProtocol(
+            name="JP",
+            server="jp.example.com",
+            port=443,
+            password="p",
+            tls=TLS(server_name="sni.example.com"),
+        ),
+        ShadowsocksProtocol(
+            name="JP ss",
+            server="jp.example.com",
+            port=8388,
+            password="p",
+            method="aes-256-gcm",
+            plugin=ShadowsocksObfsPlugin(obfs="tls", obfs_host=""),
+        ),
+        ShadowsocksProtocol(
+            name="Missing",
+            server="missing.example.com",
+            port=8388,
+            password="p",
+            method="aes-256-gcm",
+        ),
+        ShadowsocksProtocol(
+            name="IP", server="192.0.2.1", port=8388, password="p", method="aes-256-gcm"
+        ),
+    ]
+
+    async def main() -> tuple[list, dict]:
+        transport, stub, port = await _start_stub()
+        try:
+            async with Resolver(nameserver="127.0.0.1", port=port) as r:
+                result = await resolve_protocols(protocols, r, rewrite=True)
+                assert {name for name, _ in stub.queries} == {
+                    "hk.example.com",
+                    "jp.example.com",
+                    "missing.example.com",
+                }
+                return result
+        finally:
+            transport.close()
+
+    (hk, jp, jp_ss, missing, ip), errors = asyncio.run(main())
+    assert list(errors) == ["missing.example.com"]
+
+    assert hk.server == IPv4Address("203.0.113.1")
+    assert hk.tls == TLS(server_name="hk.example.com")
+    assert jp.server == IPv4Address("203.0.113.2")
+    assert jp.tls == TLS(server_name="sni.example.com")
+    assert jp_ss.server == IPv4Address("203.0.113.2")
+    assert jp_ss.plugin == ShadowsocksObfsPlugin(obfs="tls", obfs_host="jp.example.com")
+    assert missing is protocols[3]
+    assert ip is protocols[4]
+
+
+def test_resolve_protocols_rewrite_vmess():
+    protocols = [
+        VmessProtocol(
+            name="HK ws",
+            server="hk.example.com",
+            port=443,
+            uuid="u",
+            tls=TLS(),
+            transport=VmessWsTransport(path="/ws"),
+        ),
+        VmessProtocol(
+            name="HK ws host",
+            server="hk.example.com",
+            port=443,
+            uuid="u",
+            transport=VmessWsTransport(path="/ws", headers={"host": "cdn.example.com"}),
+        ),
+    ]
+
+    async def main() -> tuple[list, dict]:
+        transport, _, port = await _start_stub()
+        try:
+            async with Resolver(nameserver="127.0.0.1", port=port) as r:
+                return await resolve_protocols(protocols, r, rewrite=True)
+        finally:
+            transport.close()
+
+    (ws, ws_host), errors = asyncio.run(main())
+    assert not errors
+
+    assert ws.server == IPv4Address("203.0.113.1")
+    assert ws.tls == TLS(server_name="hk.example.com")
+    assert ws.transport == VmessWsTransport(
+        path="/ws", headers={"Host": "hk.example.com"}
+    )
+    assert protocols[0].transport.headers is None
+    assert ws_host.server == IPv4Address("203.0.113.1")
+    assert ws_host.transport == protocols[1].transport
@@ -0,0 +1,89 @@
+from __future__ import annotations
+
+import json
+
+from uniproxy.equivalence import check_equivalence, synthetic_requests
+from uniproxy.uniproxy.rules import (
+    DestPortRule,
+    DomainKeywordRule,
+    DomainSuffixGroupRule,
+    FinalRule,
+    GeoIPRule,
+    IPCidrRule,
+)
+
+
+def test_check_equivalence():
+    rules = [
+        DomainSuffixGroupRule(matcher=["example.com", "example.org"], policy="Proxy"),
+        DomainKeywordRule(matcher="tracker", policy="REJECT"),
+        # sing-box matches neither ports nor CIDRs of rejected rules
+        IPCidrRule(matcher="10.0.0.0/8", policy="REJECT"),
+        IPCidrRule(matcher="203.0.113.0/24", policy="DIRECT"),
+        GeoIPRule(matcher="CN", policy="DIRECT"),
+        FinalRule(policy="Proxy"),
+    ]
+    requests = [
+        ("www.example.com", None, 443),
+        ("ads.tracker.net", None, 443),
+        ("ads.tracker.net", None, 443),
+        (None, "10.1.2.3", 80),
+        (None, "203.0.113.7", 80),
+        ("resolved.test", "203.0.113.7", None),
+    ]
+    report = check_equivalence(rules, requests)
+    assert report.total == 6
+    assert report.unique == 5
+    assert report.errors == {}
+    assert report.skipped == {"uniproxy": 1, "surge": 1, "clash": 1, "sing-box": 1}
+    assert report.by_backend == {"surge": 0, "clash": 0, "sing-box": 4}
+
+    # "tracker" as a suffix of rejected domains, "10.0.0.0/8" as a suffix as
+    # well, and "resolved.test" as sing-box does not resolve for `ip_cidr`
+    assert report.disagreeing == 4
+    first = report.examples[0]
+    assert first.request == ("ads.tracker.net", None, 443)
+    assert first.count == 2
+    assert first.policies == {
+        "uniproxy": "REJECT",
+        "surge": "REJECT",
+        "clash": "REJECT",
+        "sing-box": "Proxy",
+    }
+    assert {d.request for d in report.examples[1:]} == {
+        (None, "10.1.2.3", 80),
+        ("resolved.test", "203.0.113.7", None),
+    }
+    assert json.loads(json.dumps(report.to_dict()))["disagreeing"] == 4
+
+
+def test_synthetic_requests():
+    rules = [
+        DomainSuffixGroupRule(matcher=["example.com"], policy="Proxy"),
+        IPCidrRule(matcher="10.0.0.0/8", policy="DIRECT"),
+        DestPortRule(matcher="8000-8999", policy="DIRECT"),
+    ]
+    requests = synthetic_requests(rules, 2000)
+    assert len(requests) == 2000
+    assert synthetic_requests(rules, 2000) == requests
+    domains = {domain for domain, _, _ in requests}
+    assert {"example.com", "www.example.com", "com"} <= domains
+    assert any(ip and ip.startswith("10.") for _, ip, _ in requests)
+    assert any(port and 8000 <= port <= 8999 for _, _, port in requests)
+
+    report = check_equivalence(rules, requests, backends=["surge", "clash"])
+    assert report.disagreeing == 0
+
+
+def test_check_equivalence_unconvertible_rule():
+    # sing-box cannot convert `DEST-PORT` rules, the others are still compared
+    rules = [
+        DestPortRule(matcher="8080", policy="DIRECT"),
+        DomainSuffixGroupRule(matcher=["example.com"], policy="Proxy"),
+        FinalRule(policy="DIRECT"),
+    ]
+    requests = [("www.example.com", None, 443), ("other.test", None, 8080)]
+    report = check_equivalence(rules, requests)
+    assert report.errors == {}
+    assert report.skipped == {"uniproxy": 0, "surge": 0, "clash": 0, "sing-box": 1}
+    assert report.by_backend == {"surge": 0, "clash": 0, "sing-box": 0}
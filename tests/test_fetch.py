@@ -0,0 +1,137 @@
+from __future__ import annotations
+
+import asyncio
+import gzip
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+
+from uniproxy.fetch import Fetcher, FetchError
+from uniproxy.uniproxy.providers import ProxyProvider, RuleProvider
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    connections = 0
+    requests = 0
+
+    def setup(self) -> None:
+        type(self).connections += 1
+        super().setup()
+
+    def log_message(self, format: str, *args: object) -> None:
+        pass
+
+    def do_GET(self) -> None:
+        type(self).requests += 1
+        if self.path == "/redirect":
+            self.send_response(302)
+            self.send_header("Location", "/sub/redirected")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+        elif self.path == "/chunked":
+            body = gzip.compress(b"chunked body")
+            self.send_response(200)
+            self.send_header("Transfer-Encoding", "chunked")
+            self.send_header("Content-Encoding", "gzip")
+            self.end_headers()
+            for i in range(0, len(body), 8):
+                chunk = body[i : i + 8]
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+            self.wfile.write(b"0\r\n\r\n")
+        elif self.path.startswith("/sub/"):
+            etag = '"%s"' % self.path.rsplit("/", 1)[1]
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.end_headers()
+                return
+            body = self.path.encode()
+            self.send_response(200)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+
+@pytest.fixture
+def server():
+    _Handler.connections = _Handler.requests = 0
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    httpd.daemon_threads = False  # join handler threads on close
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_fetch_reuses_connections(server: str):
+    async def main():
+        async with Fetcher(per_host_limit=2) as fetcher:
+            return await fetcher.fetch_all(f"{server}/sub/{i}" for i in range(20))
+
+    results = asyncio.run(main())
+
+    assert [r.content for r in results.values()] == [
+        f"/sub/{i}".encode() for i in range(20)
+    ]
+    assert _Handler.requests == 20
+    assert _Handler.connections <= 2
+
+
+def test_fetch_conditional_get(server: str, tmp_path: Path):
+    url = f"{server}/sub/1"
+
+    async def main():
+        async with Fetcher(cache_dir=tmp_path) as fetcher:
+            return await fetcher.fetch(url)
+
+    first = asyncio.run(main())
+    second = asyncio.run(main())
+
+    assert (first.status, first.content, first.etag) == (200, b"/sub/1", '"1"')
+    assert second.not_modified
+    assert second.content == first.content
+
+
+def test_fetch_redirect_chunked_and_errors(server: str):
+    async def main():
+        async with Fetcher() as fetcher:
+            redirected = await fetcher.fetch(f"{server}/redirect")
+            chunked = await fetcher.fetch(f"{server}/chunked")
+            with pytest.raises(FetchError):
+                await fetcher.fetch(f"{server}/missing")
+        return redirected, chunked
+
+    redirected, chunked = asyncio.run(main())
+
+    assert redirected.content == b"/sub/redirected"
+    assert chunked.content == b"chunked body"
+
+
+def test_fetch_providers(server: str):
+    providers = [
+        ProxyProvider(name="a", type="select", url=f"{server}/sub/a"),
+        ProxyProvider(name="b", type="select", url=f"{server}/sub/a"),
+        RuleProvider(name="rules", url=f"{server}/sub/rules"),
+    ]
+
+    async def main():
+        async with Fetcher() as fetcher:
+            return await fetcher.fetch_providers(providers)
+
+    results = asyncio.run(main())
+
+    assert {k: v.content for k, v in results.items()} == {
+        "a": b"/sub/a",
+        "b": b"/sub/a",
+        "rules": b"/sub/rules",
+    }
+    assert _Handler.requests == 2
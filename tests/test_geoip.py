@@ -0,0 +1,200 @@
+from __future__ import annotations
+
+import json
+from ipaddress import ip_network
+
+import pytest
+
+from uniproxy.geoip import (
+    GeoIPTable,
+    expand_geoip_rules,
+    geoip_rule_sets,
+    load_csv,
+    load_geoip,
+    load_mmdb,
+)
+from uniproxy.singbox.rule_sets import load_rule_set
+from uniproxy.uniproxy.rules import (
+    DomainRule,
+    GeoIPRule,
+    IPCidr6GroupRule,
+    IPCidrGroupRule,
+)
+
+NETWORKS = {
+    "1.0.1.0/24": "CN",
+    "1.0.2.0/23": "CN",
+    "1.0.4.0/24": "CN",
+    "1.0.5.0/24": "CN",
+    "8.8.8.0/24": "US",
+    "2001:db8::/32": "JP",
+}
+
+
+def _string(value: str) -> bytes:
+    return bytes([0x40 | len(value)]) + value.encode()
+
+
+def _uint32(value: int) -> bytes:
+    return b"\xc4" + value.to_bytes(4)
+
+
+def _map(items: dict[str, bytes]) -> bytes:
+    return bytes([0xE0 | len(items)]) + b"".join(
+        _string(k) + v for k, v in items.items()
+    )
+
+
+def _mmdb(networks: dict[str, str]) -> bytes:
+    """A MaxMind DB of 24 bit records, IPv4 mapped into ::/96 and aliased."""
+    nodes: list[list[tuple[str, int] | None]] = [[None, None]]
+    data = bytearray()
+    offsets: dict[str, int] = {}
+
+    def insert(value: int, depth: int, record: tuple[str, int]) -> None:
+        node = 0
+        for i in range(depth - 1):
+            bit = value >> (127 - i) & 1
+            if nodes[node][bit] is None:
+                nodes.append([None, None])
+                nodes[node][bit] = ("node", len(nodes) - 1)
+            node = nodes[node][bit][1]  # type: ignore[index]
+        nodes[node][value >> (128 - depth) & 1] = record
+
+    for cidr, country in networks.items():
+        net = ip_network(cidr)
+        if country not in offsets:
+            offsets[country] = len(data)
+            data += _map({"country": _map({"iso_code": _string(country)})})
+        shift = 96 if net.version == 4 else 0
+        insert(
+            int(net.network_address), net.prefixlen + shift, ("data", offsets[country])
+        )
+    ipv4 = 0
+    for _ in range(96):
+        ipv4 = nodes[ipv4][0][1]  # type: ignore[index]
+    insert(0xFFFF << 32, 96, ("node", ipv4))
+
+    count = len(nodes)
+    tree = bytearray()
+    for children in nodes:
+        for child in children:
+            match child:
+                case None:
+                    tree += count.to_bytes(3)
+                case ("node", node):
+                    tree += node.to_bytes(3)
+                case ("data", offset):
+                    tree += (count + 16 + offset).to_bytes(3)
+    metadata = _map({
+        "node_count": _uint32(count),
+        "record_size": _uint32(24),
+        "ip_version": _uint32(6),
+    })
+    return bytes(tree + bytes(16) + data + b"\xab\xcd\xefMaxMind.com" + metadata)
+
+
+EXPECTED = {
+    "CN": ("1.0.1.0/24", "1.0.2.0/23", "1.0.4.0/23"),
+    "JP": ("2001:db8::/32",),
+    "US": ("8.8.8.0/24",),
+}
+
+
+def test_load_mmdb(tmp_path):
+    path = tmp_path / "Country.mmdb"
+    path.write_bytes(_mmdb(NETWORKS))
+    table = load_mmdb(path)
+    assert table.countries == EXPECTED
+    assert table.cidrs("cn") == EXPECTED["CN"]
+
+
+def test_load_csv(tmp_path):
+    path = tmp_path / "country.csv"
+    path.write_text(
+        "network,country\n"
+        + "".join(f"{k},{v}\n" for k, v in NETWORKS.items())
+        + "10.0.0.0/8,-\n"
+    )
+    assert load_csv(path).countries == EXPECTED
+
+    path.write_text("16777472,16777727,CN\n16778240,16778495,CN\n0,255,-\n")
+    assert load_csv(path).countries == {"CN": ("1.0.1.0/24", "1.0.4.0/24")}
+
+
+def test_load_csv_geolite2(tmp_path):
+    blocks = tmp_path / "GeoLite2-Country-Blocks-IPv4.csv"
+    blocks.write_text(
+        "network,geoname_id,registered_country_geoname_id\n"
+        "1.0.1.0/24,1814991,1814991\n"
+        "8.8.8.0/24,,6252001\n"
+        # continent level location, falls back to the registered country
+        "2.16.0.0/24,6255148,2921044\n"
+    )
+    locations = tmp_path / "GeoLite2-Country-Locations-en.csv"
+    locations.write_text(
+        "geoname_id,locale_code,country_iso_code\n"
+        "1814991,en,CN\n6252001,en,US\n6255148,en,\n2921044,en,DE\n"
+    )
+    with pytest.raises(ValueError):
+        load_csv(blocks)
+    assert load_csv(blocks, locations).countries == {
+        "CN": ("1.0.1.0/24",),
+        "DE": ("2.16.0.0/24",),
+        "US": ("8.8.8.0/24",),
+    }
+
+
+def test_load_geoip_cache(tmp_path):
+    path = tmp_path / "Country.mmdb"
+    path.write_bytes(_mmdb(NETWORKS))
+    cache_dir = tmp_path / "cache"
+    assert load_geoip(path, cache_dir=cache_dir).countries == EXPECTED
+    (cached,) = cache_dir.iterdir()
+    cached.write_text('{"version": 1, "countries": {"CN": ["1.0.1.0/24"]}}')
+    assert load_geoip(path, cache_dir=cache_dir).countries == {"CN": ("1.0.1.0/24",)}
+    # a changed database is compiled again
+    path.write_bytes(_mmdb({"8.8.8.0/24": "US"}))
+    assert load_geoip(path, cache_dir=cache_dir).countries == {"US": ("8.8.8.0/24",)}
+
+
+def test_geoip_rule_sets(tmp_path):
+    table = GeoIPTable(countries=EXPECTED)
+    (rule_set,) = geoip_rule_sets(table, ["cn"], tmp_path)
+    assert rule_set.tag == "rs-geoip-cn"
+    assert load_rule_set(rule_set.path) == [{"ip_cidr": list(EXPECTED["CN"])}]
+    with pytest.raises(ValueError):
+        geoip_rule_sets(table, ["de"], tmp_path)
+
+
+def test_expand_geoip_rules():
+    table = GeoIPTable(
+        countries={"CN": ("1.0.1.0/24", "240e::/20"), "US": ("8.8.8.0/24",)}
+    )
+    rules = [
+        DomainRule(matcher="a.com", policy="Proxy"),
+        GeoIPRule(matcher="CN", policy="DIRECT", no_resolve=True),
+        GeoIPRule(matcher="us", policy="Proxy"),
+    ]
+    assert expand_geoip_rules(rules, table) == [
+        DomainRule(matcher="a.com", policy="Proxy"),
+        IPCidrGroupRule(matcher=["1.0.1.0/24"], policy="DIRECT", no_resolve=True),
+        IPCidr6GroupRule(matcher=["240e::/20"], policy="DIRECT", no_resolve=True),
+        IPCidrGroupRule(matcher=["8.8.8.0/24"], policy="Proxy"),
+    ]
+    with pytest.raises(ValueError):
+        expand_geoip_rules([GeoIPRule(matcher="DE", policy="Proxy")], table)
+
+
+def test_load_geoip_corrupt_cache(tmp_path):
+    path = tmp_path / "Country.mmdb"
+    path.write_bytes(_mmdb(NETWORKS))
+    cache_dir = tmp_path / "cache"
+    load_geoip(path, cache_dir=cache_dir)
+    (cached,) = cache_dir.iterdir()
+    for corrupt in ('{"version": 1, "countr', '{"version": 1}', "[]"):
+        cached.write_text(corrupt)
+        assert load_geoip(path, cache_dir=cache_dir).countries == EXPECTED
+    # rewritten whole, without temporary files left behind
+    assert list(cache_dir.iterdir()) == [cached]
+    assert json.loads(cached.read_text())["countries"]["US"] == ["8.8.8.0/24"]
@@ -0,0 +1,64 @@
+from __future__ import annotations
+
+from uniproxy.matcher import KeywordAutomaton, RuleMatcher
+from uniproxy.uniproxy.rules import (
+    DestPortRule,
+    DomainKeywordGroupRule,
+    DomainRule,
+    DomainSuffixRule,
+    FinalRule,
+    GeoIPRule,
+    IPCidr6Rule,
+    IPCidrGroupRule,
+    IPCidrRule,
+    ProcessNameRule,
+)
+
+
+def test_keyword_automaton():
+    automaton = KeywordAutomaton()
+    for index, keyword in enumerate(["she", "he", "his", "hers", "ushe"]):
+        automaton.add(keyword, index)
+    assert automaton.search("ushers") == 0
+    assert automaton.search("ahishers") == 0
+    assert automaton.search("xhex") == 1
+    assert automaton.search("xyz") is None
+
+
+def test_rule_matcher():
+    rules = [
+        ProcessNameRule(matcher="curl", policy="Direct"),
+        DomainRule(matcher="api.foo.com", policy="Api"),
+        GeoIPRule(matcher="CN", policy="Direct"),
+        DomainSuffixRule(matcher="foo.com", policy="Foo"),
+        DomainKeywordGroupRule(matcher=["google", "tracker"], policy="Reject"),
+        # 5
+        IPCidrRule(matcher="10.0.0.0/8", policy="Lan", no_resolve=True),
+        IPCidrGroupRule(matcher=["203.0.113.0/24", "10.1.0.0/16"], policy="Doc"),
+        IPCidr6Rule(matcher="2001:db8::/32", policy="Doc6", no_resolve=True),
+        DestPortRule(matcher="8000-8999", policy="Dev"),
+        FinalRule(policy="Proxy"),
+    ]
+    matcher = RuleMatcher(rules)
+    assert matcher.skipped == (2,)
+
+    def match(**kwargs) -> tuple[int, str]:
+        hit = matcher.match(**kwargs)
+        assert hit is not None
+        return hit.index, hit.policy
+
+    assert match(domain="api.foo.com", port=443, process="/usr/bin/curl") == (
+        0,
+        "Direct",
+    )
+    assert match(domain="API.foo.com.", port=443) == (1, "Api")
+    assert match(domain="cdn.foo.com") == (3, "Foo")
+    assert match(domain="mail.google.foo.com") == (3, "Foo")
+    assert match(domain="www.google.com") == (4, "Reject")
+    assert match(ip="10.1.2.3") == (5, "Lan")
+    # `no_resolve` rules skip domain requests
+    assert match(domain="intranet.example", ip="10.1.2.3") == (6, "Doc")
+    assert match(ip="2001:db8::1") == (7, "Doc6")
+    assert match(domain="example.com", port=8080) == (8, "Dev")
+    assert match(domain="example.com", port=80) == (9, "Proxy")
+    assert RuleMatcher(rules[:2]).match(domain="example.com") is None
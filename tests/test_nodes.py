@@ -0,0 +1,142 @@
+from __future__ import annotations
+
+from ipaddress import IPv6Address
+
+from uniproxy.nodes import (
+    FilterEngine,
+    NodeFilter,
+    dedup_protocols,
+    diff_protocols,
+    filter_protocols,
+    protocol_identity,
+)
+from uniproxy.uniproxy.protocols import ShadowsocksProtocol, TrojanProtocol
+from uniproxy.uniproxy.shared import TLS
+
+
+def _trojan(name: str, server: str = "example.com", **kwargs) -> TrojanProtocol:
+    kwargs.setdefault("tls", TLS(server_name="example.com", alpn=["h2"]))
+    return TrojanProtocol(
+        name=name, server=server, port=443, password="secret", **kwargs
+    )
+
+
+def test_protocol_identity():
+    assert protocol_identity(_trojan("a")) == protocol_identity(
+        _trojan("b", server="EXAMPLE.com.")
+    )
+    assert protocol_identity(_trojan("a", server="::1")) == protocol_identity(
+        _trojan("b", server=IPv6Address("0::1"))
+    )
+    assert protocol_identity(_trojan("a")) != protocol_identity(
+        _trojan("a", tls=TLS(server_name="example.org"))
+    )
+    ss = ShadowsocksProtocol(
+        name="a",
+        server="example.com",
+        port=443,
+        password="secret",
+        method="aes-128-gcm",
+    )
+    assert protocol_identity(_trojan("a")) != protocol_identity(ss)
+
+
+def test_dedup_protocols():
+    protocols = [
+        _trojan("HK 01"),
+        _trojan("HK 01", server="hk2.example.com"),
+        _trojan("Hong Kong 01"),  # same node as the first one
+        _trojan("HK 01 #2"),  # taken by the input, same node as the first one
+        _trojan("HK 01", server="hk3.example.com"),
+        _trojan("HK 01 #2", server="hk4.example.com"),
+    ]
+
+    kept, dropped = dedup_protocols(protocols)
+
+    assert [p.name for p in kept] == ["HK 01", "HK 01 #3", "HK 01 #4", "HK 01 #2"]
+    assert [p.server for p in kept] == [
+        "example.com",
+        "hk2.example.com",
+        "hk3.example.com",
+        "hk4.example.com",
+    ]
+    assert [(d.protocol.name, d.duplicate_of.name) for d in dropped] == [
+        ("Hong Kong 01", "HK 01"),
+        ("HK 01 #2", "HK 01"),
+    ]
+    # inputs are not mutated
+    assert protocols[1].name == "HK 01"
+
+
+def test_diff_protocols():
+    previous = [
+        _trojan("a", server="a.example.com"),
+        _trojan("b", server="b.example.com"),
+        _trojan("c", server="c.example.com"),
+        _trojan("d", server="d.example.com"),
+    ]
+    current = [
+        _trojan("a", server="a.example.com"),
+        _trojan("b", server="b2.example.com"),  # changed server
+        _trojan("c2", server="c.example.com"),  # renamed
+        _trojan("e", server="e.example.com"),
+    ]
+
+    diff = diff_protocols(previous, current)
+
+    assert [p.name for p in diff.added] == ["e"]
+    assert [p.name for p in diff.removed] == ["d"]
+    assert [(a.name, b.name) for a, b in diff.modified] == [("b", "b"), ("c", "c2")]
+    assert not diff_protocols(previous, list(previous))
+
+
+def test_filter_engine():
+    protocols = [
+        _trojan(name)
+        for name in [
+            "HK 01",
+            "hong kong 02",
+            "JP 01",
+            "JP Test",
+            "剩余流量 10G",
+            "US 01",
+        ]
+    ]
+    engine = FilterEngine({
+        "HK": NodeFilter(include=["(?i)hk|hong kong"]),
+        "JP": NodeFilter(include=["(?i)jp"], exclude=["(?i)test"]),
+        "Asia": NodeFilter(include=["(?i)hk|hong kong", r"^JP (\d+)$"]),
+        "All": NodeFilter(exclude=["流量"]),
+    })
+
+    groups = engine.assign(protocols)
+
+    assert {k: [p.name for p in v] for k, v in groups.items()} == {
+        "HK": ["HK 01", "hong kong 02"],
+        "JP": ["JP 01"],
+        "Asia": ["HK 01", "hong kong 02", "JP 01"],
+        "All": ["HK 01", "hong kong 02", "JP 01", "JP Test", "US 01"],
+    }
+    assert [p.name for p in filter_protocols(protocols, "^US")] == ["US 01"]
+
+
+def test_filter_engine_fallback():
+    # numbered backreferences are not fused, they would point to other groups
+    engine = FilterEngine({
+        "HK": NodeFilter(include=["(HK)"]),
+        "double": NodeFilter(include=[r"(\d)\1"]),
+    })
+    assert engine.match("HK 11") == ["HK", "double"]
+    assert engine.match("HK 12") == ["HK"]
+
+
+def test_filter_engine_newline():
+    # `.` must not match a newline in the fused expression either
+    engine = FilterEngine({
+        "dot": NodeFilter(include=["HK.01"]),
+        "start": NodeFilter(include=["^01"]),
+    })
+    assert engine.match("HK\n01") == []
+    assert engine.match("HK 01") == ["dot"]
+    # but the scan for a match still starts after a newline, as `re.search`
+    assert engine.match("node\nHK 01") == ["dot"]
@@ -0,0 +1,95 @@
+from __future__ import annotations
+
+from uniproxy.optimize import DomainTrie, aggregate_cidrs, prune_subsumed_domains
+from uniproxy.uniproxy.rules import (
+    DomainGroupRule,
+    DomainKeywordRule,
+    DomainRule,
+    DomainSuffixGroupRule,
+    DomainSuffixRule,
+    IPCidr6GroupRule,
+    IPCidr6Rule,
+    IPCidrGroupRule,
+    IPCidrRule,
+)
+
+
+def test_domain_trie():
+    trie = DomainTrie()
+    trie.add_suffix("example.com", 0)
+    trie.add_domain("a.org", 1)
+    trie.add_suffix(".b.org", 2)
+
+    assert trie.covering_domain("example.com") == 0
+    assert trie.covering_domain("A.B.Example.com.") == 0
+    assert trie.covering_suffix("cdn.example.com") == 0
+    assert trie.covering_domain("badexample.com") is None
+    assert trie.covering_domain("a.org") == 1
+    assert trie.covering_domain("x.a.org") is None
+    assert trie.covering_suffix("a.org") is None
+    # subdomains only
+    assert trie.covering_domain("b.org") is None
+    assert trie.covering_domain("x.b.org") == 2
+    assert trie.covering_suffix("x.b.org") == 2
+    assert trie.covering_suffix(".b.org") == 2
+    assert trie.covering_suffix("b.org") is None
+
+
+def test_prune_subsumed_domains():
+    rules = [
+        DomainSuffixRule(matcher="example.com", policy="Proxy"),
+        DomainRule(matcher="a.b.example.com", policy="Proxy"),
+        IPCidrRule(matcher="10.0.0.0/8", policy="Proxy"),
+        DomainSuffixRule(matcher="cdn.example.com", policy="Proxy"),
+        DomainSuffixGroupRule(
+            matcher=["x.example.com", "api.other.com", "other.com"], policy="Proxy"
+        ),
+        DomainKeywordRule(matcher="example", policy="Proxy"),
+        # a different policy starts a new run
+        DomainRule(matcher="direct.example.com", policy="DIRECT"),
+        DomainSuffixRule(matcher="example.com", policy="Proxy"),
+        DomainGroupRule(matcher=["www.example.com", "example.org"], policy="Proxy"),
+        DomainGroupRule(matcher=["www.example.com"], policy="Proxy"),
+    ]
+    pruned, removed = prune_subsumed_domains(rules)
+    assert pruned == [
+        rules[0],
+        rules[2],
+        DomainSuffixGroupRule(matcher=["other.com"], policy="Proxy"),
+        rules[5],
+        rules[6],
+        rules[7],
+        DomainGroupRule(matcher=["example.org"], policy="Proxy"),
+    ]
+    assert removed == 6
+
+
+def test_aggregate_cidrs():
+    rules = [
+        IPCidrRule(matcher="1.0.0.0/24", policy="Proxy", no_resolve=True),
+        IPCidrGroupRule(
+            matcher=["1.0.1.0/24", "1.0.0.128/25", "8.8.8.8/32"],
+            policy="Proxy",
+            no_resolve=True,
+        ),
+        IPCidr6Rule(matcher="2001:db8::/33", policy="Proxy", no_resolve=True),
+        IPCidr6Rule(matcher="2001:db8:8000::/33", policy="Proxy", no_resolve=True),
+        # `no_resolve` differs
+        IPCidrRule(matcher="1.0.2.0/24", policy="Proxy"),
+        IPCidrRule(matcher="1.0.3.0/24", policy="Proxy"),
+        DomainRule(matcher="example.com", policy="Proxy"),
+        IPCidrRule(matcher="10.0.0.0/8", policy="DIRECT"),
+        IPCidrRule(matcher="11.0.0.0/8", policy="Proxy"),
+    ]
+    aggregated, saved = aggregate_cidrs(rules)
+    assert aggregated == [
+        IPCidrGroupRule(
+            matcher=["1.0.0.0/23", "8.8.8.8/32"], policy="Proxy", no_resolve=True
+        ),
+        IPCidr6GroupRule(matcher=["2001:db8::/32"], policy="Proxy", no_resolve=True),
+        IPCidrGroupRule(matcher=["1.0.2.0/23"], policy="Proxy"),
+        rules[6],
+        rules[7],
+        rules[8],
+    ]
+    assert saved == 4
@@ -0,0 +1,163 @@
+import io
+import json
+
+import pytest
+
+from uniproxy.readers import iter_clash_proxies, iter_sip008
+from uniproxy.uniproxy.protocols import (
+    ShadowsocksObfsPlugin,
+    ShadowsocksProtocol,
+    TrojanProtocol,
+    VmessProtocol,
+    VmessWsTransport,
+)
+from uniproxy.uri import UriParseError, iter_protocols, parse_subscription
+
+SIP008 = json.dumps(
+    {
+        "version": 1,
+        "servers": [
+            {
+                "id": "27b8a625-4f4b-4428-9f0f-8a2317db7c79",
+                "remarks": "HK 01",
+                "server": "hk.example.com",
+                "server_port": 8388,
+                "password": "secret",
+                "method": "aes-256-gcm",
+                "plugin": "obfs-local",
+                "plugin_opts": "obfs=http;obfs-host=www.bing.com",
+            },
+            {
+                "remarks": "Invalid",
+                "server": "bad.example.com",
+                "server_port": 8388,
+                "password": "secret",
+                "method": "rc4-md5",
+            },
+            {
+                "remarks": "JP 01",
+                "server": "jp.example.com",
+                "server_port": 443,
+                "password": "pass:word",
+                "method": "chacha20-ietf-poly1305",
+            },
+        ],
+        "bytes_used": 274877906944,
+    },
+    indent=2,
+)
+
+CLASH = """\
+# managed by provider
+mixed-port: 7890
+proxies:
+  - name: HK 01
+    type: ss
+    server: hk.example.com
+    port: 8388
+    cipher: aes-256-gcm
+    password: secret
+    udp: true
+    plugin: obfs
+    plugin-opts:
+      mode: tls
+      host: www.bing.com
+
+  # comments and blank lines inside the list are fine
+  - {name: JP 01, type: trojan, server: jp.example.com, port: 443, password: p, sni: jp.example.com}
+  - name: US 01
+    type: vmess
+    server: us.example.com
+    port: 443
+    uuid: 27b8a625-4f4b-4428-9f0f-8a2317db7c79
+    alterId: 0
+    cipher: auto
+    tls: true
+    network: ws
+    ws-opts:
+      path: /ws
+  - name: Unsupported
+    type: hysteria2
+    server: hy.example.com
+    port: 443
+proxy-groups:
+  - name: Proxy
+    type: select
+    proxies: [HK 01, JP 01]
+"""
+
+
+def test_iter_sip008():
+    results = list(iter_sip008([SIP008[i : i + 5] for i in range(0, len(SIP008), 5)]))
+    assert [lineno for lineno, _ in results] == [4, 14, 21]
+
+    hk = results[0][1]
+    assert isinstance(hk, ShadowsocksProtocol)
+    assert hk.name == "HK 01"
+    assert hk.plugin == ShadowsocksObfsPlugin(
+        obfs="http", obfs_host="www.bing.com", command="obfs-local"
+    )
+    assert isinstance(results[1][1], UriParseError)
+    assert "rc4-md5" in results[1][1].reason
+    assert isinstance(results[2][1], ShadowsocksProtocol)
+    assert results[2][1].password == "pass:word"
+
+    bare = json.dumps(json.loads(SIP008)["servers"])
+    assert [type(each) for _, each in iter_sip008([bare])] == [
+        ShadowsocksProtocol,
+        UriParseError,
+        ShadowsocksProtocol,
+    ]
+
+
+def test_iter_sip008_invalid():
+    with pytest.raises(ValueError):
+        list(iter_sip008(['{"servers": [{"server": "a"']))
+
+
+def test_iter_clash_proxies():
+    results = list(iter_clash_proxies(CLASH.splitlines()))
+    assert [lineno for lineno, _ in results] == [4, 17, 18, 29]
+
+    hk, jp, us, unsupported = (each for _, each in results)
+    assert isinstance(hk, ShadowsocksProtocol)
+    assert hk.network == "tcp_and_udp"
+    assert hk.plugin == ShadowsocksObfsPlugin(obfs="tls", obfs_host="www.bing.com")
+    assert isinstance(jp, TrojanProtocol)
+    assert jp.tls is not None and jp.tls.server_name == "jp.example.com"
+    assert isinstance(us, VmessProtocol)
+    assert us.transport == VmessWsTransport(path="/ws")
+    assert isinstance(unsupported, UriParseError)
+    assert "hysteria2" in unsupported.reason
+
+
+@pytest.mark.parametrize("body", [SIP008, CLASH], ids=["sip008", "clash"])
+def test_sniffed_formats(body: str):
+    errors: list[UriParseError] = []
+    streamed = list(
+        iter_protocols(io.BytesIO(body.encode()), on_error=errors.append, chunk_size=7)
+    )
+    protocols, parse_errors = parse_subscription(body)
+    assert streamed == protocols
+    assert errors == parse_errors
+    assert len(protocols) == 2 if body is SIP008 else 3
+    assert len(errors) == 1
+
+
+def test_flat_items_same_as_yaml():
+    from ruamel.yaml import YAML
+
+    from uniproxy.readers import _flat_item
+
+    item = [
+        "- name: 'HK 01'",
+        "  type: ss",
+        "  server: 2001:db8::1",
+        "  port: 8388",
+        '  password: "0123"',
+        "  cipher: aes-256-gcm",
+        "  udp: True",
+        "  plugin: ~",
+        "  sni: a.example.com",
+    ]
+    assert _flat_item(item) == YAML(typ="safe").load("\n".join(item))[0]
@@ -0,0 +1,159 @@
+from __future__ import annotations
+
+import asyncio
+import random
+
+from uniproxy.scheduler import RefreshScheduler
+from uniproxy.uniproxy.providers import ProxyProvider
+
+
+class _Clock:
+    now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_scheduler_coalesces_urls():
+    clock = _Clock()
+    fetched: list[str] = []
+    received: list[tuple[str, str, object]] = []
+
+    async def fetch(url: str) -> str:
+        fetched.append(url)
+        if url.endswith("broken"):
+            raise ConnectionError(url)
+        return f"content of {url}"
+
+    def receiver(tenant: str):
+        return lambda url, result: received.append((tenant, url, result))
+
+    scheduler = RefreshScheduler(
+        fetch=fetch, jitter=0.1, clock=clock, rng=random.Random(0)
+    )
+    shared = "https://example.com/sub"
+    subs = [
+        scheduler.subscribe_provider(
+            ProxyProvider(
+                name=f"sub-{i}", type="select", url=shared, interval=interval
+            ),
+            receiver(f"tenant-{i}"),
+        )
+        for i, interval in enumerate([600, 300, 900])
+    ]
+    scheduler.subscribe("https://example.com/broken", 100, receiver("tenant-0"))
+
+    assert asyncio.run(scheduler.run_due()) == 2
+    assert sorted(fetched) == ["https://example.com/broken", shared]
+    assert [tenant for tenant, url, _ in received if url == shared] == [
+        "tenant-0",
+        "tenant-1",
+        "tenant-2",
+    ]
+    broken = [result for _, url, result in received if url.endswith("broken")]
+    assert len(broken) == 1 and isinstance(broken[0], ConnectionError)
+
+    # once per shortest interval, brought forward by at most 10%
+    next_run = scheduler.next_runs()[shared]
+    assert 270 <= next_run <= 300
+    stats = scheduler.stats()
+    assert stats[shared].interval == 300
+    assert stats[shared].dependents == 3
+    assert stats["https://example.com/broken"].failures == 1
+
+    fetched.clear()
+    clock.now = next_run + 5
+    assert scheduler.stats()[shared].lag == 5
+    asyncio.run(scheduler.run_due())
+    assert fetched.count(shared) == 1
+    assert scheduler.stats()[shared].last_lag == 5
+
+    # without the 300s dependent the shared URL falls back to 600s
+    scheduler.unsubscribe(subs[1])
+    clock.now += 1
+    asyncio.run(scheduler.run_due())
+    assert scheduler.stats()[shared].interval == 600
+    for sub in subs:
+        scheduler.unsubscribe(sub)
+    assert shared not in scheduler.next_runs()
+
+
+def test_scheduler_shorter_interval_brings_run_forward():
+    clock = _Clock()
+
+    async def fetch(url: str) -> str:
+        return url
+
+    scheduler = RefreshScheduler(fetch=fetch, jitter=0, clock=clock)
+    scheduler.subscribe("https://example.com/sub", 600, lambda *_: None)
+    asyncio.run(scheduler.run_due())
+    assert scheduler.next_runs()["https://example.com/sub"] == 600
+
+    clock.now = 50
+    scheduler.subscribe("https://example.com/sub", 60, lambda *_: None)
+    assert scheduler.next_runs()["https://example.com/sub"] == 60
+
+
+def test_scheduler_run():
+    fetched: list[str] = []
+
+    async def fetch(url: str) -> str:
+        fetched.append(url)
+        return url
+
+    async def main() -> None:
+        scheduler = RefreshScheduler(fetch=fetch, jitter=0)
+        task = asyncio.create_task(scheduler.run())
+        await asyncio.sleep(0.01)
+        # a new subscription wakes the idle scheduler up
+        scheduler.subscribe("https://example.com/sub", 0.05, lambda *_: None)
+        await asyncio.sleep(0.2)
+        task.cancel()
+
+    asyncio.run(main())
+    assert 3 <= len(fetched) <= 6
+
+
+def test_scheduler_unsubscribe_shortest_interval():
+    clock = _Clock()
+
+    async def fetch(url: str) -> str:
+        return url
+
+    url = "https://example.com/sub"
+    scheduler = RefreshScheduler(fetch=fetch, jitter=0, clock=clock)
+    scheduler.subscribe(url, 600, lambda *_: None)
+    fast = scheduler.subscribe(url, 60, lambda *_: None)
+    asyncio.run(scheduler.run_due())
+    assert scheduler.next_runs()[url] == 60
+
+    clock.now = 30
+    scheduler.unsubscribe(fast)
+    assert scheduler.next_runs()[url] == 600
+    clock.now = 61
+    assert asyncio.run(scheduler.run_due()) == 0
+
+
+def test_scheduler_run_slow_upstream():
+    fetched: list[str] = []
+
+    async def fetch(url: str) -> str:
+        fetched.append(url)
+        if url.endswith("slow"):
+            await asyncio.sleep(0.3)
+        return url
+
+    async def main() -> RefreshScheduler[str]:
+        scheduler = RefreshScheduler(fetch=fetch, jitter=0)
+        scheduler.subscribe("https://example.com/slow", 0.05, lambda *_: None)
+        scheduler.subscribe("https://example.com/fast", 0.05, lambda *_: None)
+        task = asyncio.create_task(scheduler.run())
+        await asyncio.sleep(0.25)
+        task.cancel()
+        return scheduler
+
+    scheduler = asyncio.run(main())
+    # the fast URL keeps its schedule while the slow one is in flight, once
+    assert fetched.count("https://example.com/slow") == 1
+    assert fetched.count("https://example.com/fast") >= 3
+    assert scheduler.stats()["https://example.com/fast"].max_lag < 0.05
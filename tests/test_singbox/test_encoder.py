@@ -0,0 +1,88 @@
+from __future__ import annotations
+
+import io
+import json
+
+import pytest
+from xattrs import asdict
+from xattrs.filters import exclude_if_none
+
+from uniproxy.singbox import DNS, Route, SingBoxConfig
+from uniproxy.singbox.encoder import dump, dumps, iterencode
+from uniproxy.singbox.general import Log
+from uniproxy.singbox.inbounds import HTTPInbound
+from uniproxy.singbox.outbounds import ShadowsocksOutbound
+from uniproxy.singbox.preconf import (
+    DNS_SERVER_FAKEIP,
+    DNS_SERVER_GOOGLE_HTTPS,
+    HC_DEFAULT,
+    OUT_DIRECT,
+    RULE_HIJACK_DNS,
+    RULE_SNIFF,
+)
+from uniproxy.singbox.route import LocalRuleSet
+from uniproxy.singbox.route_rules import RejectRule, RouteRule
+
+
+def make_config() -> SingBoxConfig:
+    proxy = ShadowsocksOutbound(
+        tag="Proxy 测试",
+        server="example.com",
+        server_port=8388,
+        method="aes-128-gcm",
+        password='p"a\\ss',
+    )
+    rules = [
+        RULE_SNIFF,
+        RULE_HIJACK_DNS,
+        RouteRule(
+            outbound="Proxy 测试", domain_suffix=["a.com", "b.com"], port=[80, 443]
+        ),
+        RouteRule(outbound="DIRECT", ip_cidr="10.0.0.0/8", invert=False),
+        RejectRule(domain_keyword=["ads"], method="drop"),
+        RouteRule(outbound="DIRECT", rule_set=["rs-geoip-cn"]),
+    ]
+    return SingBoxConfig(
+        inbounds=[HTTPInbound(tag="http-in", listen="127.0.0.1", listen_port=8080)],
+        outbounds=[OUT_DIRECT, proxy],
+        route=Route(
+            rules=rules,
+            rule_set=[LocalRuleSet(tag="rs-geoip-cn", format="binary", path="cn.srs")],
+            final=proxy,
+        ),
+        dns=DNS(servers=[DNS_SERVER_GOOGLE_HTTPS, DNS_SERVER_FAKEIP]),
+        http_clients=[HC_DEFAULT],
+        log=Log(level="info", timestamp=True),
+        experimental={"clash_api": {"external_controller": None, "secret": ""}},
+    )
+
+
+@pytest.mark.parametrize(
+    "kwargs",
+    [
+        {},
+        {"indent": 2},
+        {"indent": "\t", "ensure_ascii": False},
+        {"separators": (",", ":"), "sort_keys": True},
+    ],
+)
+def test_dumps_matches_asdict(kwargs):
+    config = make_config()
+    expected = json.dumps(asdict(config, filter=exclude_if_none), **kwargs)
+    assert dumps(config, **kwargs) == expected
+
+
+def test_dump_in_chunks():
+    config = make_config()
+    chunks = list(iterencode(config, chunk_size=64))
+    assert len(chunks) > 1
+    assert all(len(chunk) >= 64 for chunk in chunks[:-1])
+
+    fp = io.StringIO()
+    dump(config, fp, chunk_size=64, indent=2)
+    assert fp.getvalue() == json.dumps(asdict(config, filter=exclude_if_none), indent=2)
+
+
+def test_dumps_unserializable():
+    with pytest.raises(TypeError):
+        dumps(RouteRule(outbound="DIRECT", domain={"a.com"}))  # type: ignore[arg-type]
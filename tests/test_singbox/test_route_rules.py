@@ -0,0 +1,75 @@
+from __future__ import annotations
+
+from uniproxy.matcher import RuleMatcher
+from uniproxy.singbox.route_rules import RejectRule, RouteRule, coalesce_route_rules
+from uniproxy.to.singbox.uniproxy.rules import (
+    route_rules_from_uniproxy_many,
+    unify_mixed_route_rules,
+)
+from uniproxy.uniproxy.protocols import HttpProtocol
+from uniproxy.uniproxy.rules import (
+    DomainSuffixGroupRule,
+    DomainSuffixRule,
+    FinalRule,
+    GeoIPRule,
+    IPCidr6Rule,
+    IPCidrGroupRule,
+    ProcessNameRule,
+)
+
+
+def test_route_rules_from_uniproxy_many():
+    proxy = HttpProtocol(name="Proxy", server="example.com", port=8080)
+    rules = [
+        DomainSuffixRule(matcher="example.com", policy=proxy),
+        DomainSuffixGroupRule(matcher=["ads.com", "track.com"], policy="REJECT"),
+        IPCidrGroupRule(matcher=["1.0.0.0/24", "1.0.1.0/24"], policy="DIRECT"),
+        IPCidr6Rule(matcher="fc00::/7", policy="DIRECT"),
+        GeoIPRule(matcher="CN", policy="DIRECT"),
+        ProcessNameRule(matcher="curl", policy=proxy),
+        FinalRule(policy=proxy),
+    ]
+    assert route_rules_from_uniproxy_many(rules) == unify_mixed_route_rules(rules)
+
+
+def test_coalesce_route_rules():
+    rules = [
+        RouteRule(domain_suffix="a.com", outbound="proxy"),
+        RouteRule(domain=["b.com"], domain_suffix=["a.com", "c.com"], outbound="proxy"),
+        RouteRule(ip_cidr=["10.0.0.0/8"], outbound="proxy"),
+        # ANDed with the port, ends the run
+        RouteRule(domain=["d.com"], port=[443], outbound="proxy"),
+        RouteRule(port=[80], outbound="proxy"),
+        RouteRule(port_range=["8000:8999"], outbound="proxy"),
+        RouteRule(port=[22], outbound="direct"),
+        RejectRule(domain_suffix=["ads.com"]),
+        RejectRule(domain_suffix=["track.com"]),
+        RejectRule(domain_suffix=["drop.com"], method="drop"),
+    ]
+    out = coalesce_route_rules(rules)
+    assert out == [
+        RouteRule(
+            domain_suffix=["a.com", "c.com"],
+            domain=["b.com"],
+            ip_cidr=["10.0.0.0/8"],
+            outbound="proxy",
+        ),
+        rules[3],
+        RouteRule(port=[80], port_range=["8000:8999"], outbound="proxy"),
+        rules[6],
+        RejectRule(domain_suffix=["ads.com", "track.com"]),
+        rules[9],
+    ]
+
+    before = RuleMatcher.from_singbox(rules, final="final")
+    after = RuleMatcher.from_singbox(out, final="final")
+    for domain, port in [
+        ("x.a.com", None),
+        ("b.com", 22),
+        ("d.com", 443),
+        ("d.com", 8080),
+        ("www.track.com", None),
+        ("drop.com", 80),
+    ]:
+        expected, got = before.match(domain, port=port), after.match(domain, port=port)
+        assert expected and got and expected.policy == got.policy
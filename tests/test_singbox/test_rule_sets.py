@@ -0,0 +1,99 @@
+from __future__ import annotations
+
+import json
+
+import pytest
+
+from uniproxy.singbox.route import LocalRuleSet
+from uniproxy.singbox.route_rules import RejectRule, RouteRule
+from uniproxy.singbox.rule_sets import (
+    compile_rule_sets,
+    compile_uniproxy_rule_sets,
+    dumps_binary_rule_set,
+    load_rule_set,
+    loads_binary_rule_set,
+)
+from uniproxy.uniproxy.rules import DomainSuffixGroupRule, DomainSuffixRule
+
+
+def test_binary_rule_set_round_trip():
+    rules = [
+        {
+            "domain": ["exact.example.org", "a.example.com"],
+            "domain_suffix": ["example.com", ".sub.example.net"],
+            "domain_keyword": ["tracker"],
+            "domain_regex": [r"^ads\d+\."],
+            "port": [80, 443],
+            "port_range": ["8000:8999"],
+        },
+        {
+            "ip_cidr": ["10.0.0.0/24", "10.0.1.0/24", "10.0.3.0/24", "2001:db8::/32"],
+            "process_name": ["curl"],
+        },
+    ]
+    data = dumps_binary_rule_set(rules)
+    assert data[:4] == b"SRS\x01"
+    first, second = loads_binary_rule_set(data)
+
+    # "a.example.com" is part of the suffix, but kept as written
+    assert sorted(first.pop("domain")) == ["a.example.com", "exact.example.org"]
+    assert sorted(first.pop("domain_suffix")) == [".sub.example.net", "example.com"]
+    assert first == {
+        "domain_keyword": ["tracker"],
+        "domain_regex": [r"^ads\d+\."],
+        "port": [80, 443],
+        "port_range": ["8000:8999"],
+    }
+    # adjacent networks are merged
+    assert second == {
+        "ip_cidr": ["10.0.0.0/23", "10.0.3.0/24", "2001:db8::/32"],
+        "process_name": ["curl"],
+    }
+
+    with pytest.raises(ValueError):
+        dumps_binary_rule_set([{"inbound": ["tun-in"]}])
+
+
+def test_compile_rule_sets(tmp_path):
+    domains = [f"site{i}.com" for i in range(5)]
+    rules = [
+        RouteRule(domain_suffix=domains, outbound="proxy"),
+        RouteRule(domain_suffix=["small.com"], outbound="proxy"),
+        RejectRule(ip_cidr=[f"10.{i}.0.0/16" for i in range(5)], method="drop"),
+        RouteRule(domain=domains, inbound=["tun-in"], outbound="direct"),
+    ]
+    out, rule_sets = compile_rule_sets(rules, tmp_path, threshold=5)
+    assert out == [
+        RouteRule(rule_set=["rs-inline-0"], outbound="proxy"),
+        rules[1],
+        RejectRule(rule_set=["rs-inline-1"], method="drop"),
+        rules[3],
+    ]
+    assert rule_sets == [
+        LocalRuleSet(
+            tag="rs-inline-0", format="binary", path=str(tmp_path / "rs-inline-0.srs")
+        ),
+        LocalRuleSet(
+            tag="rs-inline-1", format="binary", path=str(tmp_path / "rs-inline-1.srs")
+        ),
+    ]
+    assert sorted(load_rule_set(rule_sets[0].path)[0]["domain_suffix"]) == domains
+    assert load_rule_set(rule_sets[1].path) == [
+        {"ip_cidr": ["10.0.0.0/14", "10.4.0.0/16"]}
+    ]
+
+
+def test_compile_uniproxy_rule_sets(tmp_path):
+    rules = [
+        DomainSuffixRule(matcher="a.com", policy="Proxy"),
+        DomainSuffixGroupRule(matcher=["b.com", "c.com"], policy="Proxy"),
+    ]
+    out, (rule_set,) = compile_uniproxy_rule_sets(
+        rules, tmp_path, threshold=3, format="source"
+    )
+    assert out == [RouteRule(rule_set=["rs-inline-0"], outbound="Proxy")]
+    assert json.loads((tmp_path / "rs-inline-0.json").read_text()) == {
+        "version": 1,
+        "rules": [{"domain_suffix": ["a.com", "b.com", "c.com"]}],
+    }
+    assert rule_set.format == "source"
@@ -14,3 +14,75 @@ def test_ip_rules_with_no_resolve():
 
         assert isinstance(rule, IPCidrRule)
         assert rule.no_resolve == uniproxy_rule.no_resolve
+
+
+def test_make_rules_from_uniproxy_many():
+    from uniproxy.surge.rules import make_rules_from_uniproxy_many
+    from uniproxy.uniproxy.protocols import HttpProtocol
+    from uniproxy.uniproxy.rules import (
+        DomainSuffixGroupRule,
+        DomainSuffixRule,
+        FinalRule,
+        IPCidr6GroupRule,
+        ProcessNameRule,
+    )
+
+    proxy = HttpProtocol(name="Proxy", server="example.com", port=8080)
+    rules = [
+        DomainSuffixRule(matcher="example.com", policy=proxy),
+        DomainSuffixGroupRule(matcher=["a.com", "b.com"], policy="DIRECT"),
+        UniproxyIPCidrRule(matcher="10.0.0.0/8", policy=proxy, no_resolve=True),
+        IPCidr6GroupRule(matcher=["fc00::/7"], policy="DIRECT", no_resolve=False),
+        ProcessNameRule(matcher="curl", policy=proxy),
+    ]
+    expected = [each for rule in rules for each in make_rules_from_uniproxy(rule)]
+    assert make_rules_from_uniproxy_many(rules) == expected
+
+    final = make_rules_from_uniproxy_many([FinalRule(policy=proxy)])
+    assert [rule.to_tag for rule in final] == ["final.Proxy"]
+
+
+def test_make_rules_from_uniproxy_external(tmp_path):
+    from uniproxy.surge.rules import (
+        DomainRule,
+        DomainSetRule,
+        RuleSetRule,
+        make_rules_from_uniproxy_external,
+    )
+    from uniproxy.uniproxy.rules import (
+        DomainGroupRule,
+        DomainSuffixGroupRule,
+        IPCidrGroupRule,
+    )
+
+    rules = [
+        DomainGroupRule(matcher=["a.com"], policy="Proxy"),
+        DomainSuffixGroupRule(matcher=["c.com", "b.com", "c.com"], policy="Proxy"),
+        DomainSuffixGroupRule(matcher=[".sub.com", "d.com"], policy="DIRECT"),
+        IPCidrGroupRule(
+            matcher=["10.0.0.0/8", "172.16.0.0/12"], policy="DIRECT", no_resolve=True
+        ),
+    ]
+    out = make_rules_from_uniproxy_external(rules, tmp_path, threshold=2)
+    assert out == [
+        DomainRule(matcher="a.com", policy="Proxy"),
+        DomainSetRule(matcher=str(tmp_path / "inline-0.txt"), policy="Proxy"),
+        RuleSetRule(matcher=str(tmp_path / "inline-1.txt"), policy="DIRECT"),
+        RuleSetRule(
+            matcher=str(tmp_path / "inline-2.txt"), policy="DIRECT", no_resolve=True
+        ),
+    ]
+    assert (tmp_path / "inline-0.txt").read_text() == ".b.com\n.c.com\n"
+    assert (tmp_path / "inline-1.txt").read_text() == (
+        "DOMAIN-SUFFIX,.sub.com\nDOMAIN-SUFFIX,d.com\n"
+    )
+    assert (tmp_path / "inline-2.txt").read_text() == (
+        "IP-CIDR,10.0.0.0/8\nIP-CIDR,172.16.0.0/12\n"
+    )
+
+
+def test_rule_set_rule_positional():
+    from uniproxy.surge.rules import RuleSetRule
+
+    rule = RuleSetRule("LAN", "DIRECT")
+    assert (rule.matcher, rule.policy) == ("LAN", "DIRECT")
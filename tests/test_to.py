@@ -0,0 +1,102 @@
+from __future__ import annotations
+
+import pytest
+
+from uniproxy.singbox.route import LocalRuleSet
+from uniproxy.singbox.route_rules import RouteRule
+from uniproxy.singbox.rule_sets import dumps_binary_rule_set
+from uniproxy.surge.rules import (
+    DomainRule,
+    DomainSuffixRule,
+    IPCidr6Rule,
+    IPCidrRule,
+    SrcIPRule,
+)
+from uniproxy.to import ip_version, make_rules_from_singbox
+
+
+@pytest.mark.parametrize(
+    "cidr, version",
+    [
+        ("1.2.3.4", 4),
+        ("10.0.0.0/8", 4),
+        ("::1", 6),
+        ("2001:db8::/32", 6),
+        ("fe80::1:2/64", 6),
+        ("::ffff:1.2.3.4/128", 6),
+    ],
+)
+def test_ip_version(cidr, version):
+    assert ip_version(cidr) == version
+
+
+@pytest.mark.parametrize("cidr", ["1x2.3.4", "1.2.3.4/33", "::1/129", "example.com"])
+def test_ip_version_invalid(cidr):
+    with pytest.raises(ValueError):
+        ip_version(cidr)
+
+
+def test_make_rules_from_singbox():
+    rule = RouteRule(
+        outbound="Proxy", domain="a.com", ip_cidr=["10.0.0.0/8", "2001:db8::/32"]
+    )
+    assert make_rules_from_singbox(rule) == [
+        DomainRule(matcher="a.com", policy="Proxy"),
+        IPCidrRule(matcher="10.0.0.0/8", policy="Proxy"),
+        IPCidr6Rule(matcher="2001:db8::/32", policy="Proxy"),
+    ]
+    rule = RouteRule(outbound="Proxy", source_ip_cidr=["192.168.0.0/16"])
+    assert make_rules_from_singbox(rule) == [
+        SrcIPRule(matcher="192.168.0.0/16", policy="Proxy")
+    ]
+
+
+@pytest.mark.parametrize(
+    "rule",
+    [
+        RouteRule(outbound="Proxy", domain="a.com", network="udp"),
+        RouteRule(outbound="Proxy", port_range="1000:2000"),
+        # ANDed, would send all port 443 traffic to the policy
+        RouteRule(outbound="Proxy", domain="a.com", port=443),
+    ],
+)
+def test_make_rules_from_singbox_unsupported(rule):
+    with pytest.raises(ValueError):
+        make_rules_from_singbox(rule)
+
+
+def test_make_rules_from_singbox_rule_set(tmp_path):
+    path = tmp_path / "geosite.srs"
+    path.write_bytes(
+        dumps_binary_rule_set([
+            {"domain_suffix": ["b.com"]},
+            {"ip_cidr": ["1.1.1.0/24"]},
+        ])
+    )
+    rule = RouteRule(outbound="Proxy", domain="a.com", rule_set="geosite")
+    rule_sets = {
+        "geosite": LocalRuleSet(tag="geosite", format="binary", path=str(path))
+    }
+    assert make_rules_from_singbox(rule, rule_sets) == [
+        DomainRule(matcher="a.com", policy="Proxy"),
+        DomainSuffixRule(matcher="b.com", policy="Proxy"),
+        IPCidrRule(matcher="1.1.1.0/24", policy="Proxy"),
+    ]
+    with pytest.raises(ValueError, match="Unknown rule_set"):
+        make_rules_from_singbox(rule)
+
+
+@pytest.mark.parametrize(
+    "headless",
+    [
+        {"network": ["udp"], "port_range": ["1000:2000"], "domain_regex": [r"^ads\."]},
+        {"source_port_range": ["1000:2000"]},
+        {"port": [443], "domain": ["x.com"]},
+    ],
+)
+def test_make_rules_from_singbox_rule_set_unsupported(tmp_path, headless):
+    path = tmp_path / "rules.srs"
+    path.write_bytes(dumps_binary_rule_set([headless]))
+    rule = RouteRule(outbound="Proxy", rule_set="rules")
+    with pytest.raises(ValueError):
+        make_rules_from_singbox(rule, {"rules": path})